@@ -1,58 +1,1067 @@
 import os
+import signal
+import sys
 import json
+import time
+import queue
+import socket
+import base64
+import http.client
+import xml.etree.ElementTree as ET
+import selectors
+import tracemalloc
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import socketserver
 import threading
 
+# Event stream tuning: replay buffer length, keepalive interval (s), and how
+# many bytes a slow subscriber may fall behind before it is dropped
+EVENT_REPLAY_SIZE = int(os.getenv('EVENT_REPLAY_SIZE', '1024'))
+EVENT_HEARTBEAT_INTERVAL = float(os.getenv('EVENT_HEARTBEAT_INTERVAL', '15'))
+EVENT_MAX_BUFFERED = int(os.getenv('EVENT_MAX_BUFFERED', '262144'))
+# Sensor alarm thresholds, e.g. "battery_voltage<11.5,water>0,dust>50", and how
+# often (s) readings are polled over the control connection (0 = never)
+SENSOR_THRESHOLDS = os.getenv('SENSOR_THRESHOLDS', 'battery_voltage<11.5,water>0,dust>50')
+SENSOR_POLL_INTERVAL = float(os.getenv('SENSOR_POLL_INTERVAL', '5'))
+# Zone table size, and how many consecutive zones belong to each subsystem
+ZONE_COUNT = int(os.getenv('ZONE_COUNT', '256'))
+ZONE_SUBSYSTEM_SIZE = int(os.getenv('ZONE_SUBSYSTEM_SIZE', '64'))
+ZONE_STATUSES = ("ok", "alarm", "fault")
+# Command queue: operations per device exchange, and how long a caller waits (s)
+COMMAND_PIPELINE_DEPTH = int(os.getenv('COMMAND_PIPELINE_DEPTH', '32'))
+COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '10'))
+
+
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def parse_thresholds(spec):
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        op = '<' if '<' in item else '>'
+        name, limit = item.split(op, 1)
+        thresholds[name.strip()] = (op, float(limit))
+    return thresholds
+
+
+class EventHub:
+    """
+    Server-sent events fan-out. Every event is encoded once and appended to
+    each subscriber's pending buffer; a single selector thread writes the
+    buffers out with non-blocking sends, so idle or slow subscribers never
+    hold a thread. Subscribers further than max_buffered bytes behind are
+    dropped and can resume with Last-Event-ID from the replay buffer.
+    """
+
+    def __init__(self, replay_size=EVENT_REPLAY_SIZE, heartbeat=EVENT_HEARTBEAT_INTERVAL,
+                 max_buffered=EVENT_MAX_BUFFERED):
+        self.heartbeat = heartbeat
+        self.max_buffered = max_buffered
+        self._replay = deque()
+        self._replay_size = replay_size
+        self._evicted = 0  # newest event id no longer in the replay buffer
+        self._pending = {}
+        self._dirty = set()
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @staticmethod
+    def encode(event_id, event_type, data):
+        return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+    def publish(self, seq, event_id, event_type, data):
+        # seq orders the replay buffer; event_id is what clients see and send back
+        payload = self.encode(event_id, event_type, data)
+        with self._lock:
+            if len(self._replay) == self._replay_size:
+                self._evicted = self._replay.popleft()[0]
+            self._replay.append((seq, event_id, payload))
+            for sock, buf in self._pending.items():
+                buf += payload
+                self._dirty.add(sock)
+        self._wake()
+
+    def since(self, last_id, current_id):
+        """Encoded events after last_id, or None when the replay buffer no longer covers it."""
+        with self._lock:
+            if last_id is None or last_id > current_id or last_id < self._evicted:
+                return None
+            return [payload for seq, _, payload in self._replay if seq > last_id]
+
+    def subscribe(self, sock, backlog):
+        sock.setblocking(False)
+        with self._lock:
+            self._pending[sock] = bytearray(backlog)
+            self._dirty.add(sock)
+            self._selector.register(sock, selectors.EVENT_READ)
+        self._wake()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._pending),
+                "replay": len(self._replay),
+                "last_event_id": self._replay[-1][1] if self._replay else None,
+                "dropped": self._dropped,
+            }
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+    def _drop(self, sock):
+        self._pending.pop(sock, None)
+        self._dirty.discard(sock)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def _flush(self, sock):
+        buf = self._pending.get(sock)
+        if buf is None:
+            return
+        try:
+            sent = sock.send(buf) if buf else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(sock)
+            return
+        del buf[:sent]
+        if len(buf) > self.max_buffered:
+            self._dropped += 1
+            self._drop(sock)
+            return
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if buf else 0)
+        if self._selector.get_key(sock).events != mask:
+            self._selector.modify(sock, mask)
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while True:
+            ready = self._selector.select(max(next_heartbeat - time.monotonic(), 0))
+            with self._lock:
+                for key, mask in ready:
+                    sock = key.fileobj
+                    if sock is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    if sock not in self._pending:
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        # Subscribers never send anything; readable means closed
+                        try:
+                            closed = not sock.recv(4096)
+                        except BlockingIOError:
+                            closed = False
+                        except OSError:
+                            closed = True
+                        if closed:
+                            self._drop(sock)
+                            continue
+                    if mask & selectors.EVENT_WRITE:
+                        self._dirty.add(sock)
+                if time.monotonic() >= next_heartbeat:
+                    next_heartbeat = time.monotonic() + self.heartbeat
+                    for sock, buf in self._pending.items():
+                        buf += b": keepalive\n\n"
+                        self._dirty.add(sock)
+                dirty, self._dirty = self._dirty, set()
+                for sock in dirty:
+                    self._flush(sock)
+
+
+event_hub = EventHub()
+
+
+class ZoneTable:
+    """
+    Zones 1..count in flat arrays (a status code byte and a subsystem number
+    per zone) plus int bitsets, bit i for zone i + 1, of bypassed, alarmed
+    and faulted zones. Filters are mask ANDs and the summary counters are
+    maintained on every change, so neither walks the table.
+    """
+
+    def __init__(self, count=ZONE_COUNT, subsystem_size=ZONE_SUBSYSTEM_SIZE):
+        self.count = count
+        self.status = array('B', bytes(count))
+        self.subsystem = array('H', (i // subsystem_size + 1 for i in range(count)))
+        self.bypassed = 0
+        self.alarmed = 0
+        self.faulted = 0
+        self.counts = {"bypassed": 0, "alarm": 0, "fault": 0}
+        self._all = (1 << count) - 1
+        self._subsystem_masks = {}
+        for i, subsystem in enumerate(self.subsystem):
+            self._subsystem_masks[subsystem] = self._subsystem_masks.get(subsystem, 0) | (1 << i)
+
+    def index(self, zone_id):
+        # Zone ids arrive as JSON numbers or numeric strings; None when out of range
+        try:
+            zone = int(zone_id)
+        except (TypeError, ValueError):
+            return None
+        return zone - 1 if 1 <= zone <= self.count else None
+
+    def is_bypassed(self, index):
+        return bool(self.bypassed >> index & 1)
+
+    def set_bypassed(self, index, flag):
+        bit = 1 << index
+        if bool(self.bypassed & bit) == flag:
+            return False
+        self.bypassed ^= bit
+        self.counts["bypassed"] += 1 if flag else -1
+        return True
+
+    def set_status(self, index, code):
+        old = self.status[index]
+        if old == code:
+            return False
+        bit = 1 << index
+        for value, name in ((1, "alarm"), (2, "fault")):
+            if old == value:
+                self.counts[name] -= 1
+            elif code == value:
+                self.counts[name] += 1
+        self.alarmed = self.alarmed | bit if code == 1 else self.alarmed & ~bit
+        self.faulted = self.faulted | bit if code == 2 else self.faulted & ~bit
+        self.status[index] = code
+        return True
+
+    def summary(self):
+        counts = self.counts
+        return {
+            "total": self.count,
+            "ok": self.count - counts["alarm"] - counts["fault"],
+            "alarm": counts["alarm"],
+            "fault": counts["fault"],
+            "bypassed": counts["bypassed"],
+        }
+
+    def mask(self, status=None, subsystem=None):
+        if status is None:
+            mask = self._all
+        elif status == "bypassed":
+            mask = self.bypassed
+        elif status == "alarm":
+            mask = self.alarmed
+        elif status == "fault":
+            mask = self.faulted
+        else:
+            mask = self._all & ~(self.alarmed | self.faulted)
+        if subsystem is not None:
+            mask &= self._subsystem_masks.get(subsystem, 0)
+        return mask
+
+    def row(self, index):
+        return {
+            "zone": index + 1,
+            "status": ZONE_STATUSES[self.status[index]],
+            "bypassed": self.is_bypassed(index),
+            "subsystem": self.subsystem[index],
+        }
+
+    def query(self, status=None, subsystem=None, after=0, limit=100):
+        """Zones matching the filters with id > after; returns (rows, matched, next_after)."""
+        mask = self.mask(status, subsystem)
+        matched = mask.bit_count()
+        mask = mask >> after << after
+        rows = []
+        while mask and len(rows) < limit:
+            low = mask & -mask
+            rows.append(self.row(low.bit_length() - 1))
+            mask ^= low
+        return rows, matched, rows[-1]["zone"] if mask and rows else None
+
+
+class DeviceLink:
+    """
+    Persistent control connection speaking JSON lines: one operation per
+    line, one reply per line. Batches go out as a single {"batch": [...]}
+    exchange when the device supports it, otherwise as pipelined lines
+    written together and answered in order.
+    """
+
+    def __init__(self, host, port, timeout=5.0, batch_supported=True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.batch_supported = batch_supported
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = self._reader = None
+
+    def _reply(self, call):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Device closed the control connection")
+        call["received"] += len(line)
+        return json.loads(line)
+
+    def exchange(self, operations):
+        with self._lock, metrics.device_call("link_exchange") as call:
+            if self._sock is None:
+                self._connect()
+            try:
+                if self.batch_supported and len(operations) > 1:
+                    request = json.dumps({"batch": operations}).encode('utf-8') + b'\n'
+                    self._sock.sendall(request)
+                    call["sent"] = len(request)
+                    reply = self._reply(call)
+                    results = reply.get("results") if isinstance(reply, dict) else None
+                    if not isinstance(results, list):
+                        raise ValueError("Batch reply has no results list")
+                    return results
+                request = b''.join(json.dumps(op).encode('utf-8') + b'\n' for op in operations)
+                self._sock.sendall(request)
+                call["sent"] = len(request)
+                return [self._reply(call) for _ in operations]
+            except (OSError, ValueError, KeyError) as e:
+                # Recorded as what actually failed, so timeouts stay distinguishable
+                call["error"] = e
+                self.close()
+                raise ConnectionError("Device control exchange failed")
+
+# Alert stream event types that report a zone condition while "active"
+ZONE_ALERT_TYPES = {"IO": "alarm", "zoneAlarm": "alarm", "alarmInput": "alarm", "zoneFault": "fault", "fault": "fault"}
+ZONE_ALERT_FIELDS = ("zoneNo", "zoneID", "inputIOPortID")
+
+
+class MultipartAlertParser:
+    """
+    Incremental multipart/mixed parser over one fixed-size buffer. Callers
+    recv_into() free() and report the byte count to written(); complete parts
+    are handed to on_part(content_type, body) as memoryviews into the buffer,
+    valid only during the call. Parts bigger than the buffer are skipped.
+    """
+
+    def __init__(self, boundary, on_part, buffer_size=65536):
+        self.delimiter = b'--' + boundary
+        self.on_part = on_part
+        self.buf = bytearray(buffer_size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self._skip = 0  # body bytes of an oversized part still to discard
+        self.closed = False
+        self.parts = 0
+        self.oversized = 0
+
+    def free(self):
+        if self.start and (self.end == len(self.buf) or self.start > len(self.buf) // 2):
+            remaining = self.end - self.start
+            self.buf[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+        return self.view[self.end:]
+
+    def written(self, count):
+        self.end += count
+        self._parse()
+
+    def feed(self, data):
+        # Convenience for callers holding bytes rather than a socket
+        data = memoryview(data)
+        while data:
+            target = self.free()
+            count = min(len(target), len(data))
+            target[:count] = data[:count]
+            data = data[count:]
+            self.written(count)
+
+    def _oversized(self, resume):
+        self.oversized += 1
+        self.start = resume
+
+    def _parse(self):
+        buf, delimiter = self.buf, self.delimiter
+        while not self.closed:
+            if self._skip:
+                dropped = min(self._skip, self.end - self.start)
+                self.start += dropped
+                self._skip -= dropped
+                if self._skip:
+                    return
+            i = buf.find(delimiter, self.start, self.end)
+            # A part is oversized only once it fills the compacted buffer (i == 0)
+            if i < 0:
+                # Keep only what could be the start of a delimiter
+                self.start = max(self.start, self.end - len(delimiter) - 2)
+                return
+            after = i + len(delimiter)
+            if self.end - after < 2:
+                self.start = i
+                return
+            if buf[after:after + 2] == b'--':
+                self.closed = True
+                return
+            header_end = buf.find(b'\r\n\r\n', after, self.end)
+            if header_end < 0:
+                if i == 0 and self.end == len(buf):
+                    self._oversized(after)
+                    continue
+                self.start = i
+                return
+            content_type, content_length = None, None
+            for line in bytes(self.view[after:header_end]).split(b'\r\n'):
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name == b'content-type':
+                    content_type = value.strip().decode('latin-1')
+                elif name == b'content-length':
+                    content_length = int(value)
+            body_start = header_end + 4
+            if content_length is not None:
+                if body_start - i + content_length > len(buf):
+                    self._oversized(body_start)
+                    self._skip = content_length
+                    continue
+                if self.end - body_start < content_length:
+                    self.start = i
+                    return
+                body_end = body_start + content_length
+                next_start = body_end
+            else:
+                body_end = buf.find(b'\r\n' + delimiter, body_start, self.end)
+                if body_end < 0:
+                    if i == 0 and self.end == len(buf):
+                        self._oversized(body_start)
+                        continue
+                    self.start = i
+                    return
+                next_start = body_end + 2
+            self.parts += 1
+            self.on_part(content_type, self.view[body_start:body_end])
+            self.start = next_start
+
+
+def decode_alert(content_type, body):
+    """Normalize an XML or JSON alert body to {"type", "state", "zone"}."""
+    if content_type and 'json' in content_type or body[:1] in (b'{', b'['):
+        fields = json.loads(bytes(body))
+        if not isinstance(fields, dict):
+            raise ValueError("Alert JSON is not an object")
+        if len(fields) == 1 and isinstance(next(iter(fields.values())), dict):
+            fields = next(iter(fields.values()))
+    else:
+        fields = {el.tag.rsplit('}', 1)[-1]: el.text for el in ET.fromstring(bytes(body))}
+    zone = next((fields[name] for name in ZONE_ALERT_FIELDS if fields.get(name) is not None), None)
+    return {"type": fields.get("eventType"), "state": fields.get("eventState"), "zone": zone}
+
+
+class AlertStreamClient:
+    """
+    Keeps one connection to the panel's ISAPI alert stream and applies each
+    event to the device as it is parsed. Memory stays at one receive buffer
+    however long the stream runs; the connection is re-established after
+    errors, end of stream, or idle_timeout seconds without a byte (panels
+    send heartbeats, so silence means a half-open connection).
+    """
+
+    def __init__(self, device, host, port, path, username, password, buffer_size=65536, reconnect_delay=5.0,
+                 idle_timeout=60.0):
+        self.device = device
+        self.host = host
+        self.port = port
+        self.path = path
+        self.auth = base64.b64encode(f"{username}:{password}".encode('utf-8')).decode('ascii')
+        self.buffer_size = buffer_size
+        self.reconnect_delay = reconnect_delay
+        self.idle_timeout = idle_timeout
+        self.connected = False
+        self.counters = {"events": 0, "applied": 0, "ignored": 0, "malformed": 0, "oversized": 0,
+                         "bytes": 0, "connections": 0}
+        self._stop = threading.Event()
+        self._sock = None
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        # Wakes a read in progress; it then sees end of stream
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def run(self):
+        # Any failure, expected or not, ends only the current connection
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Alert stream error: {e!r}", file=sys.stderr)
+                metrics.inc("device_io_timeouts_total" if isinstance(e, TimeoutError) else "device_io_errors_total",
+                            (("operation", "alert_stream"),))
+            self._stop.wait(self.reconnect_delay)
+
+    def _on_part(self, content_type, body):
+        self.counters["events"] += 1
+        try:
+            event = decode_alert(content_type, body)
+            applied = self.device.apply_alert(event)
+        except Exception:
+            # One bad part is counted and skipped; the stream keeps going
+            self.counters["malformed"] += 1
+            return
+        if applied:
+            self.counters["applied"] += 1
+        else:
+            self.counters["ignored"] += 1
+
+    def run_once(self):
+        """Consume one connection until the panel closes it."""
+        with socket.create_connection((self.host, self.port), timeout=DEVICE_TIMEOUT) as sock:
+            self._sock = sock
+            if self._stop.is_set():
+                return
+            sock.sendall((f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Authorization: Basic {self.auth}\r\nAccept: multipart/mixed\r\n\r\n").encode('ascii'))
+            head = b''
+            while b'\r\n\r\n' not in head:
+                chunk = sock.recv(4096)
+                if not chunk or len(head) > 16384:
+                    raise ValueError("Alert stream closed before response headers")
+                head += chunk
+            head, _, rest = head.partition(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            if lines[0].split()[1:2] != ['200']:
+                raise ValueError(f"Alert stream refused: {lines[0]}")
+            headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(':') for l in lines[1:])}
+            boundary = headers.get('content-type', '').partition('boundary=')[2].strip('"')
+            if not boundary:
+                raise ValueError("Alert stream response has no multipart boundary")
+            sock.settimeout(self.idle_timeout)
+            parser = MultipartAlertParser(boundary.encode('latin-1'), self._on_part, self.buffer_size)
+            self.connected = True
+            self.counters["connections"] += 1
+            try:
+                parser.feed(rest)
+                while not parser.closed and not self._stop.is_set():
+                    count = sock.recv_into(parser.free())
+                    if not count:
+                        break
+                    self.counters["bytes"] += count
+                    metrics.inc("device_io_bytes_total", (("operation", "alert_stream"), ("direction", "received")), count)
+                    parser.written(count)
+            finally:
+                self.connected = False
+                self._sock = None
+                self.counters["oversized"] += parser.oversized
+
+    def stats(self):
+        return dict(self.counters, connected=self.connected)
+
+
+class _Command:
+    __slots__ = ("op", "key", "future", "enqueued", "merged")
+
+    def __init__(self, op, key):
+        self.op = op
+        self.key = key
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.merged = 0
+
+
+class CommandQueue:
+    """
+    Serializes all commands for one device through a single dispatcher
+    thread. Queued operations are sent in order, up to `depth` per device
+    exchange (one batch or one pipelined write), and an operation identical
+    to the latest still-queued one for the same target is merged into it so
+    both callers share one result.
+    """
+
+    def __init__(self, dispatch, depth=COMMAND_PIPELINE_DEPTH, latency_samples=1024):
+        self._dispatch = dispatch
+        self.depth = depth
+        self._queue = deque()
+        self._latest = {}
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=latency_samples)
+        self._counters = {"submitted": 0, "merged": 0, "dispatched": 0, "exchanges": 0, "failed": 0}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, op, key):
+        """Queue one operation; returns a Future resolving to its result dict."""
+        with self._cond:
+            self._counters["submitted"] += 1
+            latest = self._latest.get(key)
+            if latest is not None and latest.op == op:
+                latest.merged += 1
+                self._counters["merged"] += 1
+                return latest.future
+            command = _Command(op, key)
+            self._queue.append(command)
+            self._latest[key] = command
+            self._cond.notify()
+            return command.future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch = [self._queue.popleft() for _ in range(min(self.depth, len(self._queue)))]
+                for command in batch:
+                    if self._latest.get(command.key) is command:
+                        del self._latest[command.key]
+                self._in_flight = len(batch)
+            try:
+                results = self._dispatch([command.op for command in batch])
+            except Exception as e:
+                for command in batch:
+                    command.future.set_exception(e)
+                failed = len(batch)
+            else:
+                for command, result in zip(batch, results):
+                    command.future.set_result(result)
+                failed = 0
+            done = time.monotonic()
+            with self._cond:
+                self._in_flight = 0
+                self._counters["dispatched"] += len(batch)
+                self._counters["exchanges"] += 1
+                self._counters["failed"] += failed
+                self._latencies.extend(done - command.enqueued for command in batch)
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            stats = dict(self._counters, queued=len(self._queue), in_flight=self._in_flight, depth=self.depth)
+        if latencies:
+            def pick(q):
+                return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 3)
+            stats["latency_ms"] = {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": pick(1.0)}
+        return stats
+
+
 # Mock device "SDK" - Replace with actual SDK calls or binary protocol handling as needed.
 class HikvisionAlarmHostDevice:
-    def __init__(self, ip, port, username, password):
+    def __init__(self, ip, port, username, password, link=None, zone_count=ZONE_COUNT,
+                 zone_subsystem_size=ZONE_SUBSYSTEM_SIZE):
         self.ip = ip
         self.port = port
         self.username = username
         self.password = password
         self.fake_status = {
             "alarm_state": "normal",
-            "zones": [{"zone": 1, "status": "ok"}, {"zone": 2, "status": "bypassed"}],
             "sensors": {"battery_voltage": 12.3, "water": 0, "dust": 1},
         }
         self.armed_subsystems = set()
-        self.bypassed_zones = set()
+        self.zones = ZoneTable(zone_count, zone_subsystem_size)
         self.active_alarms = False
+        # Bumped on every state change; the encoded status is cached per version.
+        # The boot stamp keeps ETags and event ids from colliding across restarts.
+        self.version = 0
+        self._boot = "%x" % int(time.time() * 1000)
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self.sensor_thresholds = parse_thresholds(SENSOR_THRESHOLDS)
+        self._sensor_alarms = set()
+        # Optional control connection; without it commands only update the mock state.
+        # Every command goes through the queue, so only its thread talks to the device.
+        self.link = link
+        self.commands = CommandQueue(self._dispatch)
 
     def get_status(self):
         # In a real implementation, query the device via SDK/network protocol
-        return self.fake_status
+        with self._lock:
+            status = dict(self.fake_status)
+            status["active_alarms"] = self.active_alarms
+            status["armed_subsystems"] = sorted(self.armed_subsystems, key=str)
+            status["zones"] = self.zones.summary()
+            return status
+
+    def get_status_snapshot(self):
+        """Return (etag, body) for the current version, encoding only once per version."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot[0] != self.version:
+                etag = f'"{self._boot}-{self.version}"'
+                body = json.dumps(self.get_status()).encode('utf-8')
+                snapshot = self._snapshot = (self.version, etag, body)
+            return snapshot[1], snapshot[2]
+
+    def _event_id(self, version):
+        return f"{self._boot}-{version}"
+
+    def _changed(self, event_type=None, data=None):
+        # Called with the lock held; the event id is the boot stamp and the new version
+        self.version += 1
+        if event_type:
+            event_hub.publish(self.version, self._event_id(self.version), event_type, data)
+
+    def _set_alarm(self, active, source):
+        if self.active_alarms != active:
+            self.active_alarms = active
+            self.fake_status["alarm_state"] = "alarm" if active else "normal"
+            self._changed("alarm", {"active_alarms": active,
+                                    "alarm_state": self.fake_status["alarm_state"], "source": source})
+
+    def subscribe_events(self, sock, last_event_id=None):
+        """Attach an SSE socket; replays from last_event_id or starts with a full snapshot."""
+        # Ids from an earlier run carry another boot stamp and get the snapshot
+        boot, _, version = (last_event_id or "").rpartition("-")
+        last_version = int(version) if boot == self._boot and version.isdigit() else None
+        with self._lock:
+            backlog = event_hub.since(last_version, self.version)
+            if backlog is None:
+                backlog = [event_hub.encode(self._event_id(self.version), "snapshot", self.get_status())]
+            event_hub.subscribe(sock, b''.join(backlog))
+
+    def update_sensors(self, readings):
+        # Fed by poll_sensors(); every changed reading is one "sensor" event,
+        # and a reading crossing its threshold also raises the alarm
+        with self._lock:
+            sensors = self.fake_status["sensors"]
+            changed = {k: v for k, v in readings.items()
+                       if isinstance(v, (int, float)) and not isinstance(v, bool) and sensors.get(k) != v}
+            if not changed:
+                return
+            self.fake_status["sensors"] = dict(sensors, **changed)
+            for name, value in changed.items():
+                data = {"sensor": name, "value": value}
+                crossed = False
+                if name in self.sensor_thresholds:
+                    op, limit = self.sensor_thresholds[name]
+                    tripped = value < limit if op == '<' else value > limit
+                    crossed = tripped != (name in self._sensor_alarms)
+                    if tripped:
+                        self._sensor_alarms.add(name)
+                    else:
+                        self._sensor_alarms.discard(name)
+                    data.update(threshold=f"{op}{limit:g}", tripped=tripped)
+                self._changed("sensor", data)
+                if crossed and name in self._sensor_alarms:
+                    self._set_alarm(True, name)
+
+    def poll_sensors(self, timeout=COMMAND_TIMEOUT):
+        """Read the sensors over the control connection, in turn with queued commands."""
+        result = self.commands.submit({"op": "read_sensors"}, ("read_sensors",)).result(timeout)
+        if not result.get("success"):
+            raise ConnectionError(result.get("error", "Sensor read rejected by device"))
+        return result["sensors"]
+
+    def run_sensor_poller(self, interval):
+        while True:
+            try:
+                self.poll_sensors()
+            except (ConnectionError, FutureTimeout) as e:
+                print(f"Sensor poll failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+    def _validate(self, op):
+        kind = op.get("op")
+        if kind == "clear_alarm":
+            return None
+        key = {"subsystem": "subsystem_id", "zone": "zone_id"}.get(kind)
+        if key is None:
+            return "Invalid operation"
+        if not op.get(key) or not op.get("action"):
+            return f"Missing '{key}' or 'action'"
+        if kind == "zone" and self.zones.index(op[key]) is None:
+            return f"Unknown zone {op[key]}"
+        valid = ("arm", "disarm", "clear_alarm") if kind == "subsystem" else ("bypass", "unbypass")
+        if op["action"] not in valid:
+            return "Invalid action"
+        return None
+
+    def _command_key(self, op):
+        # Operations with the same key target the same device object
+        if op["op"] == "zone":
+            return ("zone", self.zones.index(op["zone_id"]))
+        if op["op"] == "subsystem":
+            return ("subsystem", str(op["subsystem_id"]))
+        return (op["op"],)
+
+    def execute(self, operations, timeout=COMMAND_TIMEOUT):
+        """
+        Queue operations for the device and wait for their results, in order;
+        invalid ones are never sent. Raises ConnectionError if the device
+        cannot be reached and TimeoutError if results take over `timeout`.
+        """
+        errors = [self._validate(op) for op in operations]
+        futures = [self.commands.submit(op, self._command_key(op)) if error is None else None
+                   for op, error in zip(operations, errors)]
+        deadline = time.monotonic() + timeout
+        results = []
+        for future, error in zip(futures, errors):
+            if future is None:
+                results.append({"success": False, "error": error})
+                continue
+            try:
+                results.append(future.result(max(deadline - time.monotonic(), 0)))
+            except FutureTimeout:
+                raise TimeoutError("Device did not answer in time; commands may still be applied")
+        return results
+
+    def _dispatch(self, operations):
+        # Runs on the command queue thread: one device exchange, then local state
+        if self.link is not None:
+            replies = self.link.exchange(operations)
+        else:
+            replies = [{"success": True}] * len(operations)
+        # A device that answers fewer operations than it was sent fails only the unanswered ones
+        replies = [reply if isinstance(reply, dict) else {"error": "Malformed reply from device"}
+                   for reply in replies[:len(operations)]]
+        replies += [{"error": "No result from device"}] * (len(operations) - len(replies))
+        with self._lock:
+            return [
+                self._apply(op, reply) if reply.get("success")
+                else {"success": False, "error": reply.get("error", "Rejected by device")}
+                for op, reply in zip(operations, replies)
+            ]
+
+    def _apply(self, op, reply):
+        # Called with the lock held after the device accepted the operation
+        if op["op"] == "read_sensors":
+            readings = reply.get("sensors")
+            if not isinstance(readings, dict):
+                return {"success": False, "error": "Device sent no sensor readings"}
+            self.update_sensors(readings)
+            return {"success": True, "sensors": dict(self.fake_status["sensors"])}
+        if op["op"] == "clear_alarm":
+            self._set_alarm(False, "clear")
+            return {"success": True, "message": "Alarms cleared."}
+        action = op["action"]
+        if op["op"] == "subsystem":
+            subsystem_id = op["subsystem_id"]
+            if action == "arm":
+                if subsystem_id not in self.armed_subsystems:
+                    self.armed_subsystems.add(subsystem_id)
+                    self._changed("subsystem", {"subsystem_id": subsystem_id, "armed": True})
+                return {"success": True, "message": f"Subsystem {subsystem_id} armed."}
+            elif action == "disarm":
+                if subsystem_id in self.armed_subsystems:
+                    self.armed_subsystems.discard(subsystem_id)
+                    self._changed("subsystem", {"subsystem_id": subsystem_id, "armed": False})
+                return {"success": True, "message": f"Subsystem {subsystem_id} disarmed."}
+            else:
+                self._set_alarm(False, f"subsystem {subsystem_id}")
+                return {"success": True, "message": f"Alarms for subsystem {subsystem_id} cleared."}
+        index = self.zones.index(op["zone_id"])
+        zone_id = index + 1
+        if self.zones.set_bypassed(index, action == "bypass"):
+            self._changed("zone", {"zone_id": zone_id, "bypassed": action == "bypass"})
+        return {"success": True, "message": f"Zone {zone_id} {action}ed."}
+
+    def update_zone(self, zone_id, status):
+        # Fed by the alert stream or a poller with "ok", "alarm" or "fault"
+        with self._lock:
+            index = self.zones.index(zone_id)
+            if index is None or not self.zones.set_status(index, ZONE_STATUSES.index(status)):
+                return False
+            self._changed("zone", {"zone_id": index + 1, "status": status})
+            if status == "alarm":
+                self._set_alarm(True, f"zone {index + 1}")
+            return True
+
+    def apply_alert(self, event):
+        """Apply one decoded alert stream event; False when it changes nothing we track."""
+        kind, state = event.get("type"), event.get("state")
+        if kind in ZONE_ALERT_TYPES and event.get("zone") is not None:
+            return self.update_zone(event["zone"], ZONE_ALERT_TYPES[kind] if state == "active" else "ok")
+        if kind == "alarm" and state == "active":
+            with self._lock:
+                alarmed = not self.active_alarms
+                self._set_alarm(True, "alert stream")
+                return alarmed
+        return False
+
+    def query_zones(self, status=None, subsystem=None, after=0, limit=100):
+        with self._lock:
+            return self.zones.query(status, subsystem, after, limit)
 
     def clear_alarm(self):
-        # In a real implementation, send a clear alarm command to the device
-        self.active_alarms = False
-        return {"success": True, "message": "Alarms cleared."}
+        return self.execute([{"op": "clear_alarm"}])[0]
 
     def manage_subsystem(self, subsystem_id, action):
-        # In a real implementation, send arm/disarm/clear command to the device
-        if action == "arm":
-            self.armed_subsystems.add(subsystem_id)
-            return {"success": True, "message": f"Subsystem {subsystem_id} armed."}
-        elif action == "disarm":
-            self.armed_subsystems.discard(subsystem_id)
-            return {"success": True, "message": f"Subsystem {subsystem_id} disarmed."}
-        elif action == "clear_alarm":
-            self.active_alarms = False
-            return {"success": True, "message": f"Alarms for subsystem {subsystem_id} cleared."}
-        else:
-            return {"success": False, "error": "Invalid action"}
+        return self.execute([{"op": "subsystem", "subsystem_id": subsystem_id, "action": action}])[0]
 
     def bypass_zone(self, zone_id, action):
-        # In a real implementation, send bypass/unbypass command to the device
-        if action == "bypass":
-            self.bypassed_zones.add(zone_id)
-            return {"success": True, "message": f"Zone {zone_id} bypassed."}
-        elif action == "unbypass":
-            self.bypassed_zones.discard(zone_id)
-            return {"success": True, "message": f"Zone {zone_id} unbypassed."}
-        else:
-            return {"success": False, "error": "Invalid action"}
+        return self.execute([{"op": "zone", "zone_id": zone_id, "action": action}])[0]
 
 # Environment variable configuration
 DEVICE_IP = os.getenv('DEVICE_IP', '192.168.1.64')
@@ -61,17 +1070,108 @@ DEVICE_USERNAME = os.getenv('DEVICE_USERNAME', 'admin')
 DEVICE_PASSWORD = os.getenv('DEVICE_PASSWORD', '12345')
 SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
 SERVER_PORT = int(os.getenv('SERVER_PORT', '8080'))
+# Worker pool: threads, connections allowed to wait for a worker before
+# shedding with 503, Retry-After seconds, and per-connection idle timeout
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '16'))
+SERVER_QUEUE_SIZE = int(os.getenv('SERVER_QUEUE_SIZE', '64'))
+SERVER_RETRY_AFTER = int(os.getenv('SERVER_RETRY_AFTER', '1'))
+SERVER_IDLE_TIMEOUT = float(os.getenv('SERVER_IDLE_TIMEOUT', '10'))
+# Requests served on one keep-alive connection before it is closed
+SERVER_KEEPALIVE_MAX_REQUESTS = int(os.getenv('SERVER_KEEPALIVE_MAX_REQUESTS', '1000'))
+# Keep-alive connections allowed to sit idle on a worker between requests;
+# past that (or while connections are queued) responses close the connection
+SERVER_KEEPALIVE_IDLE = int(os.getenv('SERVER_KEEPALIVE_IDLE', '8'))
+# One process owns the panel: the command queue sends one operation at a time,
+# and the zone table, event hub and alert stream hold the only copy of its
+# state, so prefork (SERVER_PROCESSES > 1) is refused. SO_REUSEPORT lets a
+# replacement bind the port while this process drains, for up to
+# SERVER_DRAIN_TIMEOUT seconds of queued and in-flight requests.
+SERVER_PROCESSES = int(os.getenv('SERVER_PROCESSES', '1'))
+SERVER_REUSE_PORT = os.getenv('SERVER_REUSE_PORT', '0') == '1'
+SERVER_DRAIN_TIMEOUT = float(os.getenv('SERVER_DRAIN_TIMEOUT', '15'))
+# Control connection for commands (0 = mock only), and whether it accepts batches
+DEVICE_CONTROL_PORT = int(os.getenv('DEVICE_CONTROL_PORT', '0'))
+DEVICE_BATCH_SUPPORTED = os.getenv('DEVICE_BATCH_SUPPORTED', '1') == '1'
+DEVICE_TIMEOUT = float(os.getenv('DEVICE_TIMEOUT', '5'))
+BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS', '1000'))
+# ISAPI alert stream (0 = disabled; panels usually serve it on HTTP port 80)
+ALERT_STREAM_PORT = int(os.getenv('ALERT_STREAM_PORT', '0'))
+ALERT_STREAM_PATH = os.getenv('ALERT_STREAM_PATH', '/ISAPI/Event/notification/alertStream')
+ALERT_STREAM_BUFFER_SIZE = int(os.getenv('ALERT_STREAM_BUFFER_SIZE', '65536'))
+ALERT_STREAM_RECONNECT_DELAY = float(os.getenv('ALERT_STREAM_RECONNECT_DELAY', '5'))
+# Seconds without a byte (heartbeats included) before the stream is treated as dead
+ALERT_STREAM_IDLE_TIMEOUT = float(os.getenv('ALERT_STREAM_IDLE_TIMEOUT', '60'))
 
 device = HikvisionAlarmHostDevice(
     ip=DEVICE_IP,
     port=DEVICE_PORT,
     username=DEVICE_USERNAME,
-    password=DEVICE_PASSWORD
+    password=DEVICE_PASSWORD,
+    link=DeviceLink(DEVICE_IP, DEVICE_CONTROL_PORT, DEVICE_TIMEOUT, DEVICE_BATCH_SUPPORTED) if DEVICE_CONTROL_PORT else None
 )
 
+alert_stream = AlertStreamClient(
+    device, DEVICE_IP, ALERT_STREAM_PORT, ALERT_STREAM_PATH, DEVICE_USERNAME, DEVICE_PASSWORD,
+    ALERT_STREAM_BUFFER_SIZE, ALERT_STREAM_RECONNECT_DELAY, ALERT_STREAM_IDLE_TIMEOUT
+) if ALERT_STREAM_PORT else None
+
 class AlarmHostHTTPRequestHandler(BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
 
+    def handle(self):
+        self.requests_served = 0
+        self.idle_held = False
+        try:
+            super().handle()
+        finally:
+            self._release_idle()
+
+    def _release_idle(self):
+        if self.idle_held:
+            self.idle_held = False
+            self.server.release_idle()
+
+    def end_headers(self):
+        # Persistent connections are recycled after SERVER_KEEPALIVE_MAX_REQUESTS, and
+        # only kept open while the server has an idle keep-alive slot to spare
+        self.requests_served += 1
+        if not self.close_connection and not self.idle_held:
+            if self.requests_served >= SERVER_KEEPALIVE_MAX_REQUESTS or not self.server.hold_idle():
+                self.send_header('Connection', 'close')
+            else:
+                self.idle_held = True
+        super().end_headers()
+
+    def parse_request(self):
+        # The request line is in: time from here, not from the keep-alive wait before it
+        self._release_idle()
+        self.started = metrics.request_started()
+        self.status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                # Unknown paths share one label so scanners cannot inflate the series count
+                unmatched = self.command is None or self.status in (404, 405, 501)
+                route = "unmatched" if unmatched else self.path.partition("?")[0]
+                metrics.request_finished(self.started, route, self.command or "-", self.status or 0)
+
+    def _send_metrics(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", Metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def _send_json(self, response_data, status_code=200):
         resp = json.dumps(response_data).encode('utf-8')
         self.send_response(status_code)
@@ -80,10 +1180,75 @@ class AlarmHostHTTPRequestHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(resp)
 
+    def _send_status(self):
+        # Conditional GET: pollers holding the current ETag get an empty 304
+        etag, body = device.get_status_snapshot()
+        if_none_match = self.headers.get('If-None-Match')
+        # Weak comparison (RFC 7232): compressing proxies hand back W/"..." tags
+        if if_none_match and (if_none_match.strip() == '*' or
+                              etag in (t.strip().removeprefix('W/') for t in if_none_match.split(','))):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_zones(self):
+        # /zones?status=ok|alarm|fault|bypassed&subsystem=N&after=<zone>&limit=N
+        query = parse_qs(urlparse(self.path).query)
+        status = query.get('status', [None])[0]
+        if status is not None and status not in ZONE_STATUSES + ("bypassed",):
+            self._send_json({"error": f"Unknown status '{status}'"}, status_code=400)
+            return
+        try:
+            subsystem = int(query['subsystem'][0]) if 'subsystem' in query else None
+            after = int(query.get('after', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+        except ValueError:
+            self._send_json({"error": "'subsystem', 'after' and 'limit' must be integers"}, status_code=400)
+            return
+        if after < 0 or not 1 <= limit <= 1000:
+            self._send_json({"error": "'after' must be >= 0 and 'limit' between 1 and 1000"}, status_code=400)
+            return
+        zones, matched, next_after = device.query_zones(status, subsystem, after, limit)
+        self._send_json({"zones": zones, "matched": matched, "next_after": next_after})
+
+    def _stream_events(self):
+        # Headers are written here; the socket is then handed to the event hub
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        self.server.detach(self.connection)
+        device.subscribe_events(self.connection, self.headers.get('Last-Event-ID'))
+
     def do_GET(self):
         if self.path == '/status':
-            status = device.get_status()
-            self._send_json(status)
+            self._send_status()
+        elif self.path == '/events':
+            self._stream_events()
+        elif self.path == '/events/stats':
+            self._send_json(event_hub.stats())
+        elif self.path == '/metrics':
+            self._send_metrics()
+        elif self.path == '/server/stats':
+            self._send_json(self.server.stats())
+        elif self.path == '/commands/stats':
+            self._send_json(device.commands.stats())
+        elif self.path == '/alerts/stats':
+            self._send_json(alert_stream.stats() if alert_stream else {"enabled": False})
+        elif self.path.split('?', 1)[0] == '/zones':
+            self._send_zones()
         else:
             self.send_error(404, "Not found")
 
@@ -96,6 +1261,14 @@ class AlarmHostHTTPRequestHandler(BaseHTTPRequestHandler):
             self._send_json({"error": "Malformed JSON"}, status_code=400)
             return
 
+        try:
+            self._handle_command(body)
+        except ConnectionError as e:
+            self._send_json({"error": f"Device unreachable: {e}"}, status_code=502)
+        except TimeoutError as e:
+            self._send_json({"error": str(e)}, status_code=504)
+
+    def _handle_command(self, body):
         if self.path == '/alarm/clear':
             res = device.clear_alarm()
             self._send_json(res)
@@ -115,20 +1288,427 @@ class AlarmHostHTTPRequestHandler(BaseHTTPRequestHandler):
                 return
             res = device.bypass_zone(zone_id, action)
             self._send_json(res)
+        elif self.path in ('/subsys/batch', '/zone/bypass/batch'):
+            # {"operations": [{"zone_id": 3, "action": "bypass"}, ...]} -> per-item results
+            items = body.get('operations')
+            if not isinstance(items, list) or not items:
+                self._send_json({"error": "'operations' must be a non-empty array"}, status_code=400)
+                return
+            if len(items) > BATCH_MAX_OPERATIONS:
+                self._send_json({"error": f"At most {BATCH_MAX_OPERATIONS} operations per batch"}, status_code=400)
+                return
+            kind, key = ('subsystem', 'subsystem_id') if self.path == '/subsys/batch' else ('zone', 'zone_id')
+            operations = [
+                {"op": kind, key: item.get(key), "action": item.get('action')} if isinstance(item, dict) else {"op": kind}
+                for item in items
+            ]
+            results = device.execute(operations)
+            succeeded = sum(1 for r in results if r.get("success"))
+            self._send_json({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded})
         else:
             self.send_error(404, "Not found")
 
     def log_message(self, format, *args):
         return  # Silence the default logging
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server with a fixed pool of worker threads fed from a bounded
+    queue. Connections arriving while the queue is full get an immediate
+    503 with Retry-After instead of waiting behind slow device calls.
+    Settings are passed in by the caller, so every driver carries the same
+    copy of this class whatever its environment variables are called.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64, retry_after=1,
+                 reuse_port=False, keepalive_idle=8, idle_timeout=10.0, drain_timeout=15.0):
+        self.reuse_port = reuse_port
+        self.draining = False
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        # At least one worker is always left for new connections
+        self.keepalive_idle = max(min(keepalive_idle, workers - 1), 0)
+        self._idle = 0
+        self.retry_after = retry_after
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._counters = {"accepted": 0, "served": 0, "rejected": 0}
+        self._busy = 0
+        self._lingering = {}  # rejected socket -> time it is closed regardless
+        self._linger_selector = selectors.DefaultSelector()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._linger, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            self._reject(request)
+            return
+        with self._lock:
+            self._counters["accepted"] += 1
+
+    def _reject(self, request):
+        with self._lock:
+            self._counters["rejected"] += 1
+        metrics.inc("http_connections_rejected_total")
+        body = b'{"error": "Server busy, retry later"}'
+        try:
+            request.setblocking(False)
+            request.send(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n"
+                         b"Connection: close\r\n\r\n%s" % (self.retry_after, len(body), body))
+            # Half-close and keep reading until the client closes: closing with
+            # its request still unread would reset the connection under the 503
+            request.shutdown(socket.SHUT_WR)
+            with self._lock:
+                if len(self._lingering) < 1024:
+                    self._linger_selector.register(request, selectors.EVENT_READ)
+                    self._lingering[request] = time.monotonic() + 2.0
+                    return
+        except OSError:
+            pass
+        request.close()
+
+    def _linger(self):
+        # Reads and discards whatever rejected clients still send, then closes them
+        while True:
+            events = self._linger_selector.select(0.5)
+            now = time.monotonic()
+            with self._lock:
+                for key, _ in events:
+                    try:
+                        done = not key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        done = False
+                    except OSError:
+                        done = True
+                    if done:
+                        self._unlinger(key.fileobj)
+                for sock, deadline in list(self._lingering.items()):
+                    if deadline < now:
+                        self._unlinger(sock)
+
+    def _unlinger(self, sock):
+        # Called with the lock held
+        if self._lingering.pop(sock, None) is not None:
+            self._linger_selector.unregister(sock)
+            sock.close()
+
+    def _work(self):
+        while True:
+            request, client_address, enqueued = self._queue.get()
+            with self._lock:
+                self._waits.append(time.monotonic() - enqueued)
+                self._busy += 1
+            try:
+                # Idle or stalled clients give their worker back after the timeout
+                request.settimeout(self.idle_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self._busy -= 1
+                    self._counters["served"] += 1
+
+    def hold_idle(self):
+        """
+        Reserve an idle keep-alive slot for a connection about to wait for its
+        next request; False means the response should close the connection.
+        """
+        with self._lock:
+            if self.draining or self._idle >= self.keepalive_idle or not self._queue.empty():
+                return False
+            self._idle += 1
+            return True
+
+    def release_idle(self):
+        with self._lock:
+            self._idle -= 1
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Every process bound to the port (prefork workers, or a replacement
+            # starting while this one drains) gets a share of new connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def drain(self, timeout=None):
+        """Stop accepting, then wait for queued and in-flight connections to finish."""
+        self.draining = True
+        self.server_close()
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._counters["accepted"] == self._counters["served"]:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def serve_until_terminated(self):
+        """serve_forever() until SIGTERM, then drain."""
+        # shutdown() waits for serve_forever() to return, so it cannot run inside the handler
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.shutdown).start())
+        self.serve_forever()
+        self.drain()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counters, pid=os.getpid(), workers=self.workers, busy=self._busy,
+                         idle_keepalive=self._idle, queued=self._queue.qsize())
+        if waits:
+            stats["queue_wait_ms"] = {
+                "p50": round(waits[len(waits) // 2] * 1000, 3),
+                "p99": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3),
+                "max": round(waits[-1] * 1000, 3),
+            }
+        return stats
+
+
+class AlarmHostHTTPServer(PooledHTTPServer):
+    # Event subscribers tend to reconnect in bursts; the default backlog of 5 drops SYNs
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+
+    def detach(self, request):
+        # The request socket now belongs to someone else (the event hub)
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
 
 def run_server():
+    if SERVER_PROCESSES != 1:
+        raise ValueError("SERVER_PROCESSES must be 1: the alarm host driver keeps device state in one process")
     server_address = (SERVER_HOST, SERVER_PORT)
-    httpd = ThreadedHTTPServer(server_address, AlarmHostHTTPRequestHandler)
+    httpd = AlarmHostHTTPServer(server_address, AlarmHostHTTPRequestHandler, workers=SERVER_WORKERS,
+                                queue_size=SERVER_QUEUE_SIZE, retry_after=SERVER_RETRY_AFTER,
+                                reuse_port=SERVER_REUSE_PORT, keepalive_idle=SERVER_KEEPALIVE_IDLE,
+                                idle_timeout=SERVER_IDLE_TIMEOUT, drain_timeout=SERVER_DRAIN_TIMEOUT)
+    if alert_stream:
+        alert_stream.start()
+    if device.link is not None and SENSOR_POLL_INTERVAL > 0:
+        threading.Thread(target=device.run_sensor_poller, args=(SENSOR_POLL_INTERVAL,), daemon=True).start()
     print(f"Alarm Host HTTP API server running on {SERVER_HOST}:{SERVER_PORT}")
-    httpd.serve_forever()
+    httpd.serve_until_terminated()
+
+def _serve_stand_in_device(round_trip=0.0):
+    # Local JSON-lines alarm host: every read is answered after one simulated round trip
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def serve(conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pending = b''
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                pending += data
+                *lines, pending = pending.split(b'\n')
+                if not lines:
+                    continue
+                time.sleep(round_trip)
+                replies = []
+                for line in lines:
+                    request = json.loads(line)
+                    if "batch" in request:
+                        reply = {"results": [{"success": True} for _ in request["batch"]]}
+                    elif request.get("op") == "read_sensors":
+                        reply = {"success": True, "sensors": {"battery_voltage": 12.3, "water": 0, "dust": 1}}
+                    else:
+                        reply = {"success": True}
+                    replies.append(json.dumps(reply).encode('utf-8') + b'\n')
+                conn.sendall(b''.join(replies))
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def run_benchmark(zones=200, round_trip=0.002):
+    # Bypass `zones` zones per-item vs in one batch, through HTTP, against the stand-in device
+    global device
+    device_port = _serve_stand_in_device(round_trip)
+    httpd = AlarmHostHTTPServer(('127.0.0.1', 0), AlarmHostHTTPRequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1])
+
+    def post(path, payload):
+        conn.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read())
+
+    for label, batch_supported in (("batched", True), ("pipelined", False)):
+        device = HikvisionAlarmHostDevice(DEVICE_IP, DEVICE_PORT, DEVICE_USERNAME, DEVICE_PASSWORD,
+                                          link=DeviceLink('127.0.0.1', device_port, DEVICE_TIMEOUT, batch_supported),
+                                          zone_count=max(zones, ZONE_COUNT))
+        started = time.perf_counter()
+        for zone in range(1, zones + 1):
+            post('/zone/bypass', {"zone_id": zone, "action": "bypass"})
+        single = time.perf_counter() - started
+        started = time.perf_counter()
+        result = post('/zone/bypass/batch', {"operations": [{"zone_id": z, "action": "unbypass"} for z in range(1, zones + 1)]})
+        batch = time.perf_counter() - started
+        assert result["succeeded"] == zones and not device.zones.bypassed
+        print(f"{zones} zones, {round_trip * 1000:g} ms round trip: per-item {single * 1000:.1f} ms "
+              f"({zones / single:.0f} ops/s), {label} {batch * 1000:.1f} ms ({zones / batch:.0f} ops/s)")
+
+        # Per-item requests from 16 concurrent clients share queue exchanges
+        def client(first):
+            c = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1])
+            for zone in range(first, zones + 1, 16):
+                c.request('POST', '/zone/bypass', json.dumps({"zone_id": zone, "action": "bypass"}))
+                c.getresponse().read()
+            c.close()
+        exchanges = device.commands.stats()["exchanges"]
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(i,)) for i in range(1, 17)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        concurrent = time.perf_counter() - started
+        stats = device.commands.stats()
+        print(f"{'':>{len(str(zones)) + 6}}16 concurrent per-item clients: {concurrent * 1000:.1f} ms "
+              f"({zones / concurrent:.0f} ops/s, {stats['exchanges'] - exchanges} exchanges, "
+              f"p99 {stats['latency_ms']['p99']} ms)")
+        device.link.close()
+    httpd.shutdown()
+
+
+def run_zone_report(zones=4096):
+    # Memory per panel and query latency for a `zones`-zone table with mixed state
+    tracemalloc.start()
+    table = ZoneTable(zones, ZONE_SUBSYSTEM_SIZE)
+    for i in range(0, zones, 7):
+        table.set_bypassed(i, True)
+    for i in range(0, zones, 50):
+        table.set_status(i, 1)
+    for i in range(3, zones, 101):
+        table.set_status(i, 2)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    listed = [{"zone": i + 1, "status": "ok", "bypassed": False, "subsystem": 1} for i in range(zones)]
+    print(f"{zones} zones: table {size / 1024:.1f} KiB "
+          f"(list of dicts would hold {(sys.getsizeof(listed) + sum(sys.getsizeof(z) for z in listed)) / 1024:.0f} KiB+)")
+    for label, kwargs in (
+        ("summary", None),
+        ("all, first page", {}),
+        ("all, last page", {"after": zones - 100}),
+        ("status=alarm", {"status": "alarm"}),
+        ("status=bypassed", {"status": "bypassed"}),
+        ("status=ok subsystem=3", {"status": "ok", "subsystem": 3}),
+    ):
+        started = time.perf_counter()
+        for _ in range(1000):
+            table.summary() if kwargs is None else table.query(**kwargs)
+        print(f"{label:>22}: {(time.perf_counter() - started) * 1000:.1f} us/query")
+
+
+def _synthetic_alert_stream(events, boundary=b'boundary', zones=ZONE_COUNT):
+    # Alternating XML/JSON zone alarms and restores; every fifth part has no Content-Length
+    for n in range(events):
+        zone, state = n % zones + 1, "active" if n // zones % 2 == 0 else "inactive"
+        if n % 2:
+            ctype = b'application/json'
+            body = json.dumps({"EventNotificationAlert": {"eventType": "zoneAlarm", "eventState": state,
+                                                          "zoneNo": zone, "dateTime": "2024-06-01T12:00:00+08:00"}}).encode()
+        else:
+            ctype = b'application/xml; charset="UTF-8"'
+            body = (f'<?xml version="1.0" encoding="UTF-8"?>\r\n<EventNotificationAlert version="2.0" '
+                    f'xmlns="http://www.hikvision.com/ver20/XMLSchema"><ipAddress>192.168.1.64</ipAddress>'
+                    f'<dateTime>2024-06-01T12:00:00+08:00</dateTime><eventType>IO</eventType>'
+                    f'<eventState>{state}</eventState><inputIOPortID>{zone}</inputIOPortID>'
+                    f'<eventDescription>IO alarm</eventDescription></EventNotificationAlert>').encode()
+        length = b'' if n % 5 == 4 else b'Content-Length: %d\r\n' % len(body)
+        yield b'--' + boundary + b'\r\nContent-Type: ' + ctype + b'\r\n' + length + b'\r\n' + body + b'\r\n'
+    yield b'--' + boundary + b'--\r\n'
+
+
+def _serve_alert_stand_in(recording=None, events=10000, zones=ZONE_COUNT):
+    # One-shot alert stream: replays a recorded multipart body (boundary "boundary") or synthetic events
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            while b'\r\n\r\n' not in conn.recv(4096):
+                pass
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: multipart/mixed; boundary=boundary\r\n'
+                         b'Connection: close\r\n\r\n')
+            if recording:
+                with open(recording, 'rb') as f:
+                    while chunk := f.read(65536):
+                        conn.sendall(chunk)
+            else:
+                pending = []
+                for part in _synthetic_alert_stream(events, zones=zones):
+                    pending.append(part)
+                    if len(pending) == 64:
+                        conn.sendall(b''.join(pending))
+                        pending = []
+                conn.sendall(b''.join(pending))
+        listener.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def run_alert_benchmark(events=100000, recording=None):
+    # Ingest rate for one alert stream connection against the stand-in, then
+    # peak memory on a second pass (tracemalloc slows the parser several times over)
+    for traced in (False, True):
+        target = HikvisionAlarmHostDevice(DEVICE_IP, DEVICE_PORT, DEVICE_USERNAME, DEVICE_PASSWORD, zone_count=4096)
+        port = _serve_alert_stand_in(recording, events, zones=4096)
+        client = AlertStreamClient(target, '127.0.0.1', port, ALERT_STREAM_PATH, DEVICE_USERNAME, DEVICE_PASSWORD,
+                                   ALERT_STREAM_BUFFER_SIZE)
+        if traced:
+            tracemalloc.start()
+        started = time.perf_counter()
+        client.run_once()
+        elapsed = time.perf_counter() - started
+        stats = client.stats()
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"peak traced memory {peak / 1024:.0f} KiB (receive buffer {ALERT_STREAM_BUFFER_SIZE // 1024} KiB)")
+        else:
+            print(f"{stats['events']} events ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.2f} s: "
+                  f"{stats['events'] / elapsed:.0f} events/s, {stats['applied']} applied, "
+                  f"{stats['malformed']} malformed, {stats['oversized']} oversized")
 
 if __name__ == '__main__':
-    run_server()
\ No newline at end of file
+    if sys.argv[1:2] == ['bench']:
+        run_benchmark(*(t(a) for t, a in zip((int, float), sys.argv[2:4])))
+    elif sys.argv[1:2] == ['zones-report']:
+        run_zone_report(*(int(a) for a in sys.argv[2:3]))
+    elif sys.argv[1:2] == ['alert-bench']:
+        run_alert_benchmark(*(t(a) for t, a in zip((int, str), sys.argv[2:4])))
+    else:
+        run_server()
\ No newline at end of file
@@ -1,10 +1,34 @@
 import os
 import csv
+import gc
 import io
+import itertools
+import queue
+import selectors
+import signal
+import socket
+import struct
+import sys
 import threading
+import time
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import socketserver
 import json
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Device info from environment variables or defaults
 DEVICE_NAME = os.environ.get('DEVICE_NAME', 'asd')
@@ -15,9 +39,45 @@ DEVICE_TYPE = os.environ.get('DEVICE_TYPE', 'asd')
 # Device connection info from environment variables
 DEVICE_IP = os.environ.get('DEVICE_IP', '127.0.0.1')
 DEVICE_PORT = int(os.environ.get('DEVICE_PORT', '9000'))  # dsa protocol port, configurable
+DEVICE_TIMEOUT = float(os.environ.get('DEVICE_TIMEOUT', '5'))
 # HTTP Server config
 HTTP_HOST = os.environ.get('HTTP_HOST', '0.0.0.0')
 HTTP_PORT = int(os.environ.get('HTTP_PORT', '8080'))
+# /data streaming: rows buffered between the device reader and the HTTP client,
+# and the largest chunk written to the client at once
+STREAM_BUFFER_ROWS = int(os.environ.get('STREAM_BUFFER_ROWS', '1024'))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', '16384'))
+# Rows per columnar batch, and how long a partial batch may wait for more rows
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', '65536'))
+STREAM_FLUSH_INTERVAL = float(os.environ.get('STREAM_FLUSH_INTERVAL', '0.05'))
+# In-memory history: points kept (24 bytes each) and how often the device is
+# polled in the background to fill it (0 disables polling)
+RING_BUFFER_CAPACITY = int(os.environ.get('RING_BUFFER_CAPACITY', '1048576'))
+DSA_POLL_INTERVAL = float(os.environ.get('DSA_POLL_INTERVAL', '1'))
+# Precision of timestamps in CSV answers to history queries: 's' or 'ms'
+CSV_TIMESTAMP_UNIT = os.environ.get('CSV_TIMESTAMP_UNIT', 'ms')
+if CSV_TIMESTAMP_UNIT not in ('s', 'ms'):
+    raise ValueError("CSV_TIMESTAMP_UNIT must be 's' or 'ms'")
+# Worker pool: threads, connections allowed to wait for a worker before
+# shedding with 503, Retry-After seconds, and per-connection idle timeout
+HTTP_WORKERS = int(os.environ.get('HTTP_WORKERS', '16'))
+HTTP_QUEUE_SIZE = int(os.environ.get('HTTP_QUEUE_SIZE', '64'))
+HTTP_RETRY_AFTER = int(os.environ.get('HTTP_RETRY_AFTER', '1'))
+HTTP_IDLE_TIMEOUT = float(os.environ.get('HTTP_IDLE_TIMEOUT', '10'))
+# Requests served on one keep-alive connection before it is closed
+HTTP_KEEPALIVE_MAX_REQUESTS = int(os.environ.get('HTTP_KEEPALIVE_MAX_REQUESTS', '1000'))
+# Keep-alive connections allowed to sit idle on a worker between requests;
+# past that (or while connections are queued) responses close the connection
+HTTP_KEEPALIVE_IDLE = int(os.environ.get('HTTP_KEEPALIVE_IDLE', '8'))
+# One process polls the device and holds the history buffer, so prefork
+# (HTTP_PROCESSES > 1) is refused. SO_REUSEPORT lets a replacement bind the
+# port while this process drains, for up to HTTP_DRAIN_TIMEOUT seconds of
+# queued and in-flight requests.
+HTTP_PROCESSES = int(os.environ.get('HTTP_PROCESSES', '1'))
+HTTP_REUSE_PORT = os.environ.get('HTTP_REUSE_PORT', '0') == '1'
+HTTP_DRAIN_TIMEOUT = float(os.environ.get('HTTP_DRAIN_TIMEOUT', '15'))
+
+CSV_FIELDS = ['timestamp', 'value1', 'value2']
 
 # Dummy in-memory data to mimic device data for /data
 DEVICE_DATA_POINTS = [
@@ -26,28 +86,546 @@ DEVICE_DATA_POINTS = [
     {'timestamp': '2024-06-10T12:00:02Z', 'value1': 25, 'value2': 53}
 ]
 
-# --- Simulated DSA Protocol Communication ---
+# --- Metrics ---
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# --- DSA Protocol Communication ---
+def read_device_rows():
+    """
+    Connect to the device via DSA protocol (TCP, custom) and yield data rows
+    as (timestamp, value1, value2) while they arrive. The device answers
+    "GET DATA" with one comma-separated row per line, ending with "END" or by
+    closing the connection. Falls back to the dummy DEVICE_DATA_POINTS when
+    the device is unreachable.
+    """
+    with metrics.device_call("read_rows") as call:
+        try:
+            sock = socket.create_connection((DEVICE_IP, DEVICE_PORT), timeout=DEVICE_TIMEOUT)
+        except OSError as e:
+            call["error"] = e
+            for row in DEVICE_DATA_POINTS:
+                yield (row['timestamp'], row['value1'], row['value2'])
+            return
+        with sock, sock.makefile('rb') as stream:
+            sock.sendall(b"GET DATA\n")
+            call["sent"] = 9
+            for line in stream:
+                call["received"] += len(line)
+                line = line.strip()
+                if not line or line == b'timestamp,value1,value2':
+                    continue
+                if line == b'END':
+                    break
+                yield tuple(line.decode('utf-8', errors='replace').split(',', 2))
+
+_END_OF_ROWS = object()
+
+def _put_until_stopped(rows, item, stop):
+    while not stop.is_set():
+        try:
+            rows.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _produce_rows(rows, stop):
+    try:
+        for row in read_device_rows():
+            if not _put_until_stopped(rows, row, stop):
+                return
+        item = _END_OF_ROWS
+    except Exception as ex:
+        item = ex
+    _put_until_stopped(rows, item, stop)
+
+def stream_device_batches(max_rows=STREAM_BATCH_ROWS):
+    """
+    Yield lists of device rows as they arrive. A reader thread moves rows
+    from the DSA socket into a bounded queue; when the HTTP client falls
+    behind, the queue fills, the reader stops receiving and TCP flow control
+    pushes back on the device, so memory stays constant. A batch is handed
+    out when it holds max_rows or STREAM_FLUSH_INTERVAL has passed.
+    """
+    rows = queue.Queue(maxsize=STREAM_BUFFER_ROWS)
+    stop = threading.Event()
+    threading.Thread(target=_produce_rows, args=(rows, stop), daemon=True).start()
+    try:
+        done = False
+        while not done:
+            batch = [rows.get()]
+            deadline = time.monotonic() + STREAM_FLUSH_INTERVAL
+            while len(batch) < max_rows:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(rows.get(timeout=remaining) if remaining > 0 else rows.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _END_OF_ROWS:
+                batch.pop()
+                done = True
+            elif isinstance(batch[-1], Exception):
+                raise batch[-1]
+            if batch:
+                yield batch
+    finally:
+        stop.set()
+
+def stream_device_columns(keep_rows=False):
+    """
+    Yield typed column batches (timestamps, value1, value2) from the device,
+    appending every batch to the in-memory history on the way through. With
+    keep_rows the device's own rows are yielded instead, for CSV.
+    """
+    batches = stream_device_batches()
+    try:
+        for batch in batches:
+            columns = rows_to_columns(batch)
+            data_buffer.append(*columns)
+            yield batch if keep_rows else columns
+    finally:
+        batches.close()
+
 def get_device_data_from_dsa():
     """
-    Simulate connecting to a device via DSA protocol (TCP, custom).
-    For real device: connect to DEVICE_IP:DEVICE_PORT and get data.
-    Here, just yield the dummy DEVICE_DATA_POINTS as CSV lines.
-    """
-    # In a real driver, here you'd have socket code like:
-    # s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # s.connect((DEVICE_IP, DEVICE_PORT))
-    # s.send(b"GET DATA\n")
-    # while True:
-    #     chunk = s.recv(4096)
-    #     yield chunk
-    # For this simulation, just stream the dummy data as CSV.
+    Stream device data as CSV text, row by row, one chunk per batch of rows
+    (split further at STREAM_CHUNK_SIZE).
+    """
+    return encode_csv_rows(stream_device_columns(keep_rows=True))
+
+# --- In-Memory History ---
+class ColumnRingBuffer:
+    """
+    Fixed-capacity columnar ring buffer of device points: an int64 timestamp
+    column (ms since epoch) and one int64 column per value. Points must
+    arrive in timestamp order; older or repeated timestamps are dropped, so
+    re-reading the device's dataset does not duplicate history.
+    """
+    def __init__(self, capacity=RING_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = (np.zeros(capacity, dtype=np.int64), np.zeros(capacity, dtype=np.int64))
+        self.size = 0
+        self.head = 0  # next write position
+        self._lock = threading.Lock()
+
+    def append(self, timestamps, *values):
+        with self._lock:
+            # Keep only points newer than everything before them
+            last = self.timestamps[self.head - 1] if self.size else np.iinfo(np.int64).min
+            if len(timestamps):
+                fresh = timestamps > np.maximum.accumulate(np.concatenate(([last], timestamps[:-1])))
+                if not fresh.all():
+                    timestamps = timestamps[fresh]
+                    values = [v[fresh] for v in values]
+            n = len(timestamps)
+            if n > self.capacity:
+                timestamps = timestamps[-self.capacity:]
+                values = [v[-self.capacity:] for v in values]
+                n = self.capacity
+            first = min(n, self.capacity - self.head)
+            for column, data in zip((self.timestamps,) + self.values, (timestamps,) + tuple(values)):
+                column[self.head:self.head + first] = data[:first]
+                column[:n - first] = data[first:]
+            self.head = (self.head + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+
+    def _segments(self):
+        # Chronological (start, stop) index ranges of the stored points
+        if self.size < self.capacity:
+            return [(0, self.size)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def query(self, start=None, stop=None):
+        """Copy out the columns for start <= timestamp < stop (ms since epoch)."""
+        parts = []
+        with self._lock:
+            for lo, hi in self._segments():
+                ts = self.timestamps[lo:hi]
+                i = lo + (np.searchsorted(ts, start, 'left') if start is not None else 0)
+                j = lo + (np.searchsorted(ts, stop, 'left') if stop is not None else hi - lo)
+                if i < j:
+                    parts.append((self.timestamps[i:j].copy(),) + tuple(v[i:j].copy() for v in self.values))
+        if not parts:
+            return (np.empty(0, dtype=np.int64),) * 3
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+def rollup(timestamps, values, step, agg):
+    """
+    Aggregate sorted points into step-wide buckets aligned to the epoch.
+    Returns the bucket start timestamps and one aggregated column per value.
+    """
+    if not len(timestamps):
+        return (timestamps,) + tuple(v.astype(np.float64) if agg == 'mean' else v for v in values)
+    bucket = timestamps // step
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.append(starts[1:], len(timestamps))
+    if agg == 'min':
+        out = [np.minimum.reduceat(v, starts) for v in values]
+    elif agg == 'max':
+        out = [np.maximum.reduceat(v, starts) for v in values]
+    elif agg == 'mean':
+        out = [np.add.reduceat(v, starts, dtype=np.float64) / (ends - starts) for v in values]
+    else:
+        out = [v[ends - 1] for v in values]
+    return (bucket[starts] * step,) + tuple(out)
+
+data_buffer = ColumnRingBuffer()
+
+def _poll_device():
+    # Keep the history filled even when nobody is streaming /data
+    while True:
+        try:
+            for _ in stream_device_columns():
+                pass
+        except Exception:
+            pass
+        time.sleep(DSA_POLL_INTERVAL)
+
+# --- /data Output Formats ---
+_TIMESTAMP_TEMPLATE = np.frombuffer(b'0000-00-00T00:00:00Z\0', dtype=np.uint8)
+_TIMESTAMP_DIGITS = _TIMESTAMP_TEMPLATE == ord('0')
+_MONTH_DAYS = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def parse_timestamps(values):
+    """
+    ISO-8601 UTC timestamps to int64 milliseconds since the epoch. The
+    device's fixed "YYYY-MM-DDTHH:MM:SSZ" form is decoded arithmetically over
+    the whole batch; anything else goes through numpy's datetime parser,
+    which raises ValueError on malformed input.
+    """
+    try:
+        # One byte past the fixed form, so longer values show up instead of being cut off
+        raw = np.array(values, dtype='S21')
+        b = raw.view(np.uint8).reshape(-1, 21).astype(np.int64)
+    except (UnicodeEncodeError, ValueError, TypeError):
+        b = None
+    if b is not None:
+        digits = b[:, _TIMESTAMP_DIGITS] - ord('0')
+        if not ((b[:, ~_TIMESTAMP_DIGITS] == _TIMESTAMP_TEMPLATE[~_TIMESTAMP_DIGITS]).all()
+                and ((digits >= 0) & (digits <= 9)).all()):
+            b = None
+    if b is None:
+        return _parse_timestamps_slow(values)
+    b -= ord('0')
+    year = b[:, 0] * 1000 + b[:, 1] * 100 + b[:, 2] * 10 + b[:, 3]
+    month = b[:, 5] * 10 + b[:, 6]
+    day = b[:, 8] * 10 + b[:, 9]
+    hour, minute, second = b[:, 11] * 10 + b[:, 12], b[:, 14] * 10 + b[:, 15], b[:, 17] * 10 + b[:, 18]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid = (month >= 1) & (month <= 12) & (hour < 24) & (minute < 60) & (second < 60) & (day >= 1)
+    if not (valid & (day <= _MONTH_DAYS[np.where(valid, month, 0)] + (leap & (month == 2)))).all():
+        # Out-of-range fields: let the slow parser report them
+        return _parse_timestamps_slow(values)
+    seconds = hour * 3600 + minute * 60 + second
+    # Days since 1970-01-01 from the proleptic Gregorian calendar
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    days = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+    return (days * 86400 + seconds) * 1000
+
+def _parse_timestamps_slow(values):
+    values = [v.rstrip('Z') if isinstance(v, str) else v for v in values]
+    if any(isinstance(v, str) and 'Z' in v for v in values):
+        raise ValueError("Timestamp has trailing characters after 'Z'")
+    return np.array(values, dtype='datetime64[ms]').astype(np.int64)
+
+def parse_ints(values):
+    return np.fromiter(map(int, values), dtype=np.int64, count=len(values))
+
+def rows_to_columns(batch):
+    """
+    Typed columns for a batch of (timestamp, value1, value2) rows. Rows that
+    do not parse are left out, so one bad row does not end a stream whose
+    response has already started.
+    """
+    try:
+        timestamps, value1, value2 = zip(*batch)
+        return parse_timestamps(timestamps), parse_ints(value1), parse_ints(value2)
+    except (ValueError, TypeError):
+        pass
+    good = []
+    for row in batch:
+        try:
+            good.append((parse_timestamps([row[0]])[0], int(row[1]), int(row[2])))
+        except (ValueError, TypeError, IndexError):
+            continue
+    if not good:
+        return (np.empty(0, dtype=np.int64),) * 3
+    return tuple(np.array(column, dtype=np.int64) for column in zip(*good))
+
+def format_timestamps(timestamps):
+    # int64 ms since epoch back to ISO-8601 UTC at CSV_TIMESTAMP_UNIT precision
+    return np.datetime_as_string(timestamps.astype('datetime64[ms]'), unit=CSV_TIMESTAMP_UNIT, timezone='UTC')
+
+def encode_csv(batches):
+    # Timestamps and numbers never need CSV quoting, so lines are formatted
+    # directly; one chunk holds roughly STREAM_CHUNK_SIZE bytes of rows
+    rows_per_chunk = max(1, STREAM_CHUNK_SIZE // 32)
+    yield (','.join(CSV_FIELDS) + '\r\n').encode()
+    for timestamps, value1, value2 in batches:
+        lines = list(map('%s,%s,%s\r\n'.__mod__, zip(
+            format_timestamps(timestamps).tolist(), value1.tolist(), value2.tolist())))
+        for i in range(0, len(lines), rows_per_chunk):
+            yield ''.join(lines[i:i + rows_per_chunk]).encode()
+
+def encode_csv_rows(batches):
+    # The device's rows as it sent them, values that are not numbers included
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=['timestamp', 'value1', 'value2'])
-    writer.writeheader()
-    for row in DEVICE_DATA_POINTS:
-        writer.writerow(row)
-    yield output.getvalue()
-    output.close()
+    writer = csv.writer(output)
+    writer.writerow(CSV_FIELDS)
+    try:
+        for batch in batches:
+            for row in batch:
+                writer.writerow(row)
+                if output.tell() >= STREAM_CHUNK_SIZE:
+                    yield output.getvalue().encode()
+                    output.seek(0)
+                    output.truncate()
+            if output.tell():
+                yield output.getvalue().encode()
+                output.seek(0)
+                output.truncate()
+    finally:
+        output.close()
+
+_PACKED_DTYPES = {np.dtype(np.int64): 0, np.dtype(np.float64): 1}
+
+def encode_packed_columns(batches):
+    """
+    Packed little-endian column layout: per batch a uint32 row count and one
+    type byte per value column (0 = int64, 1 = float64), followed by the
+    timestamp (int64 ms since epoch), value1 and value2 columns; a zero row
+    count ends the stream.
+    """
+    for timestamps, value1, value2 in batches:
+        header = struct.pack('<IBB', len(timestamps), _PACKED_DTYPES[value1.dtype], _PACKED_DTYPES[value2.dtype])
+        yield header + b''.join(c.astype(c.dtype.newbyteorder('<'), copy=False).tobytes()
+                                for c in (timestamps, value1, value2))
+    yield struct.pack('<I', 0)
+
+def encode_msgpack(batches):
+    # One MessagePack map of column arrays per batch, concatenated
+    packer = msgpack.Packer()
+    for columns in batches:
+        yield packer.pack({name: column.tolist() for name, column in zip(CSV_FIELDS, columns)})
+
+def encode_arrow(batches):
+    # Arrow IPC stream: schema message, then one record batch per column batch;
+    # value types come from the first batch (int64, or float64 for means)
+    sink = io.BytesIO()
+    writer = None
+    try:
+        for timestamps, value1, value2 in batches:
+            if writer is None:
+                schema = pa.schema([
+                    ('timestamp', pa.timestamp('ms', tz='UTC')),
+                    ('value1', pa.from_numpy_dtype(value1.dtype)),
+                    ('value2', pa.from_numpy_dtype(value2.dtype)),
+                ])
+                writer = pa.ipc.new_stream(sink, schema)
+            writer.write_batch(pa.record_batch(
+                [pa.array(timestamps.astype('datetime64[ms]')).cast(schema.field('timestamp').type),
+                 pa.array(value1), pa.array(value2)],
+                schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, pa.schema([
+                ('timestamp', pa.timestamp('ms', tz='UTC')), ('value1', pa.int64()), ('value2', pa.int64()),
+            ]))
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.getvalue()
+
+# Media types served on /data, in server preference order
+DATA_FORMATS = {'text/csv': encode_csv}
+if pa is not None:
+    DATA_FORMATS['application/vnd.apache.arrow.stream'] = encode_arrow
+DATA_FORMATS['application/vnd.dsa.columns'] = encode_packed_columns
+if msgpack is not None:
+    DATA_FORMATS['application/msgpack'] = encode_msgpack
+    DATA_FORMATS['application/x-msgpack'] = encode_msgpack
+
+def negotiate_data_format(accept):
+    """Pick the media type for /data from an Accept header, or None if nothing fits."""
+    if not accept:
+        return 'text/csv'
+    ranges = []
+    for part in accept.split(','):
+        fields = part.strip().split(';')
+        media = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges.append((media, q))
+    best, best_q = None, 0.0
+    for media in DATA_FORMATS:
+        major = media.split('/')[0]
+        # The most specific matching range decides the quality of each type
+        matches = [(3 if r == media else 2 if r == major + '/*' else 1, q)
+                   for r, q in ranges if r in (media, major + '/*', '*/*')]
+        if matches:
+            q = max(matches)[1]
+            if q > best_q:
+                best, best_q = media, q
+    return best
 
 def send_command_to_device_dsa(command):
     """
@@ -56,70 +634,459 @@ def send_command_to_device_dsa(command):
     """
     # Real code would send command over socket and read response.
     # For this simulation, just echo the command back.
-    return {
-        'status': 'success',
-        'command_sent': command,
-        'message': f'Command "{command}" sent to device at {DEVICE_IP}:{DEVICE_PORT}'
-    }
+    with metrics.device_call("send_command"):
+        return {
+            'status': 'success',
+            'command_sent': command,
+            'message': f'Command "{command}" sent to device at {DEVICE_IP}:{DEVICE_PORT}'
+        }
+
+def parse_time_param(value):
+    # Epoch milliseconds or an ISO-8601 UTC timestamp
+    try:
+        return int(value)
+    except ValueError:
+        return int(np.datetime64(value.rstrip('Z'), 'ms').astype(np.int64))
+
+_STEP_UNITS = {'ms': 1, 's': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000}
+
+def parse_step(value):
+    # "500ms", "10s", "5m", "1h", "1d" or plain milliseconds
+    for unit in ('ms', 's', 'm', 'h', 'd'):
+        if value.endswith(unit) and value[:-len(unit)].isdigit():
+            return int(value[:-len(unit)]) * _STEP_UNITS[unit]
+    return int(value)
+
+def query_history(query):
+    """Columns for a /data history query: from/to range, optional step/agg rollup."""
+    unknown = set(query) - {'from', 'to', 'step', 'agg'}
+    if unknown:
+        raise ValueError(f"Unknown query parameter(s): {', '.join(sorted(unknown))}")
+    try:
+        start = parse_time_param(query['from'][0]) if 'from' in query else None
+        stop = parse_time_param(query['to'][0]) if 'to' in query else None
+        step = parse_step(query['step'][0]) if 'step' in query else None
+    except ValueError:
+        raise ValueError("'from'/'to' must be epoch ms or ISO-8601, 'step' like 10s, 5m, 1h")
+    agg = query.get('agg', ['last'])[0]
+    if agg not in ('min', 'max', 'mean', 'last'):
+        raise ValueError("'agg' must be one of min, max, mean, last")
+    if step is not None and step <= 0:
+        raise ValueError("'step' must be positive")
+    timestamps, value1, value2 = data_buffer.query(start, stop)
+    if step is None:
+        return timestamps, value1, value2
+    return rollup(timestamps, (value1, value2), step, agg)
 
 # --- HTTP Handler ---
 class DsaDeviceHTTPRequestHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, code=200, content_type="application/json"):
+    # HTTP/1.1 for chunked /data; every other response carries Content-Length
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; keep Nagle from delaying the body
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.requests_served = 0
+        self.idle_held = False
+        try:
+            super().handle()
+        finally:
+            self._release_idle()
+
+    def _release_idle(self):
+        if self.idle_held:
+            self.idle_held = False
+            self.server.release_idle()
+
+    def end_headers(self):
+        # Persistent connections are recycled after HTTP_KEEPALIVE_MAX_REQUESTS, and
+        # only kept open while the server has an idle keep-alive slot to spare
+        self.requests_served += 1
+        if not self.close_connection and not self.idle_held:
+            if self.requests_served >= HTTP_KEEPALIVE_MAX_REQUESTS or not self.server.hold_idle():
+                self.send_header('Connection', 'close')
+            else:
+                self.idle_held = True
+        super().end_headers()
+
+    def parse_request(self):
+        # The request line is in: time from here, not from the keep-alive wait before it
+        self._release_idle()
+        self.started = metrics.request_started()
+        self.status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                # Unknown paths share one label so scanners cannot inflate the series count
+                unmatched = self.command is None or self.status in (404, 405, 501)
+                route = "unmatched" if unmatched else self.path.partition("?")[0]
+                metrics.request_finished(self.started, route, self.command or "-", self.status or 0)
+
+    def _send_metrics(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", Metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _set_headers(self, code=200, content_type="application/json", length=None):
         self.send_response(code)
         self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'content-type')
+        if length is None:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(length))
         self.end_headers()
 
+    def _send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self._set_headers(code, length=len(body))
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+
     def do_OPTIONS(self):
-        self._set_headers()
+        self._set_headers(length=0)
 
     def do_GET(self):
-        if self.path == "/info":
-            self._set_headers()
+        parsed = urlparse(self.path)
+        if parsed.path == "/info":
             info = {
                 "device_name": DEVICE_NAME,
                 "device_model": DEVICE_MODEL,
                 "manufacturer": DEVICE_MANUFACTURER,
                 "device_type": DEVICE_TYPE
             }
-            self.wfile.write(json.dumps(info).encode())
-        elif self.path == "/data":
-            self._set_headers(200, "text/csv")
-            for data_chunk in get_device_data_from_dsa():
-                self.wfile.write(data_chunk.encode())
+            self._send_json(info)
+        elif parsed.path == "/metrics":
+            self._send_metrics()
+        elif parsed.path == "/server/stats":
+            self._send_json(self.server.stats())
+        elif parsed.path == "/data":
+            media_type = negotiate_data_format(self.headers.get('Accept'))
+            if media_type is None:
+                self._send_json({"error": "Not acceptable", "available": list(DATA_FORMATS)}, 406)
+                return
+            query = parse_qs(parsed.query)
+            if query:
+                # History queries are answered from memory, not from the device
+                try:
+                    batches = (columns for columns in [query_history(query)])
+                except ValueError as ex:
+                    self._send_json({"error": str(ex)}, 400)
+                    return
+            else:
+                batches = stream_device_columns(keep_rows=media_type == 'text/csv')
+            # Read the first batch before committing to a 200, so a device
+            # that fails up front gets a proper error response
+            try:
+                first = next(batches, None)
+            except Exception as ex:
+                batches.close()
+                self._send_json({"error": f"Device read failed: {ex}"}, 502)
+                return
+            self._set_headers(200, media_type)
+            encode = encode_csv_rows if media_type == 'text/csv' and not query else DATA_FORMATS[media_type]
+            chunks = encode(itertools.chain([] if first is None else [first], batches))
+            try:
+                for data_chunk in chunks:
+                    self._write_chunk(data_chunk)
+                self.wfile.write(b"0\r\n\r\n")
+            except Exception:
+                # Headers are already sent: drop the connection so the client
+                # sees a truncated body instead of a complete one
+                self.close_connection = True
+            finally:
+                chunks.close()
+                batches.close()
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+            self._send_json({"error": "Not found"}, 404)
 
     def do_POST(self):
+        # Always consume the body so the next request on the connection parses cleanly
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
         if self.path == "/cmd":
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
             try:
                 cmd_json = json.loads(body)
                 command = cmd_json.get("command", "")
                 if not command:
                     raise ValueError("Missing 'command' field")
                 result = send_command_to_device_dsa(command)
-                self._set_headers()
-                self.wfile.write(json.dumps(result).encode())
+                self._send_json(result)
             except Exception as ex:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": str(ex)}).encode())
+                self._send_json({"error": str(ex)}, 400)
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+            self._send_json({"error": "Not found"}, 404)
+
+# --- HTTP Server Worker Pool ---
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server with a fixed pool of worker threads fed from a bounded
+    queue. Connections arriving while the queue is full get an immediate
+    503 with Retry-After instead of waiting behind slow device calls.
+    Settings are passed in by the caller, so every driver carries the same
+    copy of this class whatever its environment variables are called.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64, retry_after=1,
+                 reuse_port=False, keepalive_idle=8, idle_timeout=10.0, drain_timeout=15.0):
+        self.reuse_port = reuse_port
+        self.draining = False
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        # At least one worker is always left for new connections
+        self.keepalive_idle = max(min(keepalive_idle, workers - 1), 0)
+        self._idle = 0
+        self.retry_after = retry_after
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._counters = {"accepted": 0, "served": 0, "rejected": 0}
+        self._busy = 0
+        self._lingering = {}  # rejected socket -> time it is closed regardless
+        self._linger_selector = selectors.DefaultSelector()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._linger, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            self._reject(request)
+            return
+        with self._lock:
+            self._counters["accepted"] += 1
+
+    def _reject(self, request):
+        with self._lock:
+            self._counters["rejected"] += 1
+        metrics.inc("http_connections_rejected_total")
+        body = b'{"error": "Server busy, retry later"}'
+        try:
+            request.setblocking(False)
+            request.send(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n"
+                         b"Connection: close\r\n\r\n%s" % (self.retry_after, len(body), body))
+            # Half-close and keep reading until the client closes: closing with
+            # its request still unread would reset the connection under the 503
+            request.shutdown(socket.SHUT_WR)
+            with self._lock:
+                if len(self._lingering) < 1024:
+                    self._linger_selector.register(request, selectors.EVENT_READ)
+                    self._lingering[request] = time.monotonic() + 2.0
+                    return
+        except OSError:
+            pass
+        request.close()
+
+    def _linger(self):
+        # Reads and discards whatever rejected clients still send, then closes them
+        while True:
+            events = self._linger_selector.select(0.5)
+            now = time.monotonic()
+            with self._lock:
+                for key, _ in events:
+                    try:
+                        done = not key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        done = False
+                    except OSError:
+                        done = True
+                    if done:
+                        self._unlinger(key.fileobj)
+                for sock, deadline in list(self._lingering.items()):
+                    if deadline < now:
+                        self._unlinger(sock)
+
+    def _unlinger(self, sock):
+        # Called with the lock held
+        if self._lingering.pop(sock, None) is not None:
+            self._linger_selector.unregister(sock)
+            sock.close()
+
+    def _work(self):
+        while True:
+            request, client_address, enqueued = self._queue.get()
+            with self._lock:
+                self._waits.append(time.monotonic() - enqueued)
+                self._busy += 1
+            try:
+                # Idle or stalled clients give their worker back after the timeout
+                request.settimeout(self.idle_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self._busy -= 1
+                    self._counters["served"] += 1
 
-# --- HTTP Server Thread ---
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+    def hold_idle(self):
+        """
+        Reserve an idle keep-alive slot for a connection about to wait for its
+        next request; False means the response should close the connection.
+        """
+        with self._lock:
+            if self.draining or self._idle >= self.keepalive_idle or not self._queue.empty():
+                return False
+            self._idle += 1
+            return True
+
+    def release_idle(self):
+        with self._lock:
+            self._idle -= 1
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Every process bound to the port (prefork workers, or a replacement
+            # starting while this one drains) gets a share of new connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def drain(self, timeout=None):
+        """Stop accepting, then wait for queued and in-flight connections to finish."""
+        self.draining = True
+        self.server_close()
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._counters["accepted"] == self._counters["served"]:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def serve_until_terminated(self):
+        """serve_forever() until SIGTERM, then drain."""
+        # shutdown() waits for serve_forever() to return, so it cannot run inside the handler
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.shutdown).start())
+        self.serve_forever()
+        self.drain()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counters, pid=os.getpid(), workers=self.workers, busy=self._busy,
+                         idle_keepalive=self._idle, queued=self._queue.qsize())
+        if waits:
+            stats["queue_wait_ms"] = {
+                "p50": round(waits[len(waits) // 2] * 1000, 3),
+                "p99": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3),
+                "max": round(waits[-1] * 1000, 3),
+            }
+        return stats
 
 def run_server():
-    server = ThreadedHTTPServer((HTTP_HOST, HTTP_PORT), DsaDeviceHTTPRequestHandler)
+    if HTTP_PROCESSES != 1:
+        raise ValueError("HTTP_PROCESSES must be 1: one process polls the device and keeps its history")
+    if DSA_POLL_INTERVAL > 0:
+        threading.Thread(target=_poll_device, daemon=True).start()
+    server = PooledHTTPServer((HTTP_HOST, HTTP_PORT), DsaDeviceHTTPRequestHandler, workers=HTTP_WORKERS,
+                              queue_size=HTTP_QUEUE_SIZE, retry_after=HTTP_RETRY_AFTER,
+                              reuse_port=HTTP_REUSE_PORT, keepalive_idle=HTTP_KEEPALIVE_IDLE,
+                              idle_timeout=HTTP_IDLE_TIMEOUT, drain_timeout=HTTP_DRAIN_TIMEOUT)
     print(f"DSA HTTP Device Driver running at http://{HTTP_HOST}:{HTTP_PORT}")
-    server.serve_forever()
+    server.serve_until_terminated()
+
+def _decode_csv(data):
+    reader = csv.reader(io.StringIO(data.decode()))
+    next(reader)
+    rows = [(np.datetime64(t.rstrip('Z'), 'ms'), int(a), int(b)) for t, a, b in reader]
+    return len(rows)
+
+def _decode_packed_columns(data):
+    view = memoryview(data)
+    offset, total = 0, 0
+    while True:
+        (count,) = struct.unpack_from('<I', view, offset)
+        if not count:
+            return total
+        types = struct.unpack_from('<BB', view, offset + 4)
+        offset += 6
+        columns = []
+        for dtype in ('<i8',) + tuple('<f8' if t else '<i8' for t in types):
+            columns.append(np.frombuffer(view, dtype=dtype, count=count, offset=offset))
+            offset += 8 * count
+        total += len(columns[0])
+
+def _decode_msgpack(data):
+    return sum(len(batch['timestamp']) for batch in msgpack.Unpacker(io.BytesIO(data)))
+
+def _decode_arrow(data):
+    return pa.ipc.open_stream(data).read_all().num_rows
+
+def run_benchmark(row_counts=(10000, 100000, 1000000)):
+    # Serialized size and encode/decode time per /data format
+    decoders = {
+        'text/csv': _decode_csv,
+        'application/vnd.apache.arrow.stream': _decode_arrow,
+        'application/vnd.dsa.columns': _decode_packed_columns,
+        'application/msgpack': _decode_msgpack,
+    }
+    for count in row_counts:
+        rows = [(f'2024-06-10T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}Z', str(i % 1000), str(i % 7919))
+                for i in range(count)]
+        batches = [rows[i:i + STREAM_BATCH_ROWS] for i in range(0, count, STREAM_BATCH_ROWS)]
+        # The server streams rows; keep the benchmark's resident copy out of GC passes
+        gc.freeze()
+        print(f"{count} rows")
+        for media_type, decode in decoders.items():
+            if media_type not in DATA_FORMATS:
+                print(f"  {media_type:<38} unavailable")
+                continue
+            start = time.perf_counter()
+            data = b''.join(DATA_FORMATS[media_type](rows_to_columns(batch) for batch in batches))
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            decoded = decode(data)
+            decode_time = time.perf_counter() - start
+            assert decoded == count
+            print(f"  {media_type:<38} {len(data) / 1e6:8.2f} MB  encode {encode_time * 1e3:8.1f} ms"
+                  f"  decode {decode_time * 1e3:8.1f} ms")
+
+def run_rollup_benchmark(points=1000000):
+    # Ring buffer append throughput and rollup latency over a full history
+    buffer = ColumnRingBuffer(points)
+    rng = np.random.default_rng(0)
+    timestamps = 1718020800000 + np.arange(points, dtype=np.int64) * 1000
+    value1 = rng.integers(0, 1000, points)
+    value2 = rng.integers(0, 10000, points)
+    start = time.perf_counter()
+    for i in range(0, points, 4096):
+        buffer.append(timestamps[i:i + 4096], value1[i:i + 4096], value2[i:i + 4096])
+    append_time = time.perf_counter() - start
+    print(f"append {points} points: {append_time * 1e3:8.1f} ms  ({buffer.timestamps.nbytes * 3 / 1e6:.0f} MB resident)")
+    for step in (60000, 3600000):
+        for agg in ('min', 'max', 'mean', 'last'):
+            start = time.perf_counter()
+            ts, v1, v2 = buffer.query()
+            buckets = rollup(ts, (v1, v2), step, agg)
+            elapsed = time.perf_counter() - start
+            print(f"rollup step={step // 1000:>5}s agg={agg:<4}: {len(buckets[0]):6d} buckets  {elapsed * 1e3:6.1f} ms")
 
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    if sys.argv[1:2] == ["bench"]:
+        run_benchmark(tuple(int(a) for a in sys.argv[2:]) or (10000, 100000, 1000000))
+    elif sys.argv[1:2] == ["bench-rollup"]:
+        run_rollup_benchmark(*(int(a) for a in sys.argv[2:3]))
+    else:
+        run_server()
\ No newline at end of file
@@ -1,5 +1,22 @@
+import asyncio
 import os
-from fastapi import FastAPI, Response
+import fcntl
+import json
+import mmap
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import http.client
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse
 import uvicorn
 
@@ -10,19 +27,436 @@ DEVICE_TYPE = os.environ.get("DEVICE_TYPE", "sad")
 
 SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "8080"))
+# Prefork: copies of this driver sharing SERVER_PORT through SO_REUSEPORT
+# (1 = serve from this process), seconds a stopping process may spend on
+# in-flight requests, and the pause before restarting a worker
+# that died right after starting
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", "1"))
+SERVER_REUSE_PORT = os.environ.get("SERVER_REUSE_PORT", "0") == "1"
+SERVER_DRAIN_TIMEOUT = float(os.environ.get("SERVER_DRAIN_TIMEOUT", "15"))
+SERVER_RESTART_DELAY = float(os.environ.get("SERVER_RESTART_DELAY", "1"))
+# Device state shared by all workers: backing file (on tmpfs where available),
+# its size, and how often the leader refreshes it. Followers retry for the
+# lead at the same interval, so a dead leader is replaced within one period.
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), f"dassad-{SERVER_PORT}.state"))
+SHARED_STATE_SIZE = int(os.environ.get("SHARED_STATE_SIZE", "65536"))
+DEVICE_REFRESH_INTERVAL = float(os.environ.get("DEVICE_REFRESH_INTERVAL", "5"))
 
-app = FastAPI()
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class SharedSnapshot:
+    """
+    Single-writer snapshot in a memory-mapped file shared by every worker,
+    versioned like a seqlock: the writer makes the sequence odd, writes the
+    payload, then makes it even again. Readers copy the payload and retry
+    if the sequence was odd or moved underneath them, so they never take a
+    lock. A CRC of the payload also rejects torn copies on CPUs that
+    reorder the stores. The writer is whichever worker holds an exclusive
+    flock on the file; the kernel drops it when that process dies.
+    """
+
+    HEADER = struct.Struct("<QIId")  # sequence, payload length, payload crc32, first published (epoch s)
+    SEQUENCE = struct.Struct("<Q")
+
+    def __init__(self, path=SHARED_STATE_PATH, size=SHARED_STATE_SIZE):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self.capacity = size - self.HEADER.size
+        self.leading = False
+        self.retries = 0
+
+    def try_lead(self):
+        """Take the writer role if no live worker holds it."""
+        if not self.leading:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self.leading = True
+        return True
+
+    def publish(self, payload):
+        if not self.leading:
+            raise RuntimeError("Only the leading worker may publish")
+        if len(payload) > self.capacity:
+            raise ValueError(f"Snapshot of {len(payload)} bytes exceeds {self.capacity}")
+        # An unchanged payload keeps its version, so ETags stay valid across refreshes
+        sequence, length, crc, _ = self.HEADER.unpack_from(self._map)
+        if (sequence and not sequence & 1 and length == len(payload) and crc == zlib.crc32(payload)
+                and self._map[self.HEADER.size:self.HEADER.size + length] == payload):
+            return sequence // 2
+        # A previous leader may have died mid-write; start from the next even sequence
+        sequence = (self.SEQUENCE.unpack_from(self._map)[0] | 1) + 1
+        self.SEQUENCE.pack_into(self._map, 0, sequence - 1)
+        self._map[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(self._map, 0, sequence - 1, len(payload), zlib.crc32(payload), time.time())
+        self.SEQUENCE.pack_into(self._map, 0, sequence)
+        return sequence // 2
+
+    def read(self, attempts=1000):
+        """(version, published, payload) of the latest snapshot, or None if none is readable."""
+        for _ in range(attempts):
+            sequence, length, crc, published = self.HEADER.unpack_from(self._map)
+            if sequence == 0:
+                return None
+            if not sequence & 1 and length <= self.capacity:
+                payload = self._map[self.HEADER.size:self.HEADER.size + length]
+                if self.SEQUENCE.unpack_from(self._map)[0] == sequence and zlib.crc32(payload) == crc:
+                    return sequence // 2, published, payload
+            self.retries += 1
+        return None
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+def read_device_state():
+    # The device is described by its configured identity only; this is the
+    # one place that talks to it, and only the leading worker calls it
+    return {
+        "device_name": DEVICE_NAME,
+        "device_model": DEVICE_MODEL,
+        "manufacturer": DEVICE_MANUFACTURER,
+        "device_type": DEVICE_TYPE
+    }
+
+def refresh_shared_state(snapshot, stop, interval=DEVICE_REFRESH_INTERVAL):
+    # Every worker runs this; only the flock holder polls the device and publishes
+    while True:
+        if snapshot.try_lead():
+            try:
+                with metrics.device_call("read_state"):
+                    state = read_device_state()
+                snapshot.publish(json.dumps(state).encode("utf-8"))
+            except Exception as e:
+                print(f"Device state refresh failed: {e}", file=sys.stderr)
+        if stop.wait(interval):
+            return
+
+# Opened by each serving worker at startup, so importing the module or
+# running the prefork supervisor leaves no state file behind
+shared_state = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global shared_state
+    shared_state = SharedSnapshot()
+    stop = threading.Event()
+    refresher = threading.Thread(target=refresh_shared_state, args=(shared_state, stop), daemon=True)
+    refresher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        refresher.join()
+        shared_state.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = metrics.request_started()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Unknown paths share one label so scanners cannot inflate the series count
+        route = request.scope.get("route")
+        route = route.path if route is not None and status not in (404, 405) else "unmatched"
+        metrics.request_finished(started, route, request.method, status)
+
+@app.get("/metrics")
+async def get_metrics():
+    # Per worker: under prefork each process reports only its own requests
+    return Response(metrics.render(gauges={"asyncio_tasks": len(asyncio.all_tasks())}),
+                    media_type=Metrics.CONTENT_TYPE)
 
 @app.get("/info")
-def get_info():
-    return JSONResponse(
-        content={
-            "device_name": DEVICE_NAME,
-            "device_model": DEVICE_MODEL,
-            "manufacturer": DEVICE_MANUFACTURER,
-            "device_type": DEVICE_TYPE
-        }
-    )
+async def get_info(request: Request):
+    # Served straight from the shared snapshot: no device I/O, lock or IPC per request
+    snapshot = shared_state.read()
+    if snapshot is None:
+        return JSONResponse(status_code=503, content={"error": "Device state not available yet"},
+                            headers={"Retry-After": "1"})
+    version, _, payload = snapshot
+    etag = f'"{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/state/stats")
+async def get_state_stats():
+    snapshot = shared_state.read()
+    return {
+        "pid": os.getpid(),
+        "leader": shared_state.leading,
+        "version": snapshot[0] if snapshot else 0,
+        "age_seconds": round(time.time() - snapshot[1], 3) if snapshot else None,
+        "read_retries": shared_state.retries,
+    }
+
+def run_prefork(processes):
+    """
+    Supervise `processes` copies of this driver, each serving SERVER_PORT
+    with SO_REUSEPORT so the kernel spreads connections across them.
+    Workers that exit are restarted; SIGTERM or SIGINT is passed on as
+    SIGTERM and the supervisor returns once every worker has drained.
+    """
+    command = [sys.executable, os.path.abspath(__file__)]
+    env = dict(os.environ, SERVER_PROCESSES="1", SERVER_REUSE_PORT="1")
+    workers = {}  # slot -> (process, start time)
+    restarts = {slot: 0.0 for slot in range(processes)}  # slot -> earliest (re)start time
+    deadline = []
+
+    def stop(signum, frame):
+        if not deadline:
+            deadline.append(time.monotonic() + SERVER_DRAIN_TIMEOUT + 5)
+            for proc, _ in workers.values():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Supervising {processes} workers on {SERVER_HOST}:{SERVER_PORT}")
+    while workers or (restarts and not deadline):
+        now = time.monotonic()
+        for slot, at in list(restarts.items()):
+            if at <= now and not deadline:
+                del restarts[slot]
+                # Own session, so a terminal Ctrl-C reaches only the supervisor
+                proc = subprocess.Popen(command, env=env, start_new_session=True)
+                workers[slot] = (proc, now)
+                if deadline:
+                    proc.terminate()
+        for slot, (proc, started) in list(workers.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del workers[slot]
+            if not deadline:
+                print(f"Worker {proc.pid} exited with status {code}, restarting", file=sys.stderr)
+                # A worker that dies right after starting is not respawned in a tight loop
+                restarts[slot] = now + (SERVER_RESTART_DELAY if now - started < SERVER_RESTART_DELAY else 0)
+        if deadline and now > deadline[0]:
+            for proc, _ in workers.values():
+                proc.kill()
+        time.sleep(0.1)
+
+def serve_reuse_port():
+    """
+    Serve app as one prefork worker on an SO_REUSEPORT listener. uvicorn
+    handles SIGTERM itself: it stops accepting and gives in-flight requests
+    up to SERVER_DRAIN_TIMEOUT to finish.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Accepted sockets inherit this; uvicorn only sets it on listeners it binds itself
+    listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.bind((SERVER_HOST, SERVER_PORT))
+    listener.listen(2048)
+    config = uvicorn.Config(app, host=SERVER_HOST, port=SERVER_PORT,
+                            timeout_graceful_shutdown=SERVER_DRAIN_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[listener])
+
+def _count_requests(port, seconds):
+    # One keep-alive client: GET /info in a loop for `seconds`
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    count = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.request("GET", "/info")
+        conn.getresponse().read()
+        count += 1
+    conn.close()
+    return count
+
+def run_benchmark(max_workers=4, seconds=5.0, clients=8):
+    # GET /info throughput with 1..max_workers prefork workers behind one port
+    for workers in range(1, max_workers + 1):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        state_path = os.path.join(tempfile.gettempdir(), f"dassad-bench-{port}.state")
+        env = dict(os.environ, SERVER_HOST="127.0.0.1", SERVER_PORT=str(port),
+                   SERVER_PROCESSES=str(workers), SHARED_STATE_PATH=state_path)
+        supervisor = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                    conn.request("GET", "/info")
+                    if conn.getresponse().status == 200:
+                        break
+                except OSError:
+                    pass
+                time.sleep(0.2)
+            with ProcessPoolExecutor(clients) as pool:
+                total = sum(pool.map(_count_requests, [port] * clients, [seconds] * clients))
+            rate = total / seconds
+            print(f"{workers} workers: {rate:8.0f} req/s  {rate / workers:8.0f} req/s per worker")
+        finally:
+            supervisor.terminate()
+            supervisor.wait()
+            os.unlink(state_path)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
+    if sys.argv[1:2] == ["bench"]:
+        run_benchmark(*(t(a) for t, a in zip((int, float, int), sys.argv[2:5])))
+    elif SERVER_PROCESSES > 1:
+        run_prefork(SERVER_PROCESSES)
+    elif SERVER_REUSE_PORT:
+        serve_reuse_port()
+    else:
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
@@ -1,8 +1,165 @@
 import os
+import signal
+import subprocess
+import sys
+import socket
 import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import parse_qs, urlparse
+import queue
+import selectors
 import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
 
 # Mock device communication backend for demonstration purposes
 
@@ -13,70 +170,365 @@ class DeviceConnection:
     def send_command(self, command_payload):
         # Simulate sending a command to the device and getting a response
         # Replace with real device communication logic for actual use
-        return {
-            "status": "success",
-            "sent_command": command_payload,
-            "device_ip": self.ip
-        }
+        with metrics.device_call("send_command"):
+            return {
+                "status": "success",
+                "sent_command": command_payload,
+                "device_ip": self.ip
+            }
 
     def get_data(self):
         # Simulate retrieving data points from the device
         # Replace with real device communication logic for actual use
-        return {
-            "temperature": 23.5,
-            "humidity": 45.1,
-            "device_ip": self.ip
-        }
+        with metrics.device_call("get_data"):
+            return {
+                "temperature": 23.5,
+                "humidity": 45.1,
+                "device_ip": self.ip
+            }
 
 # Environment variable configuration
 DEVICE_IP = os.environ.get("DEVICE_IP", "127.0.0.1")
 SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "8080"))
+# Worker pool: threads, connections allowed to wait for a worker before
+# shedding with 503, Retry-After seconds, and per-connection idle timeout
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "16"))
+SERVER_QUEUE_SIZE = int(os.environ.get("SERVER_QUEUE_SIZE", "64"))
+SERVER_RETRY_AFTER = int(os.environ.get("SERVER_RETRY_AFTER", "1"))
+SERVER_IDLE_TIMEOUT = float(os.environ.get("SERVER_IDLE_TIMEOUT", "10"))
+# Requests served on one keep-alive connection before it is closed
+SERVER_KEEPALIVE_MAX_REQUESTS = int(os.environ.get("SERVER_KEEPALIVE_MAX_REQUESTS", "1000"))
+# Keep-alive connections allowed to sit idle on a worker between requests;
+# past that (or while connections are queued) responses close the connection
+SERVER_KEEPALIVE_IDLE = int(os.environ.get("SERVER_KEEPALIVE_IDLE", "8"))
+# Prefork: copies of this driver sharing SERVER_PORT through SO_REUSEPORT
+# (1 = serve from this process), seconds a stopping process may spend on
+# queued and in-flight requests, and the pause before restarting a worker
+# that died right after starting
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", "1"))
+SERVER_REUSE_PORT = os.environ.get("SERVER_REUSE_PORT", "0") == "1"
+SERVER_DRAIN_TIMEOUT = float(os.environ.get("SERVER_DRAIN_TIMEOUT", "15"))
+SERVER_RESTART_DELAY = float(os.environ.get("SERVER_RESTART_DELAY", "1"))
 
 device_conn = DeviceConnection(DEVICE_IP)
 
 class DeviceHTTPRequestHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, status=200, content_type="application/json"):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; keep Nagle from delaying the body
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.requests_served = 0
+        self.idle_held = False
+        try:
+            super().handle()
+        finally:
+            self._release_idle()
+
+    def _release_idle(self):
+        if self.idle_held:
+            self.idle_held = False
+            self.server.release_idle()
+
+    def end_headers(self):
+        # Persistent connections are recycled after SERVER_KEEPALIVE_MAX_REQUESTS, and
+        # only kept open while the server has an idle keep-alive slot to spare
+        self.requests_served += 1
+        if not self.close_connection and not self.idle_held:
+            if self.requests_served >= SERVER_KEEPALIVE_MAX_REQUESTS or not self.server.hold_idle():
+                self.send_header('Connection', 'close')
+            else:
+                self.idle_held = True
+        super().end_headers()
+
+    def parse_request(self):
+        # The request line is in: time from here, not from the keep-alive wait before it
+        self._release_idle()
+        self.started = metrics.request_started()
+        self.status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                # Unknown paths share one label so scanners cannot inflate the series count
+                unmatched = self.command is None or self.status in (404, 405, 501)
+                route = "unmatched" if unmatched else self.path.partition("?")[0]
+                metrics.request_finished(self.started, route, self.command or "-", self.status or 0)
+
+    def _send_metrics(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", Metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _set_headers(self, status=200, content_type="application/json", length=0):
         self.send_response(status)
         self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(length))
         self.end_headers()
 
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        self._set_headers(status, length=len(body))
+        self.wfile.write(body)
+
     def do_GET(self):
         parsed_path = urlparse(self.path)
         if parsed_path.path == "/data":
-            self._set_headers()
-            data = device_conn.get_data()
-            self.wfile.write(json.dumps(data).encode('utf-8'))
+            self._send_json(device_conn.get_data())
+        elif parsed_path.path == "/metrics":
+            self._send_metrics()
+        elif parsed_path.path == "/server/stats":
+            self._send_json(self.server.stats())
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode('utf-8'))
+            self._send_json({"error": "Not found"}, 404)
 
     def do_POST(self):
         parsed_path = urlparse(self.path)
+        # Always consume the body so the next request on the connection parses cleanly
+        content_length = int(self.headers.get('Content-Length', 0))
+        post_data = self.rfile.read(content_length)
         if parsed_path.path == "/cmd":
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
             try:
                 payload = json.loads(post_data)
             except Exception:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode('utf-8'))
+                self._send_json({"error": "Invalid JSON"}, 400)
                 return
-            resp = device_conn.send_command(payload)
-            self._set_headers()
-            self.wfile.write(json.dumps(resp).encode('utf-8'))
+            self._send_json(device_conn.send_command(payload))
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode('utf-8'))
+            self._send_json({"error": "Not found"}, 404)
 
     def log_message(self, format, *args):
         # Suppress default HTTP server logging
         return
 
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server with a fixed pool of worker threads fed from a bounded
+    queue. Connections arriving while the queue is full get an immediate
+    503 with Retry-After instead of waiting behind slow device calls.
+    Settings are passed in by the caller, so every driver carries the same
+    copy of this class whatever its environment variables are called.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64, retry_after=1,
+                 reuse_port=False, keepalive_idle=8, idle_timeout=10.0, drain_timeout=15.0):
+        self.reuse_port = reuse_port
+        self.draining = False
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        # At least one worker is always left for new connections
+        self.keepalive_idle = max(min(keepalive_idle, workers - 1), 0)
+        self._idle = 0
+        self.retry_after = retry_after
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._counters = {"accepted": 0, "served": 0, "rejected": 0}
+        self._busy = 0
+        self._lingering = {}  # rejected socket -> time it is closed regardless
+        self._linger_selector = selectors.DefaultSelector()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._linger, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            self._reject(request)
+            return
+        with self._lock:
+            self._counters["accepted"] += 1
+
+    def _reject(self, request):
+        with self._lock:
+            self._counters["rejected"] += 1
+        metrics.inc("http_connections_rejected_total")
+        body = b'{"error": "Server busy, retry later"}'
+        try:
+            request.setblocking(False)
+            request.send(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n"
+                         b"Connection: close\r\n\r\n%s" % (self.retry_after, len(body), body))
+            # Half-close and keep reading until the client closes: closing with
+            # its request still unread would reset the connection under the 503
+            request.shutdown(socket.SHUT_WR)
+            with self._lock:
+                if len(self._lingering) < 1024:
+                    self._linger_selector.register(request, selectors.EVENT_READ)
+                    self._lingering[request] = time.monotonic() + 2.0
+                    return
+        except OSError:
+            pass
+        request.close()
+
+    def _linger(self):
+        # Reads and discards whatever rejected clients still send, then closes them
+        while True:
+            events = self._linger_selector.select(0.5)
+            now = time.monotonic()
+            with self._lock:
+                for key, _ in events:
+                    try:
+                        done = not key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        done = False
+                    except OSError:
+                        done = True
+                    if done:
+                        self._unlinger(key.fileobj)
+                for sock, deadline in list(self._lingering.items()):
+                    if deadline < now:
+                        self._unlinger(sock)
+
+    def _unlinger(self, sock):
+        # Called with the lock held
+        if self._lingering.pop(sock, None) is not None:
+            self._linger_selector.unregister(sock)
+            sock.close()
+
+    def _work(self):
+        while True:
+            request, client_address, enqueued = self._queue.get()
+            with self._lock:
+                self._waits.append(time.monotonic() - enqueued)
+                self._busy += 1
+            try:
+                # Idle or stalled clients give their worker back after the timeout
+                request.settimeout(self.idle_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self._busy -= 1
+                    self._counters["served"] += 1
+
+    def hold_idle(self):
+        """
+        Reserve an idle keep-alive slot for a connection about to wait for its
+        next request; False means the response should close the connection.
+        """
+        with self._lock:
+            if self.draining or self._idle >= self.keepalive_idle or not self._queue.empty():
+                return False
+            self._idle += 1
+            return True
+
+    def release_idle(self):
+        with self._lock:
+            self._idle -= 1
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Every process bound to the port (prefork workers, or a replacement
+            # starting while this one drains) gets a share of new connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def drain(self, timeout=None):
+        """Stop accepting, then wait for queued and in-flight connections to finish."""
+        self.draining = True
+        self.server_close()
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._counters["accepted"] == self._counters["served"]:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def serve_until_terminated(self):
+        """serve_forever() until SIGTERM, then drain."""
+        # shutdown() waits for serve_forever() to return, so it cannot run inside the handler
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.shutdown).start())
+        self.serve_forever()
+        self.drain()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counters, pid=os.getpid(), workers=self.workers, busy=self._busy,
+                         idle_keepalive=self._idle, queued=self._queue.qsize())
+        if waits:
+            stats["queue_wait_ms"] = {
+                "p50": round(waits[len(waits) // 2] * 1000, 3),
+                "p99": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3),
+                "max": round(waits[-1] * 1000, 3),
+            }
+        return stats
+
+def run_prefork(processes):
+    """
+    Supervise `processes` copies of this driver, each serving SERVER_PORT
+    with SO_REUSEPORT so the kernel spreads connections across them.
+    Workers that exit are restarted; SIGTERM or SIGINT is passed on as
+    SIGTERM and the supervisor returns once every worker has drained.
+    """
+    command = [sys.executable, os.path.abspath(__file__)]
+    env = dict(os.environ, SERVER_PROCESSES="1", SERVER_REUSE_PORT="1")
+    workers = {}  # slot -> (process, start time)
+    restarts = {slot: 0.0 for slot in range(processes)}  # slot -> earliest (re)start time
+    deadline = []
+
+    def stop(signum, frame):
+        if not deadline:
+            deadline.append(time.monotonic() + SERVER_DRAIN_TIMEOUT + 5)
+            for proc, _ in workers.values():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Supervising {processes} workers on {SERVER_HOST}:{SERVER_PORT}")
+    while workers or (restarts and not deadline):
+        now = time.monotonic()
+        for slot, at in list(restarts.items()):
+            if at <= now and not deadline:
+                del restarts[slot]
+                # Own session, so a terminal Ctrl-C reaches only the supervisor
+                proc = subprocess.Popen(command, env=env, start_new_session=True)
+                workers[slot] = (proc, now)
+                if deadline:
+                    proc.terminate()
+        for slot, (proc, started) in list(workers.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del workers[slot]
+            if not deadline:
+                print(f"Worker {proc.pid} exited with status {code}, restarting", file=sys.stderr)
+                # A worker that dies right after starting is not respawned in a tight loop
+                restarts[slot] = now + (SERVER_RESTART_DELAY if now - started < SERVER_RESTART_DELAY else 0)
+        if deadline and now > deadline[0]:
+            for proc, _ in workers.values():
+                proc.kill()
+        time.sleep(0.1)
+
 def run_server():
-    server = HTTPServer((SERVER_HOST, SERVER_PORT), DeviceHTTPRequestHandler)
+    if SERVER_PROCESSES > 1:
+        run_prefork(SERVER_PROCESSES)
+        return
+    server = PooledHTTPServer((SERVER_HOST, SERVER_PORT), DeviceHTTPRequestHandler, workers=SERVER_WORKERS,
+                              queue_size=SERVER_QUEUE_SIZE, retry_after=SERVER_RETRY_AFTER,
+                              reuse_port=SERVER_REUSE_PORT, keepalive_idle=SERVER_KEEPALIVE_IDLE,
+                              idle_timeout=SERVER_IDLE_TIMEOUT, drain_timeout=SERVER_DRAIN_TIMEOUT)
     print(f"Starting deesasd device driver HTTP server at http://{SERVER_HOST}:{SERVER_PORT}")
-    server.serve_forever()
+    server.serve_until_terminated()
 
 if __name__ == "__main__":
     run_server()
\ No newline at end of file
@@ -1,81 +1,968 @@
 import os
 import asyncio
+import itertools
 import json
-from aiohttp import web
+import math
+from bisect import bisect_left
+from contextlib import contextmanager
+from aiohttp import web, WSMsgType
+import numpy as np
 import socket
 import struct
+import sys
+import threading
+import time
+import timeit
 
 # --- Environment Configuration ---
 DEVICE_IP = os.getenv("DEVICE_IP", "127.0.0.1")
 ROS_MASTER_URI = os.getenv("ROS_MASTER_URI", "http://localhost:11311")
+# Telemetry the robot publishes to this driver: local ports and bind address
 PEOPLE_TRACKING_UDP_PORT = int(os.getenv("PEOPLE_TRACKING_UDP_PORT", "15001"))
 STATUS_UDP_PORT = int(os.getenv("STATUS_UDP_PORT", "15002"))
+TELEMETRY_UDP_HOST = os.getenv("TELEMETRY_UDP_HOST", "0.0.0.0")
 CMD_VEL_UDP_PORT = int(os.getenv("CMD_VEL_UDP_PORT", "15003"))
 NAV_UDP_PORT = int(os.getenv("NAV_UDP_PORT", "15004"))
 SERVER_HOST = os.getenv("HTTP_SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("HTTP_SERVER_PORT", "8080"))
 UDP_TIMEOUT = float(os.getenv("UDP_TIMEOUT", "0.5"))
+# Default freshness bound for /status and /people when the caller passes no max_age
+TELEMETRY_MAX_AGE = float(os.getenv("TELEMETRY_MAX_AGE", "1.0"))
+# WebSocket teleop: cmd_vel send rate and dead-man timeout that zeroes velocity
+TELEOP_RATE_HZ = float(os.getenv("TELEOP_RATE_HZ", "50"))
+if not TELEOP_RATE_HZ > 0:
+    raise ValueError(f"TELEOP_RATE_HZ must be positive, not {TELEOP_RATE_HZ}")
+TELEOP_DEADMAN_TIMEOUT = float(os.getenv("TELEOP_DEADMAN_TIMEOUT", "0.5"))
+# Wire encoding for cmd_vel and nav datagrams: "json" or "binary"
+UDP_CODEC = os.getenv("UDP_CODEC", "json")
+if UDP_CODEC not in ("json", "binary"):
+    raise ValueError(f"UDP_CODEC must be 'json' or 'binary', not {UDP_CODEC!r}")
+# RealSense D435i depth stream: fragmented 16-bit frames pushed by the robot over UDP
+DEPTH_UDP_HOST = os.getenv("DEPTH_UDP_HOST", "0.0.0.0")
+DEPTH_UDP_PORT = int(os.getenv("DEPTH_UDP_PORT", "15005"))
+DEPTH_WIDTH = int(os.getenv("DEPTH_WIDTH", "848"))
+DEPTH_HEIGHT = int(os.getenv("DEPTH_HEIGHT", "480"))
+DEPTH_FRAGMENT_SIZE = int(os.getenv("DEPTH_FRAGMENT_SIZE", "8192"))
+DEPTH_SCALE = float(os.getenv("DEPTH_SCALE", "0.001"))
+DEPTH_FX = float(os.getenv("DEPTH_FX", "421.0"))
+DEPTH_FY = float(os.getenv("DEPTH_FY", "421.0"))
+DEPTH_CX = float(os.getenv("DEPTH_CX", "424.0"))
+DEPTH_CY = float(os.getenv("DEPTH_CY", "240.0"))
+# People stream: minimum movement (metres) before a track is re-sent
+PEOPLE_MOVE_THRESHOLD = float(os.getenv("PEOPLE_MOVE_THRESHOLD", "0.05"))
 
-# --- UDP Helper Functions ---
-async def udp_request(ip, port, message=None, expect_reply=True):
-    loop = asyncio.get_event_loop()
-    def udp_send_recv():
+# --- Metrics ---
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# --- UDP Transport ---
+class UdpEndpoint(asyncio.DatagramProtocol):
+    """
+    Persistent datagram endpoint connected to one robot port. Commands are
+    fire-and-forget: the robot publishes status and people data to the
+    telemetry ports (TelemetryCache), so nothing is read back here.
+    """
+    def __init__(self):
+        self.transport = None
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable) only mean the robot missed a command
+        pass
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.transport.close()
+
+    def send(self, message):
+        self.transport.sendto(message)
+
+udp_endpoints = {}
+_udp_endpoints_lock = asyncio.Lock()
+
+async def get_udp_endpoint(ip, port):
+    endpoint = udp_endpoints.get((ip, port))
+    if endpoint is None or endpoint.closed:
+        async with _udp_endpoints_lock:
+            endpoint = udp_endpoints.get((ip, port))
+            if endpoint is None or endpoint.closed:
+                loop = asyncio.get_running_loop()
+                _, endpoint = await loop.create_datagram_endpoint(
+                    UdpEndpoint, remote_addr=(ip, port), family=socket.AF_INET)
+                udp_endpoints[(ip, port)] = endpoint
+    return endpoint
+
+async def udp_send(ip, port, message, operation="send"):
+    with metrics.device_call(operation) as call:
+        endpoint = await get_udp_endpoint(ip, port)
+        endpoint.send(message)
+        call["sent"] = len(message)
+
+async def open_udp_endpoints(app):
+    for port in (CMD_VEL_UDP_PORT, NAV_UDP_PORT):
+        await get_udp_endpoint(DEVICE_IP, port)
+
+async def close_udp_endpoints(app):
+    for endpoint in udp_endpoints.values():
+        endpoint.close()
+    udp_endpoints.clear()
+
+# --- Wire Codecs ---
+# Binary datagrams start with a message type byte; JSON always starts with "{"
+# or whitespace, so replies are decoded by sniffing the first byte.
+MSG_TWIST = 0x01
+MSG_NAV = 0x02
+MSG_MAP = 0x03
+TWIST_STRUCT = struct.Struct("<B6f")
+TWIST_AXES = ("x", "y", "z")
+
+_U8 = struct.Struct("<B")
+_I8 = struct.Struct("<b")
+_U16 = struct.Struct("<H")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+def _encode_value(value, out):
+    # Tagged value: n=None t/f=bool b=int8 i=int64 d=float64 s=str l=list m=map
+    if value is None:
+        out += b"n"
+    elif value is True:
+        out += b"t"
+    elif value is False:
+        out += b"f"
+    elif isinstance(value, int) and -128 <= value < 128:
+        out += b"b"
+        out += _I8.pack(value)
+    elif isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+        out += b"i"
+        out += _I64.pack(value)
+    elif isinstance(value, (int, float)):
+        out += b"d"
+        out += _F64.pack(value)
+    elif isinstance(value, str):
+        raw = value.encode()
+        out += b"s"
+        out += _U16.pack(len(raw))
+        out += raw
+    elif isinstance(value, (list, tuple)):
+        out += b"l"
+        out += _U16.pack(len(value))
+        for item in value:
+            _encode_value(item, out)
+    elif isinstance(value, dict):
+        out += b"m"
+        out += _U16.pack(len(value))
+        for key, item in value.items():
+            raw = str(key).encode()
+            out += _U8.pack(len(raw))
+            out += raw
+            _encode_value(item, out)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def _decode_value(buf, pos):
+    tag = buf[pos]
+    pos += 1
+    if tag == 0x6E:  # n
+        return None, pos
+    if tag == 0x74:  # t
+        return True, pos
+    if tag == 0x66:  # f
+        return False, pos
+    if tag == 0x62:  # b
+        return _I8.unpack_from(buf, pos)[0], pos + 1
+    if tag == 0x69:  # i
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == 0x64:  # d
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag == 0x73:  # s
+        size = _U16.unpack_from(buf, pos)[0]
+        pos += 2
+        return bytes(buf[pos:pos + size]).decode(), pos + size
+    if tag == 0x6C:  # l
+        count = _U16.unpack_from(buf, pos)[0]
+        pos += 2
+        items = []
+        for _ in range(count):
+            item, pos = _decode_value(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == 0x6D:  # m
+        count = _U16.unpack_from(buf, pos)[0]
+        pos += 2
+        result = {}
+        for _ in range(count):
+            size = buf[pos]
+            key = bytes(buf[pos + 1:pos + 1 + size]).decode()
+            result[key], pos = _decode_value(buf, pos + 1 + size)
+        return result, pos
+    raise ValueError(f"Unknown value tag {tag:#x}")
+
+def encode_twist(cmd, codec=None):
+    if (codec or UDP_CODEC) == "binary":
+        linear, angular = cmd["linear"], cmd["angular"]
+        return TWIST_STRUCT.pack(MSG_TWIST, *(float(linear.get(a, 0)) for a in TWIST_AXES),
+                                 *(float(angular.get(a, 0)) for a in TWIST_AXES))
+    return json.dumps(cmd).encode()
+
+def decode_twist(data):
+    if data[:1] == bytes((MSG_TWIST,)):
+        values = TWIST_STRUCT.unpack(data)[1:]
+        return {"linear": dict(zip(TWIST_AXES, values[:3])), "angular": dict(zip(TWIST_AXES, values[3:]))}
+    return json.loads(data.decode())
+
+def encode_nav(cmd, codec=None):
+    if (codec or UDP_CODEC) == "binary":
+        out = bytearray((MSG_NAV,))
+        _encode_value(cmd["action"], out)
+        _encode_value(cmd["params"], out)
+        return bytes(out)
+    return json.dumps(cmd).encode()
+
+def decode_nav(data):
+    if data[:1] == bytes((MSG_NAV,)):
+        action, pos = _decode_value(data, 1)
+        params, _ = _decode_value(data, pos)
+        return {"action": action, "params": params}
+    return json.loads(data.decode())
+
+def encode_map(value):
+    # Tagged binary form of a status or people reply
+    out = bytearray((MSG_MAP,))
+    _encode_value(value, out)
+    return bytes(out)
+
+# --- Telemetry Subscriber ---
+def decode_telemetry(data):
+    try:
+        if data[:1] == bytes((MSG_MAP,)):
+            return _decode_value(data, 1)[0]
+        return json.loads(data.decode())
+    except Exception:
+        return {"raw": data.decode(errors="ignore")}
+
+class TelemetryCache:
+    """
+    Latest decoded snapshot of one telemetry stream, kept pre-encoded for
+    serving. The robot publishes the stream to a local port this cache
+    binds; a burst of datagrams is drained in one wakeup and only the newest
+    is decoded.
+    """
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.sock = None
+        self.value = None
+        self.body = None
+        self.seq = 0
+        self.updated_at = None
+        self.hits = 0
+        self.misses = 0
+        self._waiters = set()
+
+    def open(self, host=TELEMETRY_UDP_HOST):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, self.port))
+        sock.setblocking(False)
+        self.sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def _on_readable(self):
+        latest = None
+        received = 0
+        for _ in range(64):
+            try:
+                data = self.sock.recv(65535)
+            except (BlockingIOError, InterruptedError, OSError):
+                break
+            received += len(data)
+            if data:
+                latest = data
+        if received:
+            metrics.inc("device_io_bytes_total", (("operation", f"{self.name}_telemetry"), ("direction", "received")), received)
+        if latest is not None:
+            self.update(decode_telemetry(latest))
+
+    def update(self, value):
+        self.value = value
+        self.body = json.dumps(value).encode()
+        self.seq += 1
+        self.updated_at = time.monotonic()
+        waiters, self._waiters = self._waiters, set()
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def wait_update(self, timeout):
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.add(fut)
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # Timed-out waiters would otherwise pile up while no telemetry arrives
+            self._waiters.discard(fut)
+
+    def age(self):
+        if self.updated_at is None:
+            return None
+        return time.monotonic() - self.updated_at
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "seq": self.seq,
+            "age": self.age(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+status_telemetry = TelemetryCache("status", STATUS_UDP_PORT)
+people_telemetry = TelemetryCache("people", PEOPLE_TRACKING_UDP_PORT)
+
+async def telemetry_response(request, cache, error):
+    try:
+        max_age = float(request.query.get("max_age", TELEMETRY_MAX_AGE))
+    except ValueError:
+        return web.json_response({"error": "Invalid max_age"}, status=400)
+    age = cache.age()
+    if age is not None and age <= max_age:
+        cache.hits += 1
+    else:
+        # Nothing fresh enough in memory: wait for the next datagram on the stream
+        cache.misses += 1
+        if not await cache.wait_update(UDP_TIMEOUT):
+            return web.json_response({"error": error}, status=504)
+        age = cache.age()
+    return web.Response(body=cache.body, content_type="application/json", headers={
+        "X-Telemetry-Seq": str(cache.seq),
+        "X-Telemetry-Age": f"{age:.6f}",
+    })
+
+async def start_telemetry(app):
+    for cache in (status_telemetry, people_telemetry):
+        cache.open()
+
+async def stop_telemetry(app):
+    for cache in (status_telemetry, people_telemetry):
+        cache.close()
+
+# --- Depth Frame Receiver ---
+# Every depth datagram: frame id (u32), fragment index (u16), fragment count (u16),
+# then DEPTH_FRAGMENT_SIZE bytes of the little-endian uint16 frame (last one shorter).
+DEPTH_HEADER = struct.Struct("<IHH")
+
+class DepthFrameReceiver:
+    """
+    Reassembles fragmented depth frames straight into two preallocated frame
+    buffers: one being assembled and the latest complete one. Packets for
+    an older frame are reordered stragglers and dropped, unless the ids jump
+    back by more than RESYNC_GAP or RESYNC_FRAMES older frames arrive in a
+    row: then the robot restarted its frame counter and the stream resyncs.
+    """
+    RESYNC_GAP = 64
+    RESYNC_FRAMES = 3
+
+    def __init__(self, width=DEPTH_WIDTH, height=DEPTH_HEIGHT, fragment_size=DEPTH_FRAGMENT_SIZE):
+        self.width = width
+        self.height = height
+        self.fragment_size = fragment_size
+        self.frame_bytes = width * height * 2
+        self.fragment_count = -(-self.frame_bytes // fragment_size)
+        self.sock = None
+        self._assembling = bytearray(self.frame_bytes)
+        self._ready = bytearray(self.frame_bytes)
+        self._packet = bytearray(DEPTH_HEADER.size + fragment_size)
+        self._payload = memoryview(self._packet)[DEPTH_HEADER.size:]
+        self._seen = bytearray(self.fragment_count)
+        self._no_fragments = bytes(self.fragment_count)
+        self._frame_id = None
+        self._received = 0
+        self.frame_id = None
+        self.frame_at = None
+        self.started_at = time.monotonic()
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self.malformed = 0
+        self.resyncs = 0
+        self._late_frame_id = None
+        self._late_frames = 0
+
+    def open(self, host=DEPTH_UDP_HOST, port=DEPTH_UDP_PORT):
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(UDP_TIMEOUT)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * self.frame_bytes)
+        sock.bind((host, port))
+        sock.setblocking(False)
+        self.sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def _on_readable(self):
+        # Drain a bounded batch per wakeup so HTTP handlers still get loop time
+        received = 0
         try:
-            if message:
-                sock.sendto(message, (ip, port))
-            if expect_reply:
-                data, _ = sock.recvfrom(65535)
-                return data
-            return b""
-        except socket.timeout:
-            return b""
+            for _ in range(512):
+                try:
+                    n = self.sock.recv_into(self._packet)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    return
+                received += n
+                self._on_packet(n)
         finally:
-            sock.close()
-    data = await loop.run_in_executor(None, udp_send_recv)
-    return data
+            # One metrics update per batch rather than per fragment
+            if received:
+                metrics.inc("device_io_bytes_total", (("operation", "depth_stream"), ("direction", "received")), received)
+
+    def _on_packet(self, n):
+        self.packets += 1
+        self.bytes += n
+        if n < DEPTH_HEADER.size:
+            self.malformed += 1
+            return
+        frame_id, index, count = DEPTH_HEADER.unpack_from(self._packet)
+        offset = index * self.fragment_size
+        size = min(self.fragment_size, self.frame_bytes - offset)
+        if count != self.fragment_count or index >= count or n - DEPTH_HEADER.size != size:
+            self.malformed += 1
+            return
+        if frame_id != self._frame_id:
+            behind = 0 if self._frame_id is None else (self._frame_id - frame_id) & 0xFFFFFFFF
+            if 0 < behind < 0x80000000:
+                if frame_id != self._late_frame_id:
+                    self._late_frame_id = frame_id
+                    self._late_frames += 1
+                if behind <= self.RESYNC_GAP and self._late_frames < self.RESYNC_FRAMES:
+                    self.late += 1
+                    return
+                self.resyncs += 1
+            self._late_frame_id = None
+            self._late_frames = 0
+            if self._received:
+                self.dropped += 1
+            self._frame_id = frame_id
+            self._received = 0
+            self._seen[:] = self._no_fragments
+        if self._seen[index]:
+            return
+        self._assembling[offset:offset + size] = self._payload[:size]
+        self._seen[index] = 1
+        self._received += 1
+        if self._received == count:
+            self._assembling, self._ready = self._ready, self._assembling
+            self._received = 0
+            self.frame_id = frame_id
+            self.frame_at = time.monotonic()
+            self.frames += 1
+
+    def latest(self):
+        # Zero-copy view of the latest complete frame; valid until the next await
+        if self.frame_id is None:
+            return None
+        return np.frombuffer(self._ready, dtype="<u2").reshape(self.height, self.width)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "late_packets": self.late,
+            "resyncs": self.resyncs,
+            "malformed_packets": self.malformed,
+            "packets": self.packets,
+            "fps": self.frames / elapsed,
+            "mbit_per_s": self.bytes * 8 / elapsed / 1e6,
+            "frame_id": self.frame_id,
+            "frame_age": None if self.frame_at is None else time.monotonic() - self.frame_at,
+        }
+
+depth_receiver = DepthFrameReceiver()
+
+def crop_and_decimate(depth, roi, step):
+    x, y, w, h = roi
+    return depth[y:y + h:step, x:x + w:step]
+
+def clip_range(depth, scale, min_m, max_m):
+    # Depth outside [min_m, max_m] becomes 0, the RealSense "no data" value
+    lo = int(min(np.ceil(min_m / scale), 65536))
+    hi = int(min(np.floor(max_m / scale), 65535))
+    out = depth.copy()
+    out[(out < lo) | (out > hi)] = 0
+    return out
+
+def depth_to_points(depth, scale, origin, step, max_points):
+    # Deproject valid pixels with the pinhole intrinsics, evenly subsampled
+    v, u = np.nonzero(depth)
+    if len(v) > max_points:
+        keep = np.linspace(0, len(v) - 1, max_points).astype(np.intp)
+        v, u = v[keep], u[keep]
+    z = depth[v, u].astype(np.float32) * np.float32(scale)
+    px = origin[0] + u.astype(np.float32) * step
+    py = origin[1] + v.astype(np.float32) * step
+    points = np.empty((len(z), 3), dtype=np.float32)
+    points[:, 0] = (px - DEPTH_CX) * z / DEPTH_FX
+    points[:, 1] = (py - DEPTH_CY) * z / DEPTH_FY
+    points[:, 2] = z
+    return points
+
+async def start_depth_receiver(app):
+    depth_receiver.open()
+
+async def stop_depth_receiver(app):
+    depth_receiver.close()
 
 # --- /status Endpoint ---
 async def handle_status(request):
-    # Compose a UDP status request; protocol assumed: send nothing, receive JSON
-    data = await udp_request(DEVICE_IP, STATUS_UDP_PORT, expect_reply=True)
-    if not data:
-        return web.json_response({"error": "No status reply from robot"}, status=504)
-    try:
-        status = json.loads(data.decode())
-    except Exception:
-        status = {"raw": data.decode(errors="ignore")}
-    return web.json_response(status)
+    # Served from the latest status datagram the robot published
+    return await telemetry_response(request, status_telemetry, "No status reply from robot")
 
 # --- /people Endpoint ---
 async def handle_people(request):
-    # Compose a UDP people tracking request; protocol assumed: send nothing, receive JSON
-    data = await udp_request(DEVICE_IP, PEOPLE_TRACKING_UDP_PORT, expect_reply=True)
-    if not data:
-        return web.json_response({"error": "No people data reply from robot"}, status=504)
+    # Served from the latest people tracking datagram the robot published
+    return await telemetry_response(request, people_telemetry, "No people data reply from robot")
+
+# --- /people/stream Endpoint ---
+def extract_tracks(value):
+    # Accepts a bare list of tracks or {"people": [...]} / {"tracks": [...]};
+    # positions are "x"/"y" on the track or under "position"
+    if isinstance(value, dict):
+        value = value.get("people", value.get("tracks", []))
+    if not isinstance(value, list):
+        value = []
+    tracks = [t for t in value if isinstance(t, dict)]
+    ids = np.array([str(t.get("id", i)) for i, t in enumerate(tracks)], dtype=str)
+    xy = np.empty((len(tracks), 2), dtype=np.float64)
+    for i, t in enumerate(tracks):
+        pos = t.get("position", t)
+        try:
+            xy[i] = (float(pos.get("x", np.nan)), float(pos.get("y", np.nan)))
+        except (TypeError, ValueError, AttributeError):
+            xy[i] = np.nan
+    return tracks, ids, xy
+
+class PeopleDeltaEncoder:
+    """
+    Per-subscriber state for the people stream: the first update is a full
+    snapshot, later ones only carry added, moved and removed tracks.
+    """
+    def __init__(self, threshold=PEOPLE_MOVE_THRESHOLD, radius=None, center=(0.0, 0.0), bbox=None):
+        self.threshold = threshold
+        self.radius = radius
+        self.center = center
+        self.bbox = bbox
+        self.ids = None
+        self.track_ids = None
+        self.xy = None
+
+    def _filter(self, xy):
+        mask = ~np.isnan(xy).any(axis=1) if (self.radius is not None or self.bbox is not None) else np.ones(len(xy), dtype=bool)
+        if self.radius is not None:
+            d = xy - np.asarray(self.center)
+            mask &= np.einsum("ij,ij->i", d, d) <= self.radius * self.radius
+        if self.bbox is not None:
+            xmin, ymin, xmax, ymax = self.bbox
+            mask &= (xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax)
+        return mask
+
+    def encode(self, value):
+        # Returns (event, payload), or None when nothing changed for this subscriber
+        tracks, ids, xy = extract_tracks(value)
+        keep = np.flatnonzero(self._filter(xy))
+        # A repeated id keeps only its last entry, so ids stay unique for the matching below
+        _, last = np.unique(ids[keep][::-1], return_index=True)
+        keep = keep[np.sort(len(keep) - 1 - last)]
+        ids, xy = ids[keep], xy[keep]
+        # Original (unstringified) ids, so removals echo what the robot sent
+        track_ids = [tracks[i].get("id", i) for i in keep]
+        if self.ids is None:
+            self.ids, self.track_ids, self.xy = ids, track_ids, xy
+            return "snapshot", {"tracks": [tracks[i] for i in keep]}
+        _, cur, prev = np.intersect1d(ids, self.ids, assume_unique=True, return_indices=True)
+        d = xy[cur] - self.xy[prev]
+        dist2 = np.einsum("ij,ij->i", d, d)
+        # A track that gains or loses its position also counts as moved
+        located_changed = np.isnan(xy[cur]).any(axis=1) != np.isnan(self.xy[prev]).any(axis=1)
+        moved = cur[(dist2 > self.threshold * self.threshold) | located_changed]
+        is_new = np.ones(len(ids), dtype=bool)
+        is_new[cur] = False
+        added = np.flatnonzero(is_new)
+        still_here = np.zeros(len(self.ids), dtype=bool)
+        still_here[prev] = True
+        removed = [self.track_ids[i] for i in np.flatnonzero(~still_here)]
+        # Remember the position last sent, so slow drift still adds up past the threshold
+        new_xy = np.empty_like(xy)
+        new_xy[cur] = self.xy[prev]
+        new_xy[moved] = xy[moved]
+        new_xy[added] = xy[added]
+        self.ids, self.track_ids, self.xy = ids, track_ids, new_xy
+        if not (len(added) or len(moved) or len(removed)):
+            return None
+        return "delta", {
+            "added": [tracks[keep[i]] for i in added],
+            "moved": [tracks[keep[i]] for i in moved],
+            "removed": removed,
+        }
+
+def parse_people_stream_query(query):
+    threshold = float(query.get("threshold", PEOPLE_MOVE_THRESHOLD))
+    radius = float(query["radius"]) if "radius" in query else None
+    center = tuple(float(v) for v in query.get("center", "0,0").split(","))
+    bbox = tuple(float(v) for v in query["bbox"].split(",")) if "bbox" in query else None
+    if len(center) != 2 or (bbox is not None and len(bbox) != 4):
+        raise ValueError("center must be x,y and bbox xmin,ymin,xmax,ymax")
+    return PeopleDeltaEncoder(threshold, radius, center, bbox)
+
+async def handle_people_stream(request):
+    # Server-sent events: one snapshot, then deltas as people telemetry arrives
     try:
-        people = json.loads(data.decode())
-    except Exception:
-        people = {"raw": data.decode(errors="ignore")}
-    return web.json_response(people)
+        encoder = parse_people_stream_query(request.query)
+    except ValueError as exc:
+        return web.json_response({"error": f"Invalid stream query: {exc}"}, status=400)
+    resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await resp.prepare(request)
+    seq = None
+    while True:
+        if people_telemetry.seq == seq or people_telemetry.value is None:
+            if not await people_telemetry.wait_update(15.0):
+                await resp.write(b": keep-alive\n\n")
+                continue
+        seq = people_telemetry.seq
+        event = encoder.encode(people_telemetry.value)
+        if event is not None:
+            name, payload = event
+            payload["seq"] = seq
+            await resp.write(f"id: {seq}\nevent: {name}\ndata: {json.dumps(payload)}\n\n".encode())
+
+# --- /telemetry/stats Endpoint ---
+async def handle_telemetry_stats(request):
+    return web.json_response({cache.name: cache.stats() for cache in (status_telemetry, people_telemetry)})
 
 # --- /move Endpoint ---
-async def handle_move(request):
-    try:
-        payload = await request.json()
-    except Exception:
-        return web.json_response({"error": "Invalid JSON"}, status=400)
+ZERO_TWIST = {"linear": {"x": 0, "y": 0, "z": 0}, "angular": {"x": 0, "y": 0, "z": 0}}
+
+def build_twist(payload):
     # Compose ROS geometry_msgs/Twist message as JSON or simple structure
     # Here, we pack as JSON for the robot backend (linear and angular fields)
-    cmd = {
+    return {
         "linear": payload.get("linear", {"x": 0, "y": 0, "z": 0}),
         "angular": payload.get("angular", {"x": 0, "y": 0, "z": 0})
     }
-    data = json.dumps(cmd).encode()
-    await udp_request(DEVICE_IP, CMD_VEL_UDP_PORT, message=data, expect_reply=False)
+
+ZERO_TWIST_DATA = encode_twist(ZERO_TWIST)
+CODEC_ERRORS = (TypeError, ValueError, KeyError, AttributeError, struct.error)
+
+async def send_cmd_vel(data):
+    await udp_send(DEVICE_IP, CMD_VEL_UDP_PORT, data, operation="cmd_vel")
+
+async def handle_move(request):
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+    try:
+        data = encode_twist(build_twist(payload))
+    except CODEC_ERRORS:
+        return web.json_response({"error": "Invalid twist"}, status=400)
+    await send_cmd_vel(data)
     return web.json_response({"status": "sent"})
 
+# --- /move/ws Teleop Endpoint ---
+class TeleopSender:
+    """
+    The single cmd_vel stream behind every WebSocket teleop client. Incoming
+    twists only replace the pending one, whichever client sent them, so the
+    newest input wins across sessions; a fixed-rate loop forwards it and
+    zeroes velocity when input stops.
+    """
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.last_input_at = self.started_at
+        self.pending = None
+        self.pending_at = None
+        self.driver = None  # session whose twist was sent or queued last
+        self.moving = False
+        self.sent = 0
+        self.superseded = 0
+        self.deadman_stops = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def offer(self, session, data):
+        now = time.monotonic()
+        if self.pending is not None:
+            self.superseded += 1
+        self.pending = data
+        self.pending_at = now
+        self.last_input_at = now
+        self.driver = session
+        session.received += 1
+
+    async def release(self, session):
+        # Never leave the robot moving once the operator driving it is gone
+        if self.driver is session:
+            self.pending = None
+            self.driver = None
+            self.moving = False
+            await send_cmd_vel(ZERO_TWIST_DATA)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / TELEOP_RATE_HZ
+        next_tick = loop.time()
+        while True:
+            next_tick += period
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            if self.pending is not None:
+                data, queued_at = self.pending, self.pending_at
+                self.pending = None
+                await send_cmd_vel(data)
+                latency = time.monotonic() - queued_at
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+                self.sent += 1
+                self.moving = True
+            elif self.moving and time.monotonic() - self.last_input_at > TELEOP_DEADMAN_TIMEOUT:
+                await send_cmd_vel(ZERO_TWIST_DATA)
+                self.deadman_stops += 1
+                self.moving = False
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "sent": self.sent,
+            "superseded": self.superseded,
+            "deadman_stops": self.deadman_stops,
+            "send_rate_hz": self.sent / elapsed,
+            "latency_avg_ms": self.latency_sum / self.sent * 1000 if self.sent else None,
+            "latency_max_ms": self.latency_max * 1000,
+        }
+
+class TeleopSession:
+    """One WebSocket teleop client feeding the shared sender."""
+    def __init__(self, session_id):
+        self.id = session_id
+        self.opened_at = time.monotonic()
+        self.received = 0
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.opened_at, 1e-9)
+        return {
+            "received": self.received,
+            "input_rate_hz": self.received / elapsed,
+            "driving": teleop_sender.driver is self,
+        }
+
+teleop_sender = TeleopSender()
+teleop_sessions = {}
+_teleop_ids = itertools.count(1)
+
+async def start_teleop_sender(app):
+    app["teleop_sender"] = asyncio.ensure_future(teleop_sender.run())
+
+async def stop_teleop_sender(app):
+    task = app.get("teleop_sender")
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+async def handle_move_ws(request):
+    ws = web.WebSocketResponse(heartbeat=10.0)
+    await ws.prepare(request)
+    session = TeleopSession(next(_teleop_ids))
+    teleop_sessions[session.id] = session
+    try:
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                try:
+                    payload = json.loads(msg.data)
+                except ValueError:
+                    await ws.send_json({"error": "Invalid JSON"})
+                    continue
+                try:
+                    teleop_sender.offer(session, encode_twist(build_twist(payload)))
+                except CODEC_ERRORS:
+                    await ws.send_json({"error": "Invalid twist"})
+            elif msg.type == WSMsgType.ERROR:
+                break
+    finally:
+        await teleop_sender.release(session)
+        del teleop_sessions[session.id]
+    return ws
+
+async def handle_teleop_stats(request):
+    return web.json_response({
+        "sender": teleop_sender.stats(),
+        "sessions": {str(sid): session.stats() for sid, session in teleop_sessions.items()},
+    })
+
 # --- /nav Endpoint ---
 async def handle_nav(request):
     try:
@@ -87,18 +974,199 @@ async def handle_nav(request):
         "action": payload.get("action", "start"),
         "params": payload.get("params", {})
     }
-    data = json.dumps(nav_cmd).encode()
-    await udp_request(DEVICE_IP, NAV_UDP_PORT, message=data, expect_reply=False)
+    try:
+        data = encode_nav(nav_cmd)
+    except CODEC_ERRORS:
+        return web.json_response({"error": "Invalid nav params"}, status=400)
+    await udp_send(DEVICE_IP, NAV_UDP_PORT, data, operation="nav")
     return web.json_response({"status": "sent"})
 
+# --- /depth Endpoint ---
+def parse_depth_query(query):
+    roi = tuple(int(v) for v in query.get("roi", f"0,0,{DEPTH_WIDTH},{DEPTH_HEIGHT}").split(","))
+    if len(roi) != 4 or min(roi) < 0 or roi[2] == 0 or roi[3] == 0:
+        raise ValueError("roi must be x,y,w,h")
+    roi = (roi[0], roi[1], min(roi[2], DEPTH_WIDTH - roi[0]), min(roi[3], DEPTH_HEIGHT - roi[1]))
+    if roi[2] <= 0 or roi[3] <= 0:
+        raise ValueError("roi is outside the frame")
+    if "width" in query:
+        step = -(-roi[2] // int(query["width"]))
+    else:
+        step = int(query.get("decimate", "1"))
+    if step < 1:
+        raise ValueError("decimate must be >= 1")
+    min_m = float(query.get("min", "0"))
+    max_m = float(query.get("max", "65.535"))
+    if not (math.isfinite(min_m) and math.isfinite(max_m)) or min_m < 0 or min_m > max_m:
+        raise ValueError("min and max must be finite metres with 0 <= min <= max")
+    max_points = int(query.get("max_points", "5000"))
+    if max_points < 0:
+        raise ValueError("max_points must be >= 0")
+    return {
+        "roi": roi,
+        "step": step,
+        "min": min_m,
+        "max": max_m,
+        "points": query.get("points") in ("1", "true"),
+        "max_points": max_points,
+        "format": query.get("format", "raw"),
+    }
+
+async def handle_depth(request):
+    try:
+        params = parse_depth_query(request.query)
+    except (ValueError, ZeroDivisionError) as exc:
+        return web.json_response({"error": f"Invalid depth query: {exc}"}, status=400)
+    frame = depth_receiver.latest()
+    if frame is None:
+        return web.json_response({"error": "No depth frame from robot"}, status=504)
+    roi, step = params["roi"], params["step"]
+    depth = clip_range(crop_and_decimate(frame, roi, step), DEPTH_SCALE, params["min"], params["max"])
+    headers = {"X-Frame-Id": str(depth_receiver.frame_id), "X-Depth-Scale": str(DEPTH_SCALE)}
+    if params["points"]:
+        points = depth_to_points(depth, DEPTH_SCALE, roi[:2], step, params["max_points"])
+        if params["format"] == "json":
+            return web.json_response({"frame_id": depth_receiver.frame_id, "points": points.tolist()})
+        headers["X-Point-Count"] = str(len(points))
+        return web.Response(body=points.tobytes(), content_type="application/octet-stream", headers=headers)
+    if params["format"] == "json":
+        return web.json_response({
+            "frame_id": depth_receiver.frame_id,
+            "width": depth.shape[1],
+            "height": depth.shape[0],
+            "scale": DEPTH_SCALE,
+            "depth": depth.tolist(),
+        })
+    headers["X-Width"] = str(depth.shape[1])
+    headers["X-Height"] = str(depth.shape[0])
+    return web.Response(body=depth.astype("<u2", copy=False).tobytes(), content_type="application/octet-stream", headers=headers)
+
+async def handle_depth_stats(request):
+    return web.json_response(depth_receiver.stats())
+
+async def handle_metrics(request):
+    # Scrape-time gauges; everything else is recorded as requests and device calls happen
+    body = metrics.render(gauges={"asyncio_tasks": len(asyncio.all_tasks())})
+    return web.Response(body=body.encode(), headers={"Content-Type": Metrics.CONTENT_TYPE})
+
+@web.middleware
+async def record_request_metrics(request, handler):
+    started = metrics.request_started()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        # Unknown paths share one label so scanners cannot inflate the series count
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None and status not in (404, 405) else "unmatched"
+        metrics.request_finished(started, route, request.method, status)
+
 # --- HTTP Application Setup ---
-app = web.Application()
+app = web.Application(middlewares=[record_request_metrics])
 app.add_routes([
     web.get('/status', handle_status),
     web.get('/people', handle_people),
+    web.get('/people/stream', handle_people_stream),
     web.post('/move', handle_move),
+    web.get('/move/ws', handle_move_ws),
+    web.get('/teleop/stats', handle_teleop_stats),
     web.post('/nav', handle_nav),
+    web.get('/telemetry/stats', handle_telemetry_stats),
+    web.get('/depth', handle_depth),
+    web.get('/depth/stats', handle_depth_stats),
+    web.get('/metrics', handle_metrics),
 ])
+app.on_startup.append(open_udp_endpoints)
+app.on_startup.append(start_telemetry)
+app.on_startup.append(start_depth_receiver)
+app.on_startup.append(start_teleop_sender)
+app.on_cleanup.append(stop_teleop_sender)
+app.on_cleanup.append(stop_depth_receiver)
+app.on_cleanup.append(stop_telemetry)
+app.on_cleanup.append(close_udp_endpoints)
+
+def run_codec_benchmark(number=100000):
+    # Compare JSON and binary wire codecs: datagram size and encode/decode cost
+    twist = build_twist({"linear": {"x": 0.5, "y": 0.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.25}})
+    nav = {"action": "start", "params": {"goal": {"x": 3.5, "y": -1.25, "yaw": 1.57}, "speed": 0.8, "map": "floor2"}}
+    status = {"battery": 87, "mode": "walk", "pose": {"x": 1.0, "y": 2.0, "yaw": 0.1}, "faults": []}
+    cases = [
+        ("twist", lambda c: encode_twist(twist, c), decode_twist),
+        ("nav", lambda c: encode_nav(nav, c), decode_nav),
+        ("status", lambda c: encode_map(status) if c == "binary" else json.dumps(status).encode(), decode_telemetry),
+    ]
+    for name, encode, decode in cases:
+        for codec in ("json", "binary"):
+            data = encode(codec)
+            enc = timeit.timeit(lambda: encode(codec), number=number) / number
+            dec = timeit.timeit(lambda: decode(data), number=number) / number
+            print(f"{name:>6} {codec:>6}: {len(data):4d} bytes  encode {enc * 1e6:6.2f} us  decode {dec * 1e6:6.2f} us")
+
+def run_synthetic_depth_sender(fps=30.0, frames=0, host=DEVICE_IP, port=DEPTH_UDP_PORT):
+    # Local stand-in for the robot: streams a moving synthetic scene as fragmented frames
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * DEPTH_WIDTH * DEPTH_HEIGHT * 2)
+    yy, xx = np.mgrid[0:DEPTH_HEIGHT, 0:DEPTH_WIDTH]
+    background = (1000 + 4 * yy).astype("<u2")
+    frame_bytes = DEPTH_WIDTH * DEPTH_HEIGHT * 2
+    count = -(-frame_bytes // DEPTH_FRAGMENT_SIZE)
+    frame_id = 0
+    next_at = time.monotonic()
+    while not frames or frame_id < frames:
+        cx = DEPTH_WIDTH / 2 + DEPTH_WIDTH / 4 * np.sin(frame_id / 30)
+        frame = background.copy()
+        frame[(xx - cx) ** 2 + (yy - DEPTH_HEIGHT / 2) ** 2 < 60 ** 2] = 600
+        view = memoryview(frame.tobytes())
+        for index in range(count):
+            offset = index * DEPTH_FRAGMENT_SIZE
+            sock.sendmsg([DEPTH_HEADER.pack(frame_id & 0xFFFFFFFF, index, count),
+                          view[offset:offset + DEPTH_FRAGMENT_SIZE]], [], 0, (host, port))
+        frame_id += 1
+        next_at += 1.0 / fps
+        time.sleep(max(0.0, next_at - time.monotonic()))
+
+def run_people_stream_benchmark(track_count=50, updates=2000):
+    # Bytes and CPU for polling the full people payload vs. the delta stream
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(-10, 10, size=(track_count, 2))
+    ids = list(range(track_count))
+    next_id = track_count
+    frames = []
+    for _ in range(updates):
+        # A third of the people walk, the rest jitter below the threshold
+        xy += rng.normal(0, 0.01, size=xy.shape)
+        xy[: len(xy) // 3] += 0.05
+        if rng.random() < 0.02:
+            ids[rng.integers(len(ids))] = next_id
+            next_id += 1
+        frames.append({"people": [{"id": i, "x": round(float(x), 3), "y": round(float(y), 3), "confidence": 0.9}
+                                  for i, (x, y) in zip(ids, xy)]})
+    start = time.perf_counter()
+    poll_bytes = sum(len(json.dumps(frame).encode()) for frame in frames)
+    poll_time = time.perf_counter() - start
+    encoder = PeopleDeltaEncoder()
+    start = time.perf_counter()
+    stream_bytes = 0
+    for frame in frames:
+        event = encoder.encode(frame)
+        if event is not None:
+            stream_bytes += len(json.dumps(event[1]).encode())
+    stream_time = time.perf_counter() - start
+    print(f"  poll: {poll_bytes / updates:9.0f} bytes/update  {poll_time / updates * 1e6:8.1f} us/update")
+    print(f"stream: {stream_bytes / updates:9.0f} bytes/update  {stream_time / updates * 1e6:8.1f} us/update")
+    print(f"bandwidth saved: {1 - stream_bytes / poll_bytes:.1%}")
 
 if __name__ == '__main__':
-    web.run_app(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
+    if sys.argv[1:2] == ["bench"]:
+        run_codec_benchmark(*(int(a) for a in sys.argv[2:3]))
+    elif sys.argv[1:2] == ["people-bench"]:
+        run_people_stream_benchmark(*(int(a) for a in sys.argv[2:4]))
+    elif sys.argv[1:2] == ["depth-sender"]:
+        run_synthetic_depth_sender(*(float(a) for a in sys.argv[2:4]))
+    else:
+        web.run_app(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
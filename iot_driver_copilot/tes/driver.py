@@ -1,9 +1,20 @@
 import os
+import signal
+import subprocess
+import sys
+import queue
+import selectors
 import threading
 import http.server
-import socketserver
+from http.server import HTTPServer
 import socket
+import struct
+import json
+import time
 import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
 from urllib.parse import urlparse, parse_qs
 
 # Environment variables
@@ -11,41 +22,371 @@ DEVICE_IP = os.environ.get('DEVICE_IP', '127.0.0.1')
 DEVICE_ADAS_PORT = int(os.environ.get('DEVICE_ADAS_PORT', '7000'))
 SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
 SERVER_PORT = int(os.environ.get('SERVER_PORT', '8080'))
+# Reply framing: "xml" (root element close), "length" (4-byte big-endian prefix),
+# "delimiter" (ADAS_FRAME_DELIMITER) or "close" (read until the device closes)
+ADAS_FRAMING = os.environ.get('ADAS_FRAMING', 'xml')
+ADAS_FRAME_DELIMITER = os.environ.get('ADAS_FRAME_DELIMITER', '\\n').encode().decode('unicode_escape').encode('latin-1')
+# Longest wait for the rest of a reply. Framed replies return as soon as they
+# are complete; with "close" framing the timeout also ends the reply.
+ADAS_RECV_TIMEOUT = float(os.environ.get('ADAS_RECV_TIMEOUT', '2'))
+# Concurrent /data reads share one device request; optionally cache the result
+# briefly and hold the device request back for a short window so more readers join
+DATA_CACHE_TTL = float(os.environ.get('DATA_CACHE_TTL', '0'))
+DATA_COALESCE_WINDOW = float(os.environ.get('DATA_COALESCE_WINDOW', '0'))
+# Worker pool: threads, connections allowed to wait for a worker before
+# shedding with 503, Retry-After seconds, and per-connection idle timeout
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '16'))
+SERVER_QUEUE_SIZE = int(os.environ.get('SERVER_QUEUE_SIZE', '64'))
+SERVER_RETRY_AFTER = int(os.environ.get('SERVER_RETRY_AFTER', '1'))
+SERVER_IDLE_TIMEOUT = float(os.environ.get('SERVER_IDLE_TIMEOUT', '10'))
+# Requests served on one keep-alive connection before it is closed
+SERVER_KEEPALIVE_MAX_REQUESTS = int(os.environ.get('SERVER_KEEPALIVE_MAX_REQUESTS', '1000'))
+# Keep-alive connections allowed to sit idle on a worker between requests;
+# past that (or while connections are queued) responses close the connection
+SERVER_KEEPALIVE_IDLE = int(os.environ.get('SERVER_KEEPALIVE_IDLE', '8'))
+# Prefork: copies of this driver sharing SERVER_PORT through SO_REUSEPORT
+# (1 = serve from this process), seconds a stopping process may spend on
+# queued and in-flight requests, and the pause before restarting a worker
+# that died right after starting. Device reads coalesce per worker, so N
+# workers make at most N concurrent reads of one resource.
+SERVER_PROCESSES = int(os.environ.get('SERVER_PROCESSES', '1'))
+SERVER_REUSE_PORT = os.environ.get('SERVER_REUSE_PORT', '0') == '1'
+SERVER_DRAIN_TIMEOUT = float(os.environ.get('SERVER_DRAIN_TIMEOUT', '15'))
+SERVER_RESTART_DELAY = float(os.environ.get('SERVER_RESTART_DELAY', '1'))
+
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
 
 # Simulated protocol: ADAS (custom, XML over TCP)
+class AdasProtocolError(Exception):
+    """The device's reply was malformed, truncated or never completed."""
+
 class AdasDeviceClient:
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, framing=ADAS_FRAMING, delimiter=ADAS_FRAME_DELIMITER):
+        if framing not in ('xml', 'length', 'delimiter', 'close'):
+            raise ValueError(f"Unknown ADAS framing: {framing}")
+        if framing == 'delimiter' and not delimiter:
+            raise ValueError("ADAS_FRAME_DELIMITER must not be empty")
         self.ip = ip
         self.port = port
+        self.framing = framing
+        self.delimiter = delimiter
 
     def send_command(self, command):
         req_xml = f"<command>{command}</command>"
-        with socket.create_connection((self.ip, self.port), timeout=5) as sock:
-            sock.sendall(req_xml.encode())
-            resp = self._recv_all(sock)
-        return resp
+        return self._request(req_xml.encode(), "send_command")
 
     def get_data(self):
         req_xml = "<get_data/>"
-        with socket.create_connection((self.ip, self.port), timeout=5) as sock:
-            sock.sendall(req_xml.encode())
-            resp = self._recv_all(sock)
-        return resp
+        return self._request(req_xml.encode(), "get_data")
 
-    def _recv_all(self, sock):
+    def _request(self, payload, operation):
+        with metrics.device_call(operation) as call:
+            frame = self._frame(payload)
+            with socket.create_connection((self.ip, self.port), timeout=5) as sock:
+                sock.sendall(frame)
+                call["sent"] = len(frame)
+                resp = self._recv_all(sock, call)
+            call["received"] = len(resp)
+        return resp.decode(errors='ignore')
+
+    def _frame(self, payload):
+        if self.framing == 'length':
+            return struct.pack('>I', len(payload)) + payload
+        if self.framing == 'delimiter':
+            return payload + self.delimiter
+        return payload
+
+    def _recv_all(self, sock, call):
+        sock.settimeout(ADAS_RECV_TIMEOUT)
         chunks = []
-        sock.settimeout(2)
         try:
-            while True:
-                data = sock.recv(4096)
-                if not data:
-                    break
-                chunks.append(data)
-        except socket.timeout:
-            pass
-        return b''.join(chunks).decode(errors='ignore')
+            if self.framing == 'xml':
+                self._recv_xml(sock, chunks)
+            elif self.framing == 'length':
+                self._recv_length_prefixed(sock, chunks)
+            elif self.framing == 'delimiter':
+                self._recv_delimited(sock, chunks)
+            else:
+                self._recv_until_close(sock, chunks)
+        except socket.timeout as e:
+            call["error"] = e
+            if self.framing != 'close':
+                raise AdasProtocolError(f"No complete reply within {ADAS_RECV_TIMEOUT}s") from e
+            # Read-until-close: a device that keeps the connection open ends its reply this way
+        return b''.join(chunks)
+
+    def _recv_xml(self, sock, chunks):
+        # Parse incrementally and stop as soon as the root element closes
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        depth = 0
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                raise AdasProtocolError("Device closed the connection before the XML reply was complete")
+            chunks.append(data)
+            try:
+                parser.feed(data)
+                for event, _ in parser.read_events():
+                    depth += 1 if event == 'start' else -1
+                    if depth == 0:
+                        return
+            except ET.ParseError as e:
+                # Without a well-formed document there is no way to tell where the reply ends
+                raise AdasProtocolError(f"Malformed XML reply: {e}") from e
+
+    def _recv_length_prefixed(self, sock, chunks):
+        header = self._recv_exactly(sock, 4)
+        chunks.append(self._recv_exactly(sock, struct.unpack('>I', header)[0]))
+
+    def _recv_exactly(self, sock, size):
+        buf = bytearray(size)
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:])
+            if not n:
+                raise AdasProtocolError(f"Device closed the connection after {received} of {size} bytes")
+            received += n
+        return bytes(buf)
+
+    def _recv_delimited(self, sock, chunks):
+        pending = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                raise AdasProtocolError("Device closed the connection before the reply delimiter")
+            pending += data
+            end = pending.find(self.delimiter)
+            if end >= 0:
+                chunks.append(pending[:end])
+                return
+            # Keep only the tail that could still start a delimiter
+            keep = len(self.delimiter) - 1
+            if len(pending) > keep:
+                chunks.append(pending[:len(pending) - keep])
+                pending = pending[len(pending) - keep:]
+
+    def _recv_until_close(self, sock, chunks):
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            chunks.append(data)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent identical calls so one in-flight call serves every waiter."""
+    def __init__(self, cache_ttl=0.0, window=0.0):
+        self.cache_ttl = cache_ttl
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = {}
+        self._stats = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            stats = self._stats.setdefault(key, {
+                "in_flight": 0, "waiters": 0, "device_calls": 0, "coalesced": 0, "cache_hits": 0,
+            })
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                stats["cache_hits"] += 1
+                return cached[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                stats["in_flight"] += 1
+                stats["device_calls"] += 1
+            else:
+                stats["coalesced"] += 1
+            stats["waiters"] += 1
+        try:
+            if leader:
+                self._run(key, call, fn)
+            else:
+                call.done.wait()
+        finally:
+            with self._lock:
+                stats["waiters"] -= 1
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def _run(self, key, call, fn):
+        try:
+            if self.window > 0:
+                # Let readers arriving within the window join this call
+                time.sleep(self.window)
+            call.value = fn()
+        except Exception as exc:
+            call.error = exc
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self._stats[key]["in_flight"] -= 1
+                if call.error is None and self.cache_ttl > 0:
+                    self._cache[key] = (time.monotonic() + self.cache_ttl, call.value)
+            call.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
 
 adas_client = AdasDeviceClient(DEVICE_IP, DEVICE_ADAS_PORT)
+# Per process: under prefork each worker coalesces its own callers
+data_flight = SingleFlight(cache_ttl=DATA_CACHE_TTL, window=DATA_COALESCE_WINDOW)
 
 # Device static info
 DEVICE_INFO = {
@@ -57,21 +398,89 @@ DEVICE_INFO = {
 }
 
 class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; keep Nagle from delaying the body
+    disable_nagle_algorithm = True
 
-    def _set_headers(self, code=200, content_type="application/json"):
+    def handle(self):
+        self.requests_served = 0
+        self.idle_held = False
+        try:
+            super().handle()
+        finally:
+            self._release_idle()
+
+    def _release_idle(self):
+        if self.idle_held:
+            self.idle_held = False
+            self.server.release_idle()
+
+    def end_headers(self):
+        # Persistent connections are recycled after SERVER_KEEPALIVE_MAX_REQUESTS, and
+        # only kept open while the server has an idle keep-alive slot to spare
+        self.requests_served += 1
+        if not self.close_connection and not self.idle_held:
+            if self.requests_served >= SERVER_KEEPALIVE_MAX_REQUESTS or not self.server.hold_idle():
+                self.send_header('Connection', 'close')
+            else:
+                self.idle_held = True
+        super().end_headers()
+
+    def parse_request(self):
+        # The request line is in: time from here, not from the keep-alive wait before it
+        self._release_idle()
+        self.started = metrics.request_started()
+        self.status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self.started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                # Unknown paths share one label so scanners cannot inflate the series count
+                unmatched = self.command is None or self.status in (404, 405, 501)
+                route = "unmatched" if unmatched else self.path.partition("?")[0]
+                metrics.request_finished(self.started, route, self.command or "-", self.status or 0)
+
+    def _send_metrics(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", Metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _set_headers(self, code=200, content_type="application/json", length=0):
         self.send_response(code)
         self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(length))
         self.end_headers()
 
+    def _send(self, body, code=200, content_type="application/json"):
+        self._set_headers(code, content_type, len(body))
+        self.wfile.write(body)
+
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == '/info':
-            self._set_headers()
-            self.wfile.write(bytes(str(DEVICE_INFO), 'utf-8'))
+            self._send(bytes(str(DEVICE_INFO), 'utf-8'))
         elif parsed.path == '/data':
-            xml_data = adas_client.get_data()
-            self._set_headers(content_type="application/xml")
-            self.wfile.write(xml_data.encode())
+            try:
+                xml_data = data_flight.do('get_data', adas_client.get_data)
+            except (OSError, AdasProtocolError) as e:
+                self._send(json.dumps({"error": f"Device error: {e}"}).encode(), code=502)
+                return
+            self._send(xml_data.encode(), content_type="application/xml")
+        elif parsed.path == '/metrics':
+            self._send_metrics()
+        elif parsed.path == '/stats':
+            self._send(json.dumps({"coalescing": data_flight.snapshot(), "server": self.server.stats()}).encode())
         else:
             self.send_error(404, "Not Found")
 
@@ -85,21 +494,233 @@ class Handler(http.server.BaseHTTPRequestHandler):
                 cmd = tree.text if tree.tag == "command" else post_data
             except Exception:
                 cmd = post_data
-            resp_xml = adas_client.send_command(cmd)
-            self._set_headers(content_type="application/xml")
-            self.wfile.write(resp_xml.encode())
+            try:
+                resp_xml = adas_client.send_command(cmd)
+            except (OSError, AdasProtocolError) as e:
+                self._send(json.dumps({"error": f"Device error: {e}"}).encode(), code=502)
+                return
+            self._send(resp_xml.encode(), content_type="application/xml")
         else:
             self.send_error(404, "Not Found")
 
     def log_message(self, format, *args):
         return
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    daemon_threads = True
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server with a fixed pool of worker threads fed from a bounded
+    queue. Connections arriving while the queue is full get an immediate
+    503 with Retry-After instead of waiting behind slow device calls.
+    Settings are passed in by the caller, so every driver carries the same
+    copy of this class whatever its environment variables are called.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64, retry_after=1,
+                 reuse_port=False, keepalive_idle=8, idle_timeout=10.0, drain_timeout=15.0):
+        self.reuse_port = reuse_port
+        self.draining = False
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        # At least one worker is always left for new connections
+        self.keepalive_idle = max(min(keepalive_idle, workers - 1), 0)
+        self._idle = 0
+        self.retry_after = retry_after
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1024)
+        self._counters = {"accepted": 0, "served": 0, "rejected": 0}
+        self._busy = 0
+        self._lingering = {}  # rejected socket -> time it is closed regardless
+        self._linger_selector = selectors.DefaultSelector()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        threading.Thread(target=self._linger, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            self._reject(request)
+            return
+        with self._lock:
+            self._counters["accepted"] += 1
+
+    def _reject(self, request):
+        with self._lock:
+            self._counters["rejected"] += 1
+        metrics.inc("http_connections_rejected_total")
+        body = b'{"error": "Server busy, retry later"}'
+        try:
+            request.setblocking(False)
+            request.send(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\n"
+                         b"Content-Type: application/json\r\nContent-Length: %d\r\n"
+                         b"Connection: close\r\n\r\n%s" % (self.retry_after, len(body), body))
+            # Half-close and keep reading until the client closes: closing with
+            # its request still unread would reset the connection under the 503
+            request.shutdown(socket.SHUT_WR)
+            with self._lock:
+                if len(self._lingering) < 1024:
+                    self._linger_selector.register(request, selectors.EVENT_READ)
+                    self._lingering[request] = time.monotonic() + 2.0
+                    return
+        except OSError:
+            pass
+        request.close()
+
+    def _linger(self):
+        # Reads and discards whatever rejected clients still send, then closes them
+        while True:
+            events = self._linger_selector.select(0.5)
+            now = time.monotonic()
+            with self._lock:
+                for key, _ in events:
+                    try:
+                        done = not key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        done = False
+                    except OSError:
+                        done = True
+                    if done:
+                        self._unlinger(key.fileobj)
+                for sock, deadline in list(self._lingering.items()):
+                    if deadline < now:
+                        self._unlinger(sock)
+
+    def _unlinger(self, sock):
+        # Called with the lock held
+        if self._lingering.pop(sock, None) is not None:
+            self._linger_selector.unregister(sock)
+            sock.close()
+
+    def _work(self):
+        while True:
+            request, client_address, enqueued = self._queue.get()
+            with self._lock:
+                self._waits.append(time.monotonic() - enqueued)
+                self._busy += 1
+            try:
+                # Idle or stalled clients give their worker back after the timeout
+                request.settimeout(self.idle_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self._busy -= 1
+                    self._counters["served"] += 1
+
+    def hold_idle(self):
+        """
+        Reserve an idle keep-alive slot for a connection about to wait for its
+        next request; False means the response should close the connection.
+        """
+        with self._lock:
+            if self.draining or self._idle >= self.keepalive_idle or not self._queue.empty():
+                return False
+            self._idle += 1
+            return True
+
+    def release_idle(self):
+        with self._lock:
+            self._idle -= 1
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Every process bound to the port (prefork workers, or a replacement
+            # starting while this one drains) gets a share of new connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def drain(self, timeout=None):
+        """Stop accepting, then wait for queued and in-flight connections to finish."""
+        self.draining = True
+        self.server_close()
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._counters["accepted"] == self._counters["served"]:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def serve_until_terminated(self):
+        """serve_forever() until SIGTERM, then drain."""
+        # shutdown() waits for serve_forever() to return, so it cannot run inside the handler
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.shutdown).start())
+        self.serve_forever()
+        self.drain()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counters, pid=os.getpid(), workers=self.workers, busy=self._busy,
+                         idle_keepalive=self._idle, queued=self._queue.qsize())
+        if waits:
+            stats["queue_wait_ms"] = {
+                "p50": round(waits[len(waits) // 2] * 1000, 3),
+                "p99": round(waits[min(int(len(waits) * 0.99), len(waits) - 1)] * 1000, 3),
+                "max": round(waits[-1] * 1000, 3),
+            }
+        return stats
+
+def run_prefork(processes):
+    """
+    Supervise `processes` copies of this driver, each serving SERVER_PORT
+    with SO_REUSEPORT so the kernel spreads connections across them.
+    Workers that exit are restarted; SIGTERM or SIGINT is passed on as
+    SIGTERM and the supervisor returns once every worker has drained.
+    """
+    command = [sys.executable, os.path.abspath(__file__)]
+    env = dict(os.environ, SERVER_PROCESSES="1", SERVER_REUSE_PORT="1")
+    workers = {}  # slot -> (process, start time)
+    restarts = {slot: 0.0 for slot in range(processes)}  # slot -> earliest (re)start time
+    deadline = []
+
+    def stop(signum, frame):
+        if not deadline:
+            deadline.append(time.monotonic() + SERVER_DRAIN_TIMEOUT + 5)
+            for proc, _ in workers.values():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Supervising {processes} workers on {SERVER_HOST}:{SERVER_PORT}")
+    while workers or (restarts and not deadline):
+        now = time.monotonic()
+        for slot, at in list(restarts.items()):
+            if at <= now and not deadline:
+                del restarts[slot]
+                # Own session, so a terminal Ctrl-C reaches only the supervisor
+                proc = subprocess.Popen(command, env=env, start_new_session=True)
+                workers[slot] = (proc, now)
+                if deadline:
+                    proc.terminate()
+        for slot, (proc, started) in list(workers.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del workers[slot]
+            if not deadline:
+                print(f"Worker {proc.pid} exited with status {code}, restarting", file=sys.stderr)
+                # A worker that dies right after starting is not respawned in a tight loop
+                restarts[slot] = now + (SERVER_RESTART_DELAY if now - started < SERVER_RESTART_DELAY else 0)
+        if deadline and now > deadline[0]:
+            for proc, _ in workers.values():
+                proc.kill()
+        time.sleep(0.1)
 
 def run_server():
-    with ThreadedHTTPServer((SERVER_HOST, SERVER_PORT), Handler) as httpd:
-        httpd.serve_forever()
+    if SERVER_PROCESSES > 1:
+        run_prefork(SERVER_PROCESSES)
+        return
+    with PooledHTTPServer((SERVER_HOST, SERVER_PORT), Handler, workers=SERVER_WORKERS,
+                          queue_size=SERVER_QUEUE_SIZE, retry_after=SERVER_RETRY_AFTER,
+                          reuse_port=SERVER_REUSE_PORT, keepalive_idle=SERVER_KEEPALIVE_IDLE,
+                          idle_timeout=SERVER_IDLE_TIMEOUT, drain_timeout=SERVER_DRAIN_TIMEOUT) as httpd:
+        httpd.serve_until_terminated()
 
 if __name__ == "__main__":
     run_server()
\ No newline at end of file
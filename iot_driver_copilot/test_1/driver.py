@@ -1,6 +1,22 @@
 import os
+import sys
+import signal
+import socket
 import json
-from flask import Flask, request, jsonify, Response, abort
+import time
+import mmap
+import atexit
+import base64
+import struct
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, Response, abort, g
+from werkzeug.serving import make_server
 
 app = Flask(__name__)
 
@@ -11,20 +27,572 @@ DEVICE_MANUFACTURER = os.environ.get("DEVICE_MANUFACTURER", "test1")
 DEVICE_TYPE = os.environ.get("DEVICE_TYPE", "test1")
 HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
 HTTP_PORT = int(os.environ.get("HTTP_PORT", "8080"))
+# One process owns the data store and the command journal, whose sequence
+# numbers and cursors must stay global, so prefork (HTTP_PROCESSES > 1) is
+# refused. With HTTP_REUSE_PORT the app is served from an SO_REUSEPORT listener
+# so a replacement can bind while this process drains for up to
+# HTTP_DRAIN_TIMEOUT seconds of in-flight requests.
+HTTP_PROCESSES = int(os.environ.get("HTTP_PROCESSES", "1"))
+HTTP_REUSE_PORT = os.environ.get("HTTP_REUSE_PORT", "0") == "1"
+HTTP_DRAIN_TIMEOUT = float(os.environ.get("HTTP_DRAIN_TIMEOUT", "15"))
+# Data retention: newest points kept, and maximum age in seconds (0 = no age limit)
+DATA_RETENTION_POINTS = int(os.environ.get("DATA_RETENTION_POINTS", "10000000"))
+DATA_RETENTION_SECONDS = float(os.environ.get("DATA_RETENTION_SECONDS", "0"))
+# Command journal: segment directory (under XDG_STATE_HOME by default) and size,
+# retention limits (0 = unlimited), in-memory tail length and fsync batching
+# interval in seconds (0 = fsync every record)
+COMMAND_JOURNAL_DIR = os.environ.get("COMMAND_JOURNAL_DIR") or os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "test1-driver", "command_journal")
+COMMAND_JOURNAL_SEGMENT_BYTES = int(os.environ.get("COMMAND_JOURNAL_SEGMENT_BYTES", "4194304"))
+COMMAND_JOURNAL_MAX_RECORDS = int(os.environ.get("COMMAND_JOURNAL_MAX_RECORDS", "1000000"))
+COMMAND_JOURNAL_MAX_AGE = float(os.environ.get("COMMAND_JOURNAL_MAX_AGE", "0"))
+COMMAND_JOURNAL_MAX_BYTES = int(os.environ.get("COMMAND_JOURNAL_MAX_BYTES", "268435456"))
+COMMAND_JOURNAL_TAIL = int(os.environ.get("COMMAND_JOURNAL_TAIL", "1024"))
+COMMAND_JOURNAL_FSYNC_INTERVAL = float(os.environ.get("COMMAND_JOURNAL_FSYNC_INTERVAL", "0.05"))
+
+
+def parse_timestamp(value):
+    # ISO-8601 ("2024-06-01T12:00:00Z") or epoch milliseconds to epoch milliseconds
+    if isinstance(value, (int, float)) or value.lstrip("-").isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def format_timestamp(ms):
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    spec = "seconds" if ms % 1000 == 0 else "milliseconds"
+    return dt.isoformat(timespec=spec).replace("+00:00", "Z")
+
+
+class TimeIndexedStore:
+    """
+    Append-only device data in typed columns (id, timestamp in epoch ms,
+    value). Ids and timestamps never decrease, so both columns stay sorted
+    and every page is found by binary search: O(log n + limit) at any depth.
+    """
+
+    def __init__(self, max_points=DATA_RETENTION_POINTS, max_age=DATA_RETENTION_SECONDS):
+        self.max_points = max_points
+        self.max_age = max_age
+        self._ids = array("q")
+        self._timestamps = array("q")
+        self._values = array("q")
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def append(self, value, timestamp=None):
+        ts = parse_timestamp(timestamp) if timestamp is not None else int(time.time() * 1000)
+        with self._lock:
+            if self._timestamps:
+                # Keep the timestamp column sorted for late or skewed samples
+                ts = max(ts, self._timestamps[-1])
+            self._ids.append(self._next_id)
+            self._timestamps.append(ts)
+            self._values.append(int(value))
+            self._next_id += 1
+            self._enforce_retention()
+            return self._next_id - 1
+
+    def extend(self, timestamps, values):
+        # Bulk load of already sorted epoch-ms timestamps and values
+        with self._lock:
+            count = len(values)
+            self._ids.extend(range(self._next_id, self._next_id + count))
+            self._timestamps.extend(timestamps)
+            self._values.extend(values)
+            self._next_id += count
+            self._enforce_retention()
+
+    def _enforce_retention(self):
+        # Trim in slices of max_points / 8 so the memmove cost is amortized
+        excess = len(self._ids) - self.max_points
+        if excess > max(self.max_points // 8, 0):
+            drop = excess
+        else:
+            drop = 0
+        if self.max_age and self._timestamps:
+            cutoff = int((time.time() - self.max_age) * 1000)
+            expired = bisect_left(self._timestamps, cutoff)
+            if expired > max(len(self._ids) // 8, 1024) or expired == len(self._ids):
+                drop = max(drop, expired)
+        if drop:
+            del self._ids[:drop]
+            del self._timestamps[:drop]
+            del self._values[:drop]
+
+    def page(self, after_id=None, start=None, end=None, offset=0, limit=5):
+        """Rows with id > after_id and start <= timestamp < end; returns (rows, matched, has_more)."""
+        with self._lock:
+            lo = bisect_right(self._ids, after_id) if after_id is not None else 0
+            if start is not None:
+                lo = max(lo, bisect_left(self._timestamps, start))
+            hi = bisect_left(self._timestamps, end) if end is not None else len(self._ids)
+            hi = max(hi, lo)
+            first = min(lo + offset, hi)
+            stop = min(first + limit, hi)
+            rows = [
+                {"id": self._ids[i], "timestamp": format_timestamp(self._timestamps[i]), "value": self._values[i]}
+                for i in range(first, stop)
+            ]
+        return rows, hi - lo, stop < hi
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(b"after:%d" % last_id).rstrip(b"=").decode()
+
+
+def decode_cursor(token):
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    prefix, _, last_id = raw.partition(b":")
+    if prefix != b"after":
+        raise ValueError("bad cursor")
+    return int(last_id)
+
+
+# Journal record header: payload length, sequence number, unix time
+RECORD_HEADER = struct.Struct("<IQd")
+
+
+class _Segment:
+    """One journal file; sequence numbers inside it are contiguous from first_seq."""
+
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.offsets = array("Q")
+        self.timestamps = array("d")
+        self.size = 0
+        self.map = None
+        self.map_size = 0
+
+    def mapping(self):
+        # Sealed segments are mapped once; the active one is remapped as it grows
+        if self.map_size < self.size:
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self.map_size = self.size
+        return self.map
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.map_size = 0
+
+
+class CommandJournal:
+    """
+    Append-only command history in rotating segment files of length-prefixed
+    records. Only per-record offsets and timestamps are kept in memory, plus a
+    short tail of recent payloads; older records are read back through mmap.
+    Retention drops whole segments, oldest first, once the record count, byte
+    size or age limit is exceeded.
+    """
+
+    def __init__(self, directory=COMMAND_JOURNAL_DIR, segment_bytes=COMMAND_JOURNAL_SEGMENT_BYTES,
+                 max_records=COMMAND_JOURNAL_MAX_RECORDS, max_age=COMMAND_JOURNAL_MAX_AGE,
+                 max_bytes=COMMAND_JOURNAL_MAX_BYTES, tail_size=COMMAND_JOURNAL_TAIL,
+                 fsync_interval=COMMAND_JOURNAL_FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_records = max_records
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._segments = []
+        self._tail = deque(maxlen=tail_size)
+        self._records = 0
+        self._bytes = 0
+        self._next_seq = 1
+        self._last_ts = 0.0
+        self._fd = None
+        self._dirty = False
+        self._fsyncs = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        if fsync_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _load(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".log"))
+        for name in names:
+            segment = self._scan(os.path.join(self.directory, name), int(name[:-4]))
+            if segment.offsets and segment.first_seq >= self._next_seq:
+                self._segments.append(segment)
+                self._records += len(segment.offsets)
+                self._bytes += segment.size
+                self._next_seq = segment.first_seq + len(segment.offsets)
+                self._last_ts = segment.timestamps[-1]
+            else:
+                os.remove(segment.path)
+        if self._segments:
+            last = self._segments[-1]
+            for i in range(max(len(last.offsets) - self._tail.maxlen, 0), len(last.offsets)):
+                self._tail.append(self._read(last, i))
+            self._fd = os.open(last.path, os.O_WRONLY | os.O_APPEND)
+        else:
+            self._new_segment()
+
+    def _scan(self, path, first_seq):
+        # Rebuild the offset index; a torn record at the end is truncated away
+        segment = _Segment(path, first_seq)
+        file_size = os.path.getsize(path)
+        if file_size:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                pos = 0
+                while pos + RECORD_HEADER.size <= file_size:
+                    length, seq, ts = RECORD_HEADER.unpack_from(data, pos)
+                    end = pos + RECORD_HEADER.size + length
+                    if end > file_size or seq != first_seq + len(segment.offsets):
+                        break
+                    segment.offsets.append(pos)
+                    segment.timestamps.append(ts)
+                    pos = end
+            segment.size = pos
+            if pos < file_size:
+                os.truncate(path, pos)
+        return segment
+
+    def _new_segment(self):
+        path = os.path.join(self.directory, "%020d.log" % self._next_seq)
+        self._segments.append(_Segment(path, self._next_seq))
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _rotate(self):
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._dirty = False
+        self._new_segment()
+
+    def append(self, command):
+        payload = json.dumps(command, separators=(",", ":")).encode()
+        with self._lock:
+            segment = self._segments[-1]
+            record_size = RECORD_HEADER.size + len(payload)
+            if segment.size and segment.size + record_size > self.segment_bytes:
+                self._rotate()
+                segment = self._segments[-1]
+            seq = self._next_seq
+            ts = self._last_ts = max(time.time(), self._last_ts)
+            os.write(self._fd, RECORD_HEADER.pack(len(payload), seq, ts) + payload)
+            segment.offsets.append(segment.size)
+            segment.timestamps.append(ts)
+            segment.size += record_size
+            self._records += 1
+            self._bytes += record_size
+            self._next_seq += 1
+            self._tail.append((seq, ts, payload))
+            if self.fsync_interval > 0:
+                self._dirty = True
+            else:
+                os.fsync(self._fd)
+                self._fsyncs += 1
+            self._enforce_retention(ts)
+        return seq
+
+    def _enforce_retention(self, now):
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            if not ((self.max_records and self._records > self.max_records)
+                    or (self.max_bytes and self._bytes > self.max_bytes)
+                    or (self.max_age and oldest.timestamps[-1] < now - self.max_age)):
+                break
+            self._segments.pop(0)
+            self._records -= len(oldest.offsets)
+            self._bytes -= oldest.size
+            oldest.close()
+            os.remove(oldest.path)
+
+    def _flush_loop(self):
+        # Group commit: one fsync per interval covers every record written since the last
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty or self._fd is None:
+                return
+            self._dirty = False
+            fd = os.dup(self._fd)
+        try:
+            os.fsync(fd)
+            self._fsyncs += 1
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            for segment in self._segments:
+                segment.close()
+
+    def _read(self, segment, index):
+        data = segment.mapping()
+        offset = segment.offsets[index]
+        length = RECORD_HEADER.unpack_from(data, offset)[0]
+        start = offset + RECORD_HEADER.size
+        return segment.first_seq + index, segment.timestamps[index], data[start:start + length]
+
+    def _locate(self, seq):
+        # Segment index holding `seq` (segments are ordered by first_seq)
+        return bisect_right([s.first_seq for s in self._segments], seq) - 1
+
+    def query(self, after_seq=None, start=None, end=None, limit=100):
+        """Records with seq > after_seq and start <= time < end (unix seconds); returns (records, has_more)."""
+        with self._lock:
+            if not self._records:
+                return [], False
+            seq = self._segments[0].first_seq
+            if after_seq is not None:
+                seq = max(seq, after_seq + 1)
+            if start is not None:
+                for segment in self._segments:
+                    if segment.timestamps[-1] >= start:
+                        seq = max(seq, segment.first_seq + bisect_left(segment.timestamps, start))
+                        break
+                else:
+                    seq = self._next_seq
+            records = []
+            has_more = False
+            tail_first = self._tail[0][0] if self._tail else self._next_seq
+            index = self._locate(seq)
+            while seq < self._next_seq:
+                if seq >= tail_first:
+                    record = self._tail[seq - tail_first]
+                else:
+                    segment = self._segments[index]
+                    if seq - segment.first_seq >= len(segment.offsets):
+                        index += 1
+                        continue
+                    record = self._read(segment, seq - segment.first_seq)
+                if end is not None and record[1] >= end:
+                    break
+                if len(records) == limit:
+                    has_more = True
+                    break
+                records.append(record)
+                seq += 1
+        return [
+            {"seq": seq, "timestamp": format_timestamp(int(ts * 1000)), "command": json.loads(payload)}
+            for seq, ts, payload in records
+        ], has_more
+
+    def stats(self):
+        with self._lock:
+            return {
+                "records": self._records,
+                "bytes": self._bytes,
+                "segments": len(self._segments),
+                "next_seq": self._next_seq,
+                "fsyncs": self._fsyncs,
+            }
+
+
+class Metrics:
+    """
+    Prometheus text-format metrics. Each thread records into its own shard
+    (a dict reached through threading.local), so request and device paths
+    never take a lock; a scrape sums the shards, folding those of threads
+    that have exited into a retired total.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FAMILIES = {
+        "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+        "http_requests_in_flight": ("gauge", "HTTP requests being handled."),
+        "http_connections_rejected_total": ("counter", "Connections shed with 503 because every worker was busy."),
+        "device_io_duration_seconds": ("histogram", "Device call latency by operation."),
+        "device_io_bytes_total": ("counter", "Bytes exchanged with the device by operation and direction."),
+        "device_io_errors_total": ("counter", "Device calls that failed other than by timing out."),
+        "device_io_timeouts_total": ("counter", "Device calls that timed out."),
+        "process_threads": ("gauge", "Threads alive in this process."),
+        "asyncio_tasks": ("gauge", "Tasks pending on the event loop."),
+    }
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for every thread that has recorded
+        self._retired = {}
+        self._lock = threading.Lock()  # taken on a thread's first record and on scrapes only
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire(self):
+        # Exited threads no longer write to their shards, so they can be merged safely
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        shard[name, labels] = shard.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        shard = self._shard()
+        histogram = shard.get((name, labels))
+        if histogram is None:
+            # One count per bucket and +Inf, then the running sum
+            histogram = shard[name, labels] = [0] * (len(self.BUCKETS) + 2)
+        histogram[bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def request_started(self):
+        self.inc("http_requests_in_flight")
+        return time.perf_counter()
+
+    def request_finished(self, started, route, method, status):
+        self.inc("http_requests_in_flight", (), -1)
+        self.observe("http_request_duration_seconds",
+                     (("route", route), ("method", method), ("status", str(status))),
+                     time.perf_counter() - started)
+
+    @contextmanager
+    def device_call(self, operation):
+        """Time one device call; the caller fills in byte counts and any handled error."""
+        call = {"sent": 0, "received": 0, "error": None}
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            if call["error"] is None:
+                call["error"] = e
+            raise
+        finally:
+            labels = (("operation", operation),)
+            self.observe("device_io_duration_seconds", labels, time.perf_counter() - started)
+            if call["sent"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "sent"),), call["sent"])
+            if call["received"]:
+                self.inc("device_io_bytes_total", labels + (("direction", "received"),), call["received"])
+            if call["error"] is not None:
+                self.inc("device_io_timeouts_total" if isinstance(call["error"], TimeoutError)
+                         else "device_io_errors_total", labels)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                          .replace("\n", "\\n")) for name, value in labels) + "}"
+
+    def render(self, gauges=None):
+        """Text exposition of every shard plus gauges sampled at scrape time."""
+        totals = {}
+        with self._lock:
+            self._retire()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        totals.setdefault(("http_requests_in_flight", ()), 0)
+        totals["process_threads", ()] = threading.active_count()
+        for name, value in (gauges or {}).items():
+            totals[name, ()] = value
+        lines = []
+        for name, (kind, help_text) in self.FAMILIES.items():
+            samples = sorted(((labels, value) for (family, labels), value in totals.items() if family == name),
+                             key=lambda sample: sample[0])
+            # Families a driver never records (the 503 counter without a
+            # worker pool, asyncio_tasks without an event loop) are left out
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for labels, histogram in samples:
+                cumulative = 0
+                for le, count in zip(self.BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
 
 # Simulated device data and command execution (since protocol is 'test1')
-DEVICE_DATA = [
-    {"id": 1, "timestamp": "2024-06-01T12:00:00Z", "value": 123},
-    {"id": 2, "timestamp": "2024-06-01T12:01:00Z", "value": 124},
-    {"id": 3, "timestamp": "2024-06-01T12:02:00Z", "value": 125},
-    {"id": 4, "timestamp": "2024-06-01T12:03:00Z", "value": 126},
-    {"id": 5, "timestamp": "2024-06-01T12:04:00Z", "value": 127},
-    {"id": 6, "timestamp": "2024-06-01T12:05:00Z", "value": 128},
-    {"id": 7, "timestamp": "2024-06-01T12:06:00Z", "value": 129},
-    {"id": 8, "timestamp": "2024-06-01T12:07:00Z", "value": 130},
-    {"id": 9, "timestamp": "2024-06-01T12:08:00Z", "value": 131}
-]
-COMMAND_HISTORY = []
+DEVICE_DATA = TimeIndexedStore()
+for _minute, _value in enumerate(range(123, 132)):
+    DEVICE_DATA.append(_value, f"2024-06-01T12:{_minute:02d}:00Z")
+_command_journal = None
+_command_journal_lock = threading.Lock()
+
+
+def command_journal():
+    """The command journal, opened (and its fsync thread started) on first use rather than at import."""
+    global _command_journal
+    if _command_journal is None:
+        with _command_journal_lock:
+            if _command_journal is None:
+                journal = CommandJournal(COMMAND_JOURNAL_DIR)
+                atexit.register(journal.close)
+                _command_journal = journal
+    return _command_journal
+
+@app.before_request
+def start_request_timer():
+    g.request_started = METRICS.request_started()
+    g.response_status = 0
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_timer(exc):
+    if "request_started" in g:
+        # Unknown paths share one label so scanners cannot inflate the series count
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        METRICS.request_finished(g.request_started, route, request.method, g.response_status or 500)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(METRICS.render(), content_type=Metrics.CONTENT_TYPE)
 
 @app.route("/info", methods=["GET"])
 def get_info():
@@ -47,7 +615,7 @@ def post_cmd():
         "executed_command": cmd,
         "message": f"Command executed on {DEVICE_NAME}"
     }
-    COMMAND_HISTORY.append(cmd)
+    command_journal().append(cmd)
     return jsonify(result), 200
 
 @app.route("/command", methods=["POST"])
@@ -61,31 +629,176 @@ def post_command():
         "executed_command": cmd,
         "message": f"Command executed on {DEVICE_NAME}"
     }
-    COMMAND_HISTORY.append(cmd)
+    command_journal().append(cmd)
     return jsonify(result), 200
 
 @app.route("/data", methods=["GET"])
 def get_data():
-    # Handle pagination
+    # Cursor pagination: pass the returned "next_cursor" as "after" for the next page.
+    # "page" offset pagination is still accepted when no cursor is given.
     try:
-        page = int(request.args.get("page", "1"))
         limit = int(request.args.get("limit", "5"))
+        page = int(request.args.get("page", "1"))
     except ValueError:
         return jsonify({"error": "Invalid 'page' or 'limit' parameter"}), 400
 
     if page < 1 or limit < 1:
         return jsonify({"error": "'page' and 'limit' must be positive integers"}), 400
 
-    start = (page - 1) * limit
-    end = start + limit
-    data_slice = DEVICE_DATA[start:end]
-    total = len(DEVICE_DATA)
-    return jsonify({
-        "page": page,
+    try:
+        after = request.args.get("after")
+        after_id = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'after' cursor"}), 400
+    try:
+        start = parse_timestamp(request.args["from"]) if "from" in request.args else None
+        end = parse_timestamp(request.args["to"]) if "to" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'from' or 'to' timestamp"}), 400
+
+    offset = 0 if after_id is not None else (page - 1) * limit
+    data_slice, matched, has_more = DEVICE_DATA.page(after_id, start, end, offset, limit)
+    result = {
+        "limit": limit,
+        "total": len(DEVICE_DATA),
+        "matched": matched,
+        "data": data_slice,
+        "next_cursor": encode_cursor(data_slice[-1]["id"]) if has_more and data_slice else None,
+    }
+    if after_id is None:
+        result["page"] = page
+    return jsonify(result), 200
+
+
+@app.route("/commands", methods=["GET"])
+def get_commands():
+    # Pages through the command journal; pass "next_cursor" back as "after"
+    try:
+        limit = int(request.args.get("limit", "100"))
+    except ValueError:
+        return jsonify({"error": "Invalid 'limit' parameter"}), 400
+    if limit < 1:
+        return jsonify({"error": "'limit' must be a positive integer"}), 400
+    try:
+        after = request.args.get("after")
+        after_seq = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'after' cursor"}), 400
+    try:
+        start = parse_timestamp(request.args["from"]) / 1000 if "from" in request.args else None
+        end = parse_timestamp(request.args["to"]) / 1000 if "to" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'from' or 'to' timestamp"}), 400
+
+    journal = command_journal()
+    commands, has_more = journal.query(after_seq, start, end, limit)
+    result = {
         "limit": limit,
-        "total": total,
-        "data": data_slice
-    }), 200
+        "journal": journal.stats(),
+        "commands": commands,
+        "next_cursor": encode_cursor(commands[-1]["seq"]) if has_more and commands else None,
+    }
+    return jsonify(result), 200
+
+
+def run_benchmark(points=10000000, limit=100):
+    # Page latency at increasing depth in a store of `points` samples
+    store = TimeIndexedStore(max_points=points)
+    start_ms = parse_timestamp("2024-01-01T00:00:00Z")
+    started = time.perf_counter()
+    for i in range(0, points, 1000000):
+        count = min(1000000, points - i)
+        store.extend(range(start_ms + i * 1000, start_ms + (i + count) * 1000, 1000), range(i, i + count))
+    print(f"load {points} points: {time.perf_counter() - started:.1f} s")
+    for depth in (0, points // 2, points - limit - 1):
+        for label, kwargs in (
+            ("cursor", {"after_id": depth}),
+            ("time range", {"start": start_ms + depth * 1000, "end": start_ms + (depth + 3600) * 1000}),
+            ("offset", {"offset": depth}),
+        ):
+            started = time.perf_counter()
+            for _ in range(100):
+                store.page(limit=limit, **kwargs)
+            elapsed = (time.perf_counter() - started) / 100
+            print(f"depth {depth:>9} {label:>10}: {elapsed * 1e6:8.1f} us/page")
+
+
+def run_journal_benchmark(records=200000):
+    # Append throughput per fsync policy, then page reads from the oldest segment
+    command = {"action": "set", "target": "relay-1", "value": 1}
+    for interval in (0, 0.001, 0.01, 0.05):
+        count = records if interval else min(records, 2000)
+        with tempfile.TemporaryDirectory() as directory:
+            journal = CommandJournal(directory, fsync_interval=interval)
+            started = time.perf_counter()
+            for _ in range(count):
+                journal.append(command)
+            journal.flush()
+            elapsed = time.perf_counter() - started
+            stats = journal.stats()
+            print(f"fsync interval {interval:>5} s: {count / elapsed:9.0f} records/s, "
+                  f"{stats['fsyncs']} fsyncs, {stats['segments']} segments")
+            if interval == 0.05:
+                started = time.perf_counter()
+                after = None
+                for _ in range(100):
+                    page, _ = journal.query(after, limit=100)
+                    after = page[-1]["seq"]
+                elapsed = (time.perf_counter() - started) / 100
+                print(f"query 100 records from disk: {elapsed * 1e6:.1f} us/page")
+            journal.close()
+
+
+def serve_reuse_port():
+    """
+    Serve app from a threaded werkzeug server on an SO_REUSEPORT listener.
+    SIGTERM stops accepting, then waits up to HTTP_DRAIN_TIMEOUT for
+    requests already inside the app.
+    """
+    command_journal()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind((HTTP_HOST, HTTP_PORT))
+    listener.listen(128)
+    in_flight = [0]
+    lock = threading.Lock()
+
+    def counted_app(environ, start_response):
+        with lock:
+            in_flight[0] += 1
+        try:
+            return app(environ, start_response)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    server = make_server(HTTP_HOST, HTTP_PORT, counted_app, threaded=True, fd=listener.fileno())
+    listener.close()
+    # shutdown() waits for serve_forever() to return, so it cannot run inside the handler
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Worker {os.getpid()} serving on {HTTP_HOST}:{HTTP_PORT}")
+    server.serve_forever()
+    server.server_close()
+    deadline = time.monotonic() + HTTP_DRAIN_TIMEOUT
+    while in_flight[0] and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_server():
+    if HTTP_PROCESSES != 1:
+        raise ValueError("HTTP_PROCESSES must be 1: one process owns the data store and command journal")
+    if HTTP_REUSE_PORT:
+        serve_reuse_port()
+    else:
+        command_journal()
+        app.run(host=HTTP_HOST, port=HTTP_PORT)
+
 
 if __name__ == "__main__":
-    app.run(host=HTTP_HOST, port=HTTP_PORT)
\ No newline at end of file
+    if sys.argv[1:2] == ["bench"]:
+        run_benchmark(*(int(a) for a in sys.argv[2:4]))
+    elif sys.argv[1:2] == ["bench-journal"]:
+        run_journal_benchmark(*(int(a) for a in sys.argv[2:3]))
+    else:
+        run_server()
\ No newline at end of file
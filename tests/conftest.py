@@ -0,0 +1,26 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+DRIVERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "iot_driver_copilot")
+
+_loaded = {}
+
+
+@pytest.fixture(scope="session")
+def load_driver():
+    """Import iot_driver_copilot/<name>/driver.py as its own module (the
+    drivers are standalone scripts, not a package)."""
+    def load(name):
+        if name not in _loaded:
+            path = os.path.join(DRIVERS_DIR, name, "driver.py")
+            module_name = "driver_" + "".join(c if c.isalnum() else "_" for c in name)
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            spec.loader.exec_module(module)
+            _loaded[name] = module
+        return _loaded[name]
+    return load
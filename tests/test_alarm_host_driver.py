@@ -0,0 +1,224 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver("Alarm Host Series")
+
+
+@pytest.fixture(autouse=True)
+def event_hub(driver, monkeypatch):
+    hub = driver.EventHub()
+    monkeypatch.setattr(driver, "event_hub", hub)
+    return hub
+
+
+def events_since(driver, device, version):
+    return [chunk.decode() for chunk in driver.event_hub.since(version, device.version)]
+
+
+def test_every_sensor_change_is_an_event(driver):
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p")
+    before = device.version
+    device.update_sensors({"dust": 20, "temperature": 30, "water": True})
+    events = events_since(driver, device, before)
+    assert device.version - before == len(events) == 2
+    assert all("event: sensor" in event for event in events)
+    device.update_sensors({"dust": 20})
+    assert device.version - before == 2
+
+
+def test_sensor_threshold_crossing_raises_the_alarm(driver):
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p")
+    before = device.version
+    device.update_sensors({"battery_voltage": 11.0})
+    assert device.active_alarms
+    events = events_since(driver, device, before)
+    assert [e.split("\n")[1] for e in events] == ["event: sensor", "event: alarm"]
+    assert json.loads(events[0].split("data: ")[1])["tripped"] is True
+
+
+def test_sensors_are_polled_over_the_control_link(driver):
+    port = driver._serve_stand_in_device()
+    link = driver.DeviceLink("127.0.0.1", port)
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p", link=link)
+    device.update_sensors({"dust": 99})
+    try:
+        assert device.poll_sensors(timeout=5)["dust"] == 1
+        assert device.get_status()["sensors"]["dust"] == 1
+    finally:
+        link.close()
+
+
+class ShortLink:
+    """Control link stand-in whose batch reply answers only the first operation."""
+
+    def exchange(self, operations):
+        return [{"success": True}]
+
+
+def test_batch_reports_operations_the_device_did_not_answer(driver):
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p", link=ShortLink())
+    results = device.execute([{"op": "zone", "zone_id": z, "action": "bypass"} for z in (1, 2, 3)], timeout=5)
+    assert results[0]["success"]
+    assert results[1:] == [{"success": False, "error": "No result from device"}] * 2
+    assert device.zones.is_bypassed(0) and not device.zones.is_bypassed(1)
+
+
+@pytest.mark.parametrize("body", [b"5", b"null", b"[1, 2]", b'"zoneAlarm"'])
+def test_non_object_json_alerts_are_rejected(driver, body):
+    with pytest.raises(ValueError):
+        driver.decode_alert("application/json", body)
+
+
+def test_alert_stream_survives_bad_parts(driver):
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p")
+    client = driver.AlertStreamClient(device, "127.0.0.1", 0, "/", "u", "p")
+    good = b'{"eventType": "zoneAlarm", "eventState": "active", "zoneNo": 3}'
+    for body in (b"5", b"null", b'{"eventType": ["IO"], "zoneNo": 1}', b'{"eventType": "IO", "zoneNo": {}}', good):
+        client._on_part("application/json", memoryview(body))
+    assert client.counters["malformed"] == 3
+    assert client.counters["ignored"] == 1
+    assert client.counters["applied"] == 1
+    assert device.zones.row(2)["status"] == "alarm"
+
+
+def test_prefork_is_refused_when_serving(driver, monkeypatch):
+    monkeypatch.setattr(driver, "SERVER_PROCESSES", 2)
+    with pytest.raises(ValueError, match="SERVER_PROCESSES must be 1"):
+        driver.run_server()
+
+
+def test_prefork_setting_does_not_break_other_commands(driver):
+    env = dict(os.environ, SERVER_PROCESSES="2")
+    result = subprocess.run([sys.executable, driver.__file__, "zones-report", "200"], env=env,
+                            capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+
+
+def test_zone_table_counts_follow_status_changes(driver):
+    zones = driver.ZoneTable(count=10, subsystem_size=4)
+    assert zones.set_status(0, 1) and zones.set_status(1, 2)
+    assert not zones.set_status(1, 2)
+    assert zones.set_bypassed(2, True) and not zones.set_bypassed(2, True)
+    assert zones.summary() == {"total": 10, "ok": 8, "alarm": 1, "fault": 1, "bypassed": 1}
+    zones.set_status(0, 2)
+    zones.set_status(1, 0)
+    zones.set_bypassed(2, False)
+    assert zones.summary() == {"total": 10, "ok": 9, "alarm": 0, "fault": 1, "bypassed": 0}
+    assert zones.mask("fault") == 0b1 and zones.mask("alarm") == 0
+
+
+def test_zone_table_query_filters_and_pages(driver):
+    zones = driver.ZoneTable(count=10, subsystem_size=4)
+    for index in (1, 4, 5, 9):
+        zones.set_status(index, 1)
+    rows, matched, next_after = zones.query(status="alarm", limit=2)
+    assert [row["zone"] for row in rows] == [2, 5] and matched == 4 and next_after == 5
+    rows, _, next_after = zones.query(status="alarm", after=next_after, limit=2)
+    assert [row["zone"] for row in rows] == [6, 10] and next_after is None
+    rows, matched, _ = zones.query(status="ok", subsystem=2)
+    assert [row["zone"] for row in rows] == [7, 8] and matched == 2
+    assert rows[0] == {"zone": 7, "status": "ok", "bypassed": False, "subsystem": 2}
+
+
+@pytest.mark.parametrize("zone_id, index", [(1, 0), ("10", 9), (0, None), (11, None), ("x", None), (None, None)])
+def test_zone_ids_outside_the_table_are_refused(driver, zone_id, index):
+    assert driver.ZoneTable(count=10).index(zone_id) == index
+
+
+@pytest.fixture
+def server(driver):
+    httpd = driver.AlarmHostHTTPServer(("127.0.0.1", 0), driver.AlarmHostHTTPRequestHandler, workers=2)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(server, path, headers=None):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.getheader("ETag"), response.read()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("tag", ['{etag}', 'W/{etag}', '"other", W/{etag}'])
+def test_status_revalidates_with_strong_or_weak_etags(server, tag):
+    status, etag, _ = get(server, "/status")
+    assert status == 200
+    assert get(server, "/status", {"If-None-Match": tag.format(etag=etag)})[:2] == (304, etag)
+    assert get(server, "/status", {"If-None-Match": 'W/"other"'})[0] == 200
+
+
+def subscribe(device, last_event_id):
+    ours, theirs = socket.socketpair()
+    theirs.settimeout(5)
+    device.subscribe_events(ours, last_event_id)
+    with theirs:
+        received = theirs.recv(65536).decode()
+    return [line[4:] for line in received.splitlines() if line.startswith("id: ")], received
+
+
+def test_events_resume_only_within_the_same_run(driver):
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p")
+    for dust in range(1, 4):
+        device.update_sensors({"dust": dust * 10})
+    first = f"{device._boot}-1"
+    ids, _ = subscribe(device, first)
+    assert ids == [f"{device._boot}-2", f"{device._boot}-3"]
+    # Same version number, earlier run: the client gets a snapshot instead
+    for last_event_id in ("1-1", "1", None, "junk"):
+        ids, received = subscribe(device, last_event_id)
+        assert ids == [f"{device._boot}-3"] and "event: snapshot" in received
+
+
+def test_silent_alert_stream_is_reconnected(driver):
+    # Stand-in panel that sends the response head and one event, then goes quiet
+    listener = socket.create_server(("127.0.0.1", 0))
+    event = b'{"eventType": "zoneAlarm", "eventState": "active", "zoneNo": 1}'
+    held = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            held.append(conn)
+            conn.recv(4096)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/mixed; boundary=b\r\n\r\n"
+                         b"--b\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s\r\n"
+                         % (len(event), event))
+
+    threading.Thread(target=serve, daemon=True).start()
+    device = driver.HikvisionAlarmHostDevice("127.0.0.1", 0, "u", "p")
+    client = driver.AlertStreamClient(device, "127.0.0.1", listener.getsockname()[1], "/", "u", "p",
+                                      reconnect_delay=0.05, idle_timeout=0.2)
+    runner = threading.Thread(target=client.run, daemon=True)
+    runner.start()
+    try:
+        deadline = time.monotonic() + 5
+        while client.counters["connections"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert client.counters["connections"] >= 2
+        assert client.counters["applied"] >= 1
+    finally:
+        client.stop()
+        runner.join(5)
+        listener.close()
+        for conn in held:
+            conn.close()
+    assert not runner.is_alive()
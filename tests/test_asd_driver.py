@@ -0,0 +1,135 @@
+import http.client
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver("asd")
+
+
+def slow_parse(values):
+    return np.array([v.rstrip("Z") for v in values], dtype="datetime64[ms]").astype(np.int64)
+
+
+def test_fixed_form_timestamps_match_the_slow_parser(driver):
+    values = ["1970-01-01T00:00:00Z", "2000-02-29T23:59:59Z", "2024-06-10T12:00:01Z", "1969-12-31T23:59:59Z"]
+    assert driver.parse_timestamps(values).tolist() == slow_parse(values).tolist()
+
+
+def test_other_timestamp_forms_take_the_slow_path(driver):
+    values = ["2024-06-10T12:00:00.250Z", "2024-06-10T12:00:01Z"]
+    assert driver.parse_timestamps(values).tolist() == slow_parse(values).tolist()
+
+
+@pytest.mark.parametrize("value", [
+    "2024-06-10T12:00:00Zjunk",   # longer than the fixed form
+    "2024-0a-10T12:00:00Z",       # non-digit in a digit position
+    "2024-06-10T12:0:000Z",       # separator moved
+    "2024-13-10T12:00:00Z",       # month out of range
+    "2023-02-29T12:00:00Z",       # not a leap year
+    "2024-06-10T24:00:00Z",
+])
+def test_malformed_timestamps_are_rejected(driver, value):
+    with pytest.raises(ValueError):
+        driver.parse_timestamps(["2024-06-10T12:00:00Z", value])
+
+
+def test_rows_that_do_not_parse_are_left_out(driver):
+    timestamps, value1, value2 = driver.rows_to_columns([
+        ("2024-06-10T12:00:00Z", "1", "2"),
+        ("2024-06-10T25:00:00Z", "3", "4"),
+        ("2024-06-10T12:00:02Z", "n/a", "6"),
+        ("2024-06-10T12:00:03Z", "7", "8"),
+    ])
+    assert value1.tolist() == [1, 7]
+    assert value2.tolist() == [2, 8]
+    assert (timestamps[1] - timestamps[0]) == 3000
+
+
+def fake_device(lines):
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def run():
+        conn, _ = listener.accept()
+        with conn:
+            conn.recv(64)
+            conn.sendall(b"".join(line + b"\n" for line in lines))
+        listener.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+@pytest.fixture
+def server(driver):
+    httpd = driver.PooledHTTPServer(("127.0.0.1", 0), driver.DsaDeviceHTTPRequestHandler, workers=2)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(server, path, accept):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        conn.request("GET", path, headers={"Accept": accept})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_stream_survives_a_malformed_row(driver, server, monkeypatch):
+    monkeypatch.setattr(driver, "data_buffer", driver.ColumnRingBuffer(64))
+    monkeypatch.setattr(driver, "DEVICE_PORT", fake_device([
+        b"2024-06-10T12:00:00Z,1,2", b"2024-06-10T12:00:01Zjunk,3,4", b"2024-06-10T12:00:02Z,5,6", b"END"]))
+    status, body = get(server, "/data", "application/vnd.dsa.columns")
+    assert status == 200
+    count = int.from_bytes(body[:4], "little")
+    assert count == 2
+    assert body[-4:] == b"\0\0\0\0"
+
+
+def test_live_csv_passes_device_values_through(driver, server, monkeypatch):
+    monkeypatch.setattr(driver, "data_buffer", driver.ColumnRingBuffer(64))
+    monkeypatch.setattr(driver, "DEVICE_PORT", fake_device([
+        b"2024-06-10T12:00:00Z,1,2", b"2024-06-10T12:00:01Z,n/a,4.5", b"END"]))
+    status, body = get(server, "/data", "text/csv")
+    assert status == 200
+    assert body.decode().splitlines() == [
+        "timestamp,value1,value2", "2024-06-10T12:00:00Z,1,2", "2024-06-10T12:00:01Z,n/a,4.5"]
+    assert driver.data_buffer.size == 1
+
+
+def test_history_csv_uses_one_configured_unit(driver, server, monkeypatch):
+    buffer = driver.ColumnRingBuffer(64)
+    buffer.append(np.array([1718020800000, 1718020800250]), np.array([1, 2]), np.array([3, 4]))
+    monkeypatch.setattr(driver, "data_buffer", buffer)
+    status, body = get(server, "/data?from=1718020800000&to=1718020800001", "text/csv")
+    assert status == 200
+    assert body.decode().splitlines()[1] == "2024-06-10T12:00:00.000Z,1,3"
+    monkeypatch.setattr(driver, "CSV_TIMESTAMP_UNIT", "s")
+    status, body = get(server, "/data?from=0", "text/csv")
+    assert body.decode().splitlines()[1:] == ["2024-06-10T12:00:00Z,1,3", "2024-06-10T12:00:00Z,2,4"]
+
+
+def test_ring_buffer_wraps_and_drops_stale_points(driver):
+    buffer = driver.ColumnRingBuffer(4)
+    buffer.append(np.array([1, 2, 3]), np.array([10, 20, 30]), np.array([0, 0, 0]))
+    buffer.append(np.array([2, 4, 5, 6]), np.array([99, 40, 50, 60]), np.array([0, 0, 0, 0]))
+    timestamps, value1, _ = buffer.query()
+    assert timestamps.tolist() == [3, 4, 5, 6]
+    assert value1.tolist() == [30, 40, 50, 60]
+    assert buffer.query(4, 6)[1].tolist() == [40, 50]
+
+
+def test_rollup_buckets(driver):
+    timestamps = np.array([0, 500, 1000, 2500])
+    values = np.array([1, 3, 5, 7])
+    starts, mean = driver.rollup(timestamps, (values,), 1000, 'mean')
+    assert starts.tolist() == [0, 1000, 2000]
+    assert mean.tolist() == [2.0, 5.0, 7.0]
@@ -0,0 +1,98 @@
+import socket
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver("d'sa")
+
+
+def serve_device(replies_per_connection, reply=b'<response status="ok"/>'):
+    """Fake device: answers each "<command>" with `reply`, closing the
+    connection after `replies_per_connection` replies (None = never)."""
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def run():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            with conn:
+                sent = 0
+                pending = b""
+                while replies_per_connection is None or sent < replies_per_connection:
+                    data = conn.recv(4096)
+                    if not data:
+                        break
+                    pending += data
+                    while b"</command>" in pending and (replies_per_connection is None
+                                                         or sent < replies_per_connection):
+                        _, _, pending = pending.partition(b"</command>")
+                        conn.sendall(reply)
+                        sent += 1
+
+    threading.Thread(target=run, daemon=True).start()
+    return listener
+
+
+def test_scanner_finds_end_of_each_document(driver):
+    scanner = driver.XmlFrameScanner()
+    first = b'<?xml version="1.0"?><!-- c --><r a="x>y"><v/><w>1</w></r>'
+    buf = bytearray(first + b"<next/>")
+    assert scanner.scan(buf, len(buf)) == len(first)
+    assert scanner.scan(buf[len(first):], len(buf) - len(first)) == len(b"<next/>")
+
+
+def test_scanner_resumes_across_partial_reads(driver):
+    doc = b'<status><data_point name="t" value="1"/></status>'
+    scanner = driver.XmlFrameScanner()
+    for cut in (3, 12, 30):
+        assert scanner.scan(doc, cut) == -1
+    assert scanner.scan(doc, len(doc)) == len(doc)
+
+
+def test_scanner_skips_markup_inside_cdata_and_comments(driver):
+    doc = b'<r><![CDATA[</r><x>]]><!-- </r> --><v>a</v></r>'
+    assert driver.XmlFrameScanner().scan(doc, len(doc)) == len(doc)
+
+
+def test_scanner_waits_for_a_tag_split_across_reads(driver):
+    doc = b'<r><v a="/>"/></r>'
+    scanner = driver.XmlFrameScanner()
+    assert scanner.scan(doc, 8) == -1
+    assert scanner.pos == 3
+    assert scanner.scan(doc, len(doc)) == len(doc)
+
+
+def test_pipelined_batch_gets_every_reply(driver):
+    listener = serve_device(None)
+    try:
+        pool = driver.DeviceSessionPool("127.0.0.1", listener.getsockname()[1])
+        replies = pool.exchange([b"<command>a</command>", b"<command>b</command>"])
+        assert replies == ['<response status="ok"/>'] * 2
+        assert pool.stats["created"] == 1
+        pool.close()
+    finally:
+        listener.close()
+
+
+def test_device_closing_after_each_reply_reports_unanswered_commands(driver, monkeypatch):
+    listener = serve_device(1)
+    try:
+        monkeypatch.setattr(driver, "device_pool", driver.DeviceSessionPool("127.0.0.1", listener.getsockname()[1]))
+        replies = driver.send_device_commands(["<command>a</command>", "<command>b</command>", "<command>c</command>"])
+        assert replies == ['<response status="ok"/>', None, None]
+        driver.device_pool.close()
+    finally:
+        listener.close()
+
+
+def test_unreachable_device_fails_every_command(driver, monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    monkeypatch.setattr(driver, "device_pool", driver.DeviceSessionPool("127.0.0.1", port))
+    assert driver.send_device_commands(["<command>a</command>", "<command>b</command>"]) == [None, None]
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def state_path(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("dassad") / "dassad.state")
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver, state_path):
+    saved = os.environ.get("SHARED_STATE_PATH")
+    os.environ["SHARED_STATE_PATH"] = state_path
+    try:
+        return load_driver("dassad")
+    finally:
+        if saved is None:
+            del os.environ["SHARED_STATE_PATH"]
+        else:
+            os.environ["SHARED_STATE_PATH"] = saved
+
+
+@pytest.fixture
+def snapshot(driver, tmp_path):
+    snapshot = driver.SharedSnapshot(str(tmp_path / "test.state"), 4096)
+    yield snapshot
+    snapshot.close()
+
+
+def test_import_leaves_no_state_file(driver, state_path):
+    assert driver.shared_state is None
+    assert not os.path.exists(state_path)
+
+
+def test_publish_and_read(driver, snapshot, tmp_path):
+    assert snapshot.read() is None
+    with pytest.raises(RuntimeError):
+        snapshot.publish(b"{}")
+    assert snapshot.try_lead()
+    assert snapshot.publish(b'{"a": 1}') == 1
+    follower = driver.SharedSnapshot(snapshot.path, 4096)
+    try:
+        assert not follower.try_lead()
+        version, _, payload = follower.read()
+        assert (version, payload) == (1, b'{"a": 1}')
+        assert snapshot.publish(b'{"a": 2}') == 2
+        assert follower.read()[2] == b'{"a": 2}'
+    finally:
+        follower.close()
+
+
+def test_unchanged_payload_keeps_its_version(snapshot):
+    snapshot.try_lead()
+    assert snapshot.publish(b'{"a": 1}') == 1
+    _, published, _ = snapshot.read()
+    assert snapshot.publish(b'{"a": 1}') == 1
+    assert snapshot.read() == (1, published, b'{"a": 1}')
+    assert snapshot.publish(b'{"a": 3}') == 2
+
+
+def test_oversized_payload_is_refused(snapshot):
+    snapshot.try_lead()
+    with pytest.raises(ValueError):
+        snapshot.publish(b"x" * 4096)
+
+
+def test_torn_snapshot_is_not_returned(snapshot):
+    snapshot.try_lead()
+    snapshot.publish(b'{"a": 1}')
+    snapshot._map[snapshot.HEADER.size] ^= 0xFF
+    assert snapshot.read(attempts=3) is None
+    assert snapshot.retries == 3
+
+
+def test_lifespan_opens_and_closes_the_shared_state(driver, state_path):
+    async def serve():
+        async with driver.lifespan(driver.app):
+            assert os.path.exists(state_path)
+            for _ in range(100):
+                if driver.shared_state.read() is not None:
+                    break
+                await asyncio.sleep(0.01)
+            version, _, payload = driver.shared_state.read()
+            assert b'"device_name"' in payload
+            return version
+
+    assert asyncio.run(serve()) == 1
+    os.unlink(state_path)
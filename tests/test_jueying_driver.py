@@ -0,0 +1,185 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from conftest import DRIVERS_DIR
+
+JUEYING = "jueying_lite_3_pro,_intel_real_sense_d_435_i"
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver(JUEYING)
+
+
+def test_unknown_udp_codec_is_rejected_at_startup():
+    env = dict(os.environ, UDP_CODEC="msgpack")
+    result = subprocess.run([sys.executable, os.path.join(DRIVERS_DIR, JUEYING, "driver.py"), "bench", "1"],
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert "UDP_CODEC" in result.stderr
+
+
+def test_telemetry_published_to_the_bound_port_updates_the_cache(driver):
+    async def scenario():
+        cache = driver.TelemetryCache("status", 0)
+        cache.open("127.0.0.1")
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as robot:
+                robot.sendto(b'{"battery": 80}', cache.sock.getsockname())
+                assert await cache.wait_update(1.0)
+            return cache.value, cache.seq
+        finally:
+            cache.close()
+
+    assert asyncio.run(scenario()) == ({"battery": 80}, 1)
+
+
+def test_timed_out_waiters_are_released(driver):
+    async def scenario():
+        cache = driver.TelemetryCache("people", 0)
+        for _ in range(5):
+            assert not await cache.wait_update(0.01)
+        return len(cache._waiters)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_teleop_latest_twist_wins_across_sessions(driver, monkeypatch):
+    sent = []
+
+    async def capture(data):
+        sent.append(data)
+
+    monkeypatch.setattr(driver, "send_cmd_vel", capture)
+
+    async def scenario():
+        sender = driver.TeleopSender()
+        task = asyncio.ensure_future(sender.run())
+        first, second = driver.TeleopSession(1), driver.TeleopSession(2)
+        sender.offer(first, b"first")
+        sender.offer(second, b"second")
+        await asyncio.sleep(3 / driver.TELEOP_RATE_HZ)
+        await sender.release(first)  # not driving any more: no stop
+        await sender.release(second)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return sender
+
+    sender = asyncio.run(scenario())
+    assert sent == [b"second", driver.ZERO_TWIST_DATA]
+    assert sender.superseded == 1
+
+
+def test_zero_teleop_rate_is_rejected_at_startup():
+    env = dict(os.environ, TELEOP_RATE_HZ="0")
+    result = subprocess.run([sys.executable, os.path.join(DRIVERS_DIR, JUEYING, "driver.py"), "bench", "1"],
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert "TELEOP_RATE_HZ" in result.stderr
+
+
+@pytest.mark.parametrize("codec", ["json", "binary"])
+def test_twist_round_trip(driver, codec):
+    twist = {"linear": {"x": 0.5, "y": -1.0, "z": 0.0}, "angular": {"x": 0.0, "y": 0.0, "z": 0.25}}
+    assert driver.decode_twist(driver.encode_twist(twist, codec)) == twist
+
+
+def test_binary_twist_fills_missing_axes_with_zero(driver):
+    data = driver.encode_twist({"linear": {"x": 1}, "angular": {}}, "binary")
+    assert len(data) == driver.TWIST_STRUCT.size
+    assert driver.decode_twist(data) == {"linear": {"x": 1.0, "y": 0.0, "z": 0.0},
+                                         "angular": {"x": 0.0, "y": 0.0, "z": 0.0}}
+
+
+@pytest.mark.parametrize("codec", ["json", "binary"])
+def test_nav_round_trip(driver, codec):
+    nav = {"action": "goto", "params": {"x": 1.5, "y": -2, "big": 1 << 40, "tags": ["a", None, True, False],
+                                        "name": "dock é", "nested": {"k": []}}}
+    assert driver.decode_nav(driver.encode_nav(nav, codec)) == nav
+
+
+def test_binary_values_use_the_narrowest_integer(driver):
+    assert driver.encode_map(5) == bytes((driver.MSG_MAP,)) + b"b\x05"
+    assert len(driver.encode_map(1000)) == 1 + 1 + 8
+
+
+def test_telemetry_decodes_binary_json_and_garbage(driver):
+    value = {"battery": 80, "pose": [1.0, 2.0]}
+    assert driver.decode_telemetry(driver.encode_map(value)) == value
+    assert driver.decode_telemetry(b'{"battery": 80}') == {"battery": 80}
+    assert driver.decode_telemetry(b"\xffnot json") == {"raw": "not json"}
+
+
+def test_unencodable_values_are_rejected(driver):
+    with pytest.raises(TypeError):
+        driver.encode_nav({"action": "go", "params": {"when": object()}}, "binary")
+    with pytest.raises(ValueError):
+        driver.decode_nav(bytes((driver.MSG_NAV,)) + b"?")
+
+
+def feed_frame(driver, receiver, frame_id, value):
+    """Push every fragment of one frame filled with `value` through the receiver."""
+    payload = bytes([value, 0]) * (receiver.fragment_size // 2)
+    for index in range(receiver.fragment_count):
+        size = min(receiver.fragment_size, receiver.frame_bytes - index * receiver.fragment_size)
+        header = driver.DEPTH_HEADER.pack(frame_id, index, receiver.fragment_count)
+        receiver._packet[:len(header) + size] = header + payload[:size]
+        receiver._on_packet(len(header) + size)
+
+
+@pytest.fixture
+def depth(driver):
+    return driver.DepthFrameReceiver(width=8, height=4, fragment_size=16)
+
+
+def test_depth_frames_reassemble_and_stragglers_are_dropped(driver, depth):
+    feed_frame(driver, depth, 10, 1)
+    feed_frame(driver, depth, 11, 2)
+    feed_frame(driver, depth, 9, 3)
+    assert depth.frame_id == 11
+    assert int(depth.latest()[0, 0]) == 2
+    assert depth.late == depth.fragment_count
+
+
+def test_depth_resyncs_after_a_frame_counter_restart(driver, depth):
+    feed_frame(driver, depth, 40, 1)
+    for frame_id in range(3):
+        feed_frame(driver, depth, frame_id, 5)
+    assert depth.frame_id == 2
+    assert depth.resyncs == 1
+
+
+def test_depth_resyncs_at_once_on_a_large_jump_back(driver, depth):
+    feed_frame(driver, depth, 50000, 1)
+    feed_frame(driver, depth, 0, 7)
+    assert depth.frame_id == 0
+    assert int(depth.latest()[0, 0]) == 7
+
+
+@pytest.mark.parametrize("query", [{"min": "nan"}, {"max": "inf"}, {"min": "2", "max": "1"},
+                                   {"min": "-1"}, {"max_points": "-5"}])
+def test_depth_query_rejects_bad_ranges(driver, query):
+    with pytest.raises(ValueError):
+        driver.parse_depth_query(query)
+
+
+def test_clip_range_with_a_range_wider_than_the_sensor(driver):
+    import numpy as np
+    depth = np.array([[0, 10, 65535]], dtype="<u2")
+    assert driver.clip_range(depth, 0.001, 0.0, 1e30).tolist() == [[0, 10, 65535]]
+
+
+def test_people_delta_with_a_repeated_track_id(driver):
+    encoder = driver.PeopleDeltaEncoder(threshold=0.5)
+    event, payload = encoder.encode([{"id": 1, "x": 0, "y": 0}, {"id": 2, "x": 5, "y": 5}])
+    assert event == "snapshot"
+    frame = [{"id": 2, "x": 5, "y": 5}, {"id": 1, "x": 0, "y": 0}, {"id": 1, "x": 3, "y": 0}]
+    event, payload = encoder.encode(frame)
+    assert event == "delta"
+    assert payload == {"added": [], "moved": [{"id": 1, "x": 3, "y": 0}], "removed": []}
+    assert encoder.encode(frame) is None
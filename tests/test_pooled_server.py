@@ -0,0 +1,105 @@
+import http.client
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+POOLED_DRIVERS = ["Alarm Host Series", "asd", "asdads", "d'sa", "deesasd", "dsa", "sasdds", "t", "tes"]
+
+
+@pytest.fixture(params=POOLED_DRIVERS)
+def driver(request, load_driver):
+    return load_driver(request.param)
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def serve(driver):
+    servers = []
+
+    def start(handler, **kwargs):
+        server = driver.PooledHTTPServer(("127.0.0.1", 0), handler, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def recv_all(sock):
+    data = b""
+    while chunk := sock.recv(65536):
+        data += chunk
+    return data
+
+
+def test_rejected_client_reads_the_whole_503(serve):
+    server = serve(SlowHandler, workers=1, queue_size=1)
+    address = server.server_address
+    busy = socket.create_connection(address)
+    busy.sendall(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+    time.sleep(0.1)
+    queued = socket.create_connection(address)
+    time.sleep(0.1)
+    with busy, queued, socket.create_connection(address, timeout=5) as rejected:
+        # A request body the server never reads: closing on it unread would reset the connection
+        rejected.sendall(b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 4000000\r\n\r\n" + b"x" * 4000000)
+        time.sleep(0.1)
+        response = recv_all(rejected)
+    assert response.startswith(b"HTTP/1.1 503 ")
+    assert response.endswith(b'{"error": "Server busy, retry later"}')
+    assert server.stats()["rejected"] == 1
+
+
+def driver_handler(driver):
+    (handler,) = [value for value in vars(driver).values()
+                  if isinstance(value, type) and issubclass(value, BaseHTTPRequestHandler)
+                  and value.__module__ == driver.__name__]
+    return handler
+
+
+def get_metrics(conn):
+    conn.request("GET", "/metrics")
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def test_idle_keepalive_connections_are_capped(driver, serve):
+    server = serve(driver_handler(driver), workers=2, keepalive_idle=8)
+    assert server.keepalive_idle == 1
+    first = http.client.HTTPConnection(*server.server_address, timeout=5)
+    second = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        assert get_metrics(first).getheader("Connection") is None
+        # The only idle slot is taken, so the next client is not kept alive...
+        assert get_metrics(second).getheader("Connection") == "close"
+        # ...and a worker stays free for new connections
+        started = time.monotonic()
+        third = http.client.HTTPConnection(*server.server_address, timeout=5)
+        assert get_metrics(third).status == 200
+        assert time.monotonic() - started < 1
+        third.close()
+        # The kept-alive connection still works and keeps its slot
+        assert get_metrics(first).getheader("Connection") is None
+        assert server.stats()["idle_keepalive"] == 1
+    finally:
+        first.close()
+        second.close()
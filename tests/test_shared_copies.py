@@ -0,0 +1,30 @@
+import ast
+import glob
+import os
+
+import pytest
+
+from conftest import DRIVERS_DIR
+
+# The drivers are standalone scripts and cannot import a common module, so
+# these definitions are copied into each one and must stay identical
+SHARED = ["Metrics", "PooledHTTPServer", "run_prefork"]
+
+
+def copies(name):
+    found = {}
+    for path in sorted(glob.glob(os.path.join(DRIVERS_DIR, "*", "driver.py"))):
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        for node in ast.parse(source).body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)) and node.name == name:
+                found[os.path.basename(os.path.dirname(path))] = ast.get_source_segment(source, node)
+    return found
+
+
+@pytest.mark.parametrize("name", SHARED)
+def test_shared_definitions_are_identical(name):
+    found = copies(name)
+    assert len(found) > 1
+    reference = next(iter(found.values()))
+    assert [driver for driver, source in found.items() if source != reference] == []
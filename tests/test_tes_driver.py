@@ -0,0 +1,94 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver("tes")
+
+
+@pytest.fixture
+def short_timeout(driver, monkeypatch):
+    monkeypatch.setattr(driver, "ADAS_RECV_TIMEOUT", 0.3)
+
+
+def serve_reply(reply, keep_open=True):
+    """One-shot fake ADAS device: reads a request, writes `reply`, then keeps
+    the connection open (as a session-oriented device would) or closes it."""
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def run():
+        conn, _ = listener.accept()
+        with conn:
+            conn.recv(4096)
+            conn.sendall(reply)
+            if keep_open:
+                try:
+                    conn.recv(4096)  # until the client hangs up
+                except ConnectionResetError:
+                    pass
+        listener.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def client(driver, port, framing, delimiter=b"\n"):
+    return driver.AdasDeviceClient("127.0.0.1", port, framing=framing, delimiter=delimiter)
+
+
+def test_xml_reply_returns_without_waiting_for_close(driver, short_timeout):
+    port = serve_reply(b'<?xml version="1.0"?><data><v a="1"/></data>')
+    started = time.monotonic()
+    assert client(driver, port, "xml").get_data() == '<?xml version="1.0"?><data><v a="1"/></data>'
+    assert time.monotonic() - started < 0.2
+
+
+def test_malformed_xml_fails_fast(driver, short_timeout):
+    port = serve_reply(b"<data><v></data>")
+    started = time.monotonic()
+    with pytest.raises(driver.AdasProtocolError):
+        client(driver, port, "xml").get_data()
+    assert time.monotonic() - started < 0.2
+
+
+def test_xml_reply_cut_short_is_an_error(driver, short_timeout):
+    port = serve_reply(b"<data><v>1</v>", keep_open=False)
+    with pytest.raises(driver.AdasProtocolError):
+        client(driver, port, "xml").get_data()
+
+
+def test_length_prefixed_reply(driver, short_timeout):
+    port = serve_reply(struct.pack(">I", 7) + b"<ok/>\r\n" + b"trailing")
+    assert client(driver, port, "length").get_data() == "<ok/>\r\n"
+
+
+def test_truncated_length_prefixed_reply_is_an_error(driver, short_timeout):
+    port = serve_reply(struct.pack(">I", 100) + b"<partial", keep_open=False)
+    with pytest.raises(driver.AdasProtocolError):
+        client(driver, port, "length").get_data()
+
+
+def test_incomplete_framed_reply_times_out_as_an_error(driver, short_timeout):
+    port = serve_reply(struct.pack(">I", 100) + b"<partial")
+    with pytest.raises(driver.AdasProtocolError):
+        client(driver, port, "length").get_data()
+
+
+def test_delimited_reply_with_multibyte_delimiter(driver, short_timeout):
+    port = serve_reply(b"<ok/>\r\n\r\n<next/>")
+    assert client(driver, port, "delimiter", b"\r\n\r\n").get_data() == "<ok/>"
+
+
+def test_empty_delimiter_is_rejected(driver):
+    with pytest.raises(ValueError):
+        client(driver, 1, "delimiter", b"")
+
+
+def test_close_framing_keeps_read_until_close(driver, short_timeout):
+    port = serve_reply(b"anything at all", keep_open=False)
+    assert client(driver, port, "close").get_data() == "anything at all"
@@ -0,0 +1,104 @@
+import os
+import struct
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def driver(load_driver):
+    return load_driver("test_1")
+
+
+def test_import_leaves_the_journal_closed(driver):
+    assert driver._command_journal is None
+    assert os.path.isabs(driver.COMMAND_JOURNAL_DIR)
+
+
+def test_journal_replays_records_after_reopen(driver, tmp_path):
+    journal = driver.CommandJournal(str(tmp_path), segment_bytes=128, tail_size=2, fsync_interval=0)
+    for i in range(10):
+        assert journal.append({"n": i}) == i + 1
+    journal.close()
+    journal = driver.CommandJournal(str(tmp_path), segment_bytes=128, tail_size=2, fsync_interval=0)
+    try:
+        assert journal.stats()["records"] == 10
+        assert journal.stats()["segments"] > 1
+        page, has_more = journal.query(after_seq=3, limit=4)
+        assert [r["command"]["n"] for r in page] == [3, 4, 5, 6]
+        assert has_more
+        assert journal.append({"n": 10}) == 11
+    finally:
+        journal.close()
+
+
+def test_journal_truncates_a_torn_record(driver, tmp_path):
+    journal = driver.CommandJournal(str(tmp_path), fsync_interval=0)
+    journal.append({"n": 0})
+    journal.append({"n": 1})
+    journal.close()
+    (segment,) = tmp_path.iterdir()
+    with open(segment, "ab") as f:
+        f.write(struct.pack("<IQd", 100, 3, 0.0) + b"{")
+    journal = driver.CommandJournal(str(tmp_path), fsync_interval=0)
+    try:
+        page, _ = journal.query()
+        assert [r["seq"] for r in page] == [1, 2]
+        assert journal.append({"n": 2}) == 3
+    finally:
+        journal.close()
+
+
+def test_journal_retention_drops_whole_segments(driver, tmp_path):
+    journal = driver.CommandJournal(str(tmp_path), segment_bytes=64, max_records=3, fsync_interval=0)
+    try:
+        for i in range(10):
+            journal.append({"n": i})
+        page, _ = journal.query()
+        assert page[-1]["seq"] == 10
+        assert page[0]["seq"] > 1
+        assert journal.stats()["records"] == len(page)
+    finally:
+        journal.close()
+
+
+def test_store_pages_by_cursor_and_time(driver):
+    store = driver.TimeIndexedStore(max_points=100)
+    for minute in range(10):
+        store.append(minute, f"2024-06-01T12:{minute:02d}:00Z")
+    rows, matched, has_more = store.page(limit=3)
+    assert [r["value"] for r in rows] == [0, 1, 2] and matched == 10 and has_more
+    rows, _, _ = store.page(after_id=rows[-1]["id"], limit=3)
+    assert [r["value"] for r in rows] == [3, 4, 5]
+    start = driver.parse_timestamp("2024-06-01T12:04:00Z")
+    end = driver.parse_timestamp("2024-06-01T12:06:00Z")
+    rows, matched, has_more = store.page(start=start, end=end, limit=5)
+    assert [r["value"] for r in rows] == [4, 5] and matched == 2 and not has_more
+    assert rows[0]["timestamp"] == "2024-06-01T12:04:00Z"
+
+
+def test_store_keeps_timestamps_sorted_and_trims(driver):
+    store = driver.TimeIndexedStore(max_points=8)
+    store.append(1, "2024-06-01T12:00:00Z")
+    store.append(2, "2024-06-01T11:00:00Z")
+    rows, _, _ = store.page(limit=2)
+    assert rows[1]["timestamp"] == "2024-06-01T12:00:00Z"
+    store.extend(range(10**12, 10**12 + 20), range(20))
+    assert len(store) <= 9
+    assert store.page(limit=100)[0][-1]["value"] == 19
+
+
+def test_cursor_round_trip(driver):
+    assert driver.decode_cursor(driver.encode_cursor(12345)) == 12345
+    with pytest.raises(ValueError):
+        driver.decode_cursor("Ym9ndXM6MQ")  # "bogus:1"
+
+
+def test_commands_open_the_journal_on_first_use(driver, tmp_path, monkeypatch):
+    monkeypatch.setattr(driver, "COMMAND_JOURNAL_DIR", str(tmp_path / "journal"))
+    monkeypatch.setattr(driver, "_command_journal", None)
+    client = driver.app.test_client()
+    assert client.post("/cmd", json={"action": "on"}).status_code == 200
+    body = client.get("/commands").get_json()
+    assert [c["command"] for c in body["commands"]] == [{"action": "on"}]
+    driver._command_journal.close()
+    assert os.listdir(tmp_path / "journal")